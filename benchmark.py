@@ -0,0 +1,253 @@
+#
+# Throughput benchmarks of the analysis scripts, on synthetic trees from generate_hits.py.
+# For each data size, trees are generated, then each analysis script is run in its own process
+# in each of its modes (one pass, --streaming, --jobs, --incremental, --cache, ...), as it would
+# be run on real data, with --report. The time spent in each stage, and the entries read per
+# second, are taken from the instrumentation report of the script, with the wall time and peak
+# resident memory of the process. Results are saved as JSON, so that they can be compared with
+# those of an earlier benchmark to catch regressions.
+#
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import event_index
+import generate_hits
+import hit_cache
+import incremental
+import instrumentation
+
+
+# Analyses benchmarked, in the order run, and the script running each
+ANALYSES = ("delays", "single", "double")
+SCRIPTS = {"delays": "scint_coincidence_delays.py",
+           "single": "scint_straw_coincidence.py",
+           "double": "double_scint_straw_coincidence.py"}
+
+# Analyses reading only the first entries of each tree, whatever the size of the trees, so whose
+# throughput does not scale with it. These are reported apart from the others
+CAPPED_ANALYSES = {"single": "reads at most the first 100000 scint and 500000 straw entries"}
+
+# Modes each script is run in, in the order run, and the analyses of modes not applying to all
+MODES = ("default", "streaming", "jobs", "incremental", "cache", "rdataframe")
+MODE_ANALYSES = {"streaming": ("single", "double"), "rdataframe": ("delays",)}
+
+# Modes run by default
+DEFAULT_MODES = ["default", "streaming", "jobs", "incremental", "cache"]
+
+# Modes reading ROOT files only
+ROOT_ONLY_MODES = ("cache", "rdataframe")
+
+# Directories made by the scripts in the directory they are run in, removed before each case so
+# that every case starts from nothing stored
+STORE_DIRECTORIES = (incremental.PARTIALS_DIRECTORY, event_index.INDEX_DIRECTORY, hit_cache.CACHE_DIRECTORY)
+
+# Default numbers of events in each run of generated trees
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Default number of processes for --jobs mode
+DEFAULT_JOBS = 4
+
+# Fraction by which throughput may fall below that of baseline benchmark before it is reported
+DEFAULT_TOLERANCE = 0.2
+
+
+def getModeOptions(mode, nJobs):
+
+    # Returns options of analysis scripts for mode
+    if mode == "default":
+        return []
+    elif mode == "jobs":
+        return ["--jobs", str(nJobs)]
+    elif mode == "rdataframe":
+        return ["--backend", "rdataframe"]
+    return ["--" + mode]
+
+
+def hasCase(analysis, mode, inputFormat):
+
+    # Returns whether analysis is run in mode, for input of given format
+    if (mode in ROOT_ONLY_MODES) and (inputFormat != "root"):
+        return False
+    return (mode not in MODE_ANALYSES) or (analysis in MODE_ANALYSES[mode])
+
+
+def runScript(command, workDirectory):
+
+    # Runs command in work directory, returning its wall time and peak resident memory, in MB
+    # (Linux gives it in kB)
+    startTime = time.time()
+    with open(os.devnull, "w") as output:
+        process = subprocess.Popen(command, cwd=workDirectory, stdout=output)
+
+        # Wait for process directly, to get its resource usage
+        pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = status
+
+    if status != 0:
+        raise RuntimeError("Benchmark command failed: " + " ".join(command))
+    return time.time() - startTime, usage.ru_maxrss / 1024.0
+
+
+def runCase(analysis, mode, inputName, workDirectory, nJobs, render):
+
+    # Runs script of analysis on input in a new process, in work directory, in given mode.
+    # Returns results for benchmark: time, entries read, and entries per second of each stage,
+    # from the report of the script; entries read from both trees, and entries per second over
+    # the run of the script; and wall time of the process (including start up) and its peak
+    # resident memory, and that of its pool processes
+    for directoryName in STORE_DIRECTORIES:
+        path = os.path.join(workDirectory, directoryName)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    scriptName = os.path.join(os.path.dirname(os.path.abspath(__file__)), SCRIPTS[analysis])
+    reportName = os.path.join(workDirectory, "%s_%s_report.json" % (analysis, mode))
+    command = [sys.executable, scriptName, "--input", inputName, "--report", reportName] + getModeOptions(mode, nJobs)
+    if not render:
+        command.append("--no-render")
+
+    # Hit cache is built by a first run, so the run timed reads the cache as later runs would
+    if mode == "cache":
+        runScript(command, workDirectory)
+
+    wallTime, peakMemory = runScript(command, workDirectory)
+    with open(reportName) as reportFile:
+        report = json.load(reportFile)
+
+    stages = [(stage["name"], stage["seconds"], stage["entriesPerSecond"]) for stage in report["stages"]]
+    entries = sum(stage["entries"] for stage in report["stages"]
+                  if stage["name"] in (instrumentation.SCINT_READ, instrumentation.STRAW_READ))
+
+    return {"script": SCRIPTS[analysis], "arguments": report["arguments"], "stages": stages, "entries": entries,
+            "entriesPerSecond": entries / report["wallTime"] if report["wallTime"] > 0 else None,
+            "scriptWallTime": report["wallTime"], "wallTime": wallTime, "peakMemory": peakMemory,
+            "peakChildMemory": report["peakChildMemory"], "capped": analysis in CAPPED_ANALYSES}
+
+
+def compareResults(results, baseline, tolerance):
+
+    # Returns list of descriptions of cases whose throughput fell by more than tolerance from
+    # the same case in baseline results
+    baselineCases = dict(((case["analysis"], case.get("mode"), case["eventsPerRun"]), case) for case in baseline["cases"])
+
+    regressions = []
+    for case in results["cases"]:
+        before = baselineCases.get((case["analysis"], case["mode"], case["eventsPerRun"]))
+        if (before is None) or (not before["entriesPerSecond"]) or (not case["entriesPerSecond"]):
+            continue
+        if case["entriesPerSecond"] < before["entriesPerSecond"] * (1 - tolerance):
+            regressions.append("%s analysis, %s mode, %d events per run: %.0f entries/s, was %.0f"
+                               % (case["analysis"], case["mode"], case["eventsPerRun"], case["entriesPerSecond"],
+                                  before["entriesPerSecond"]))
+
+    return regressions
+
+
+def printCases(cases):
+
+    # Prints table of cases, one line for each, with the time of each stage, and its entries per
+    # second for stages reading entries
+    print "%-8s %-11s %10s %10s %12s %9s %9s  %s" % ("Analysis", "Mode", "Events/run", "Entries", "Entries/s",
+                                                    "Wall (s)", "Peak (MB)", "Stages (s)")
+    for case in cases:
+        stages = " ".join("%s=%.3f" % (name, seconds) + (" (%.0f/s)" % rate if rate else "")
+                          for name, seconds, rate in case["stages"])
+        print "%-8s %-11s %10d %10d %12.0f %9.2f %9.1f  %s" % (case["analysis"], case["mode"], case["eventsPerRun"],
+                                                             case["entries"], case["entriesPerSecond"] or 0,
+                                                             case["wallTime"], max(case["peakMemory"], case["peakChildMemory"]),
+                                                             stages)
+
+
+def printResults(results):
+
+    # Prints table of results, with analyses whose throughput does not scale with the size of the
+    # trees apart from the others
+    print ""
+    printCases([case for case in results["cases"] if not case["capped"]])
+
+    for analysis, description in sorted(CAPPED_ANALYSES.items()):
+        cases = [case for case in results["cases"] if case["analysis"] == analysis]
+        if len(cases) > 0:
+            print ""
+            print "%s analysis %s, so does not scale with size:" % (analysis.capitalize(), description)
+            printCases(cases)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark analysis scripts on synthetic trees of several sizes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="numbers of events in each run of generated trees")
+    parser.add_argument("--runs", type=int, default=3, help="number of runs in generated trees")
+    parser.add_argument("--analyses", nargs="+", choices=ANALYSES, default=list(ANALYSES), help="analyses to run")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=DEFAULT_MODES,
+                        help="modes to run each analysis script in (cache and rdataframe need ROOT files)")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="number of processes for jobs mode")
+    parser.add_argument("--format", choices=["root", "columns"], default="root",
+                        help="read generated trees from ROOT file, or from directory of columns")
+    parser.add_argument("--render", action="store_true", help="include drawing of plots")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file to save results in")
+    parser.add_argument("--baseline", help="JSON file of earlier results, to report cases which have become slower")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction by which throughput may fall below baseline before it is reported")
+    parser.add_argument("--work-directory", help="directory for generated trees and outputs (temporary if not given)")
+    args = parser.parse_args()
+
+    workDirectory = os.path.abspath(args.work_directory or tempfile.mkdtemp(prefix="benchmark-"))
+    if not os.path.isdir(workDirectory):
+        os.makedirs(workDirectory)
+
+    results = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "format": args.format, "runs": args.runs,
+               "jobs": args.jobs, "render": args.render, "cases": []}
+    try:
+        for size in args.sizes:
+
+            inputName = os.path.join(workDirectory, "hits_%d" % size)
+            if args.format == "root":
+                inputName += ".root"
+
+            print "Generating %d runs of %d events" % (args.runs, size)
+            generate_hits.generate(inputName, args.format, runs=args.runs, eventsPerRun=size)
+
+            for analysis in args.analyses:
+                for mode in MODES:
+
+                    if (mode not in args.modes) or not hasCase(analysis, mode, args.format):
+                        continue
+
+                    print "Running %s analysis, %s mode" % (analysis, mode)
+                    case = runCase(analysis, mode, inputName, workDirectory, args.jobs, args.render)
+                    case.update({"analysis": analysis, "mode": mode, "eventsPerRun": size})
+                    results["cases"].append(case)
+
+    finally:
+        if not args.work_directory:
+            shutil.rmtree(workDirectory)
+
+    printResults(results)
+    with open(args.output, "w") as outputFile:
+        json.dump(results, outputFile, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            regressions = compareResults(results, json.load(baselineFile), args.tolerance)
+
+        print ""
+        for regression in regressions:
+            print "Regression: " + regression
+        if len(regressions) > 0:
+            return 1
+        print "No regressions against " + args.baseline
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
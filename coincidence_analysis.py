@@ -0,0 +1,177 @@
+#
+# Steps of the straw coincidence analysis shared by scint_straw_coincidence.py,
+# double_scint_straw_coincidence.py, double_single_straw_coincidence.py and the parallel runner:
+# finding strikes in the scintillator tree, matching straw hits to them, and filling histograms.
+# Several analyses, with different kinds of strike, can share a single read of each tree.
+#
+
+import coincidence_engine
+import hit_reader
+import instrumentation
+from coincidence_histograms import CoincidenceHistograms
+from scint_strikes import ScintStrikeCollection
+
+
+# Time window for hits on two scintillators to count as one strike, in ns
+DOUBLE_STRIKE_WINDOW = 10
+
+
+class SingleStrikeFinder:
+
+    # Class finding strikes from every scintillator hit
+
+    @instrumentation.timed(instrumentation.STRIKE_BUILD)
+    def process(self, hits):
+
+        # Every scintillator hit is a strike. Returns run number, event number, hit time and wire
+        # number of each strike in chunk of hits
+        return hits.run, hits.event, hits.hitTime, hits.wire
+
+    # Returns strikes left at end of tree, of which there are none
+    def finish(self):
+        return coincidence_engine.noStrikes()
+
+
+def makeStrikeFinder(doubleScint, nWires=None, windowTime=DOUBLE_STRIKE_WINDOW):
+
+    # Returns finder of strikes in chunks of hits. If doubleScint, strikes are found from hits on
+    # several scintillators within the window time: on at least nWires distinct scintillators, or
+    # if nWires is None, on both scintillators in consecutive hits. If not, every hit is a strike
+    if not doubleScint:
+        return SingleStrikeFinder()
+    elif nWires is None:
+        return coincidence_engine.AdjacentStrikeFinder(windowTime)
+    else:
+        return coincidence_engine.CoincidentStrikeFinder(nWires, windowTime)
+
+
+class CoincidenceAnalysis:
+
+    # Class for one kind of strike matched against straw hits: its strike finder, its histograms,
+    # and the last entries of each tree it uses
+
+    def __init__(self, doubleScint, cutTimes, tag="", scintLastEntry=None, strawLastEntry=None, nWires=None,
+                 windowTime=DOUBLE_STRIKE_WINDOW, backgroundShifts=()):
+
+        # Get strike finder (see makeStrikeFinder), and histograms for each cut time (named with
+        # tag, to keep them apart from other analyses), with random background from off-time
+        # windows at each of the background shifts, if any
+        self.strikeFinder = makeStrikeFinder(doubleScint, nWires, windowTime)
+        self.coincidenceHistograms = CoincidenceHistograms(cutTimes, tag, backgroundShifts)
+
+        # Entries of scintillator and straw trees from these on are not used (None for all entries)
+        self.scintLastEntry = scintLastEntry
+        self.strawLastEntry = strawLastEntry
+
+
+def makeAnalyses(analysisArgs):
+
+    # Returns CoincidenceAnalysis for each of list of arguments. Analyses of double scintillator
+    # strikes from consecutive hits, reading the same scintillator entries, share one search for
+    # strikes with the longest of their window times, each keeping the strikes within its own
+    # window time, so a list of window times costs one search
+    analyses = [CoincidenceAnalysis(*arguments) for arguments in analysisArgs]
+
+    groups = dict()
+    for analysis in analyses:
+        if isinstance(analysis.strikeFinder, coincidence_engine.AdjacentStrikeFinder):
+            groups.setdefault(analysis.scintLastEntry, []).append(analysis)
+
+    for group in groups.values():
+        if len(group) > 1:
+            pairSearch = coincidence_engine.SharedPairSearch(max(analysis.strikeFinder.windowTime for analysis in group))
+            for analysis in group:
+                analysis.strikeFinder = coincidence_engine.WindowStrikeFinder(pairSearch, analysis.strikeFinder.windowTime)
+
+    return analyses
+
+
+def readLimit(lastEntries):
+
+    # Returns last entry of a tree to read for analyses using trees up to given last entries
+    # (None for all entries)
+    if None in lastEntries:
+        return None
+    return max(lastEntries)
+
+
+@instrumentation.timed(instrumentation.STRAW_MATCH)
+def matchStrikes(scintStrikeCollection, strawMatcher, cutTimes):
+
+    # Find range of sorted straw hits after each scintillator hit time, and before each cut time,
+    # and keep these as clusters for each strike in collection. Straws are matched once, for all
+    # cut times
+    strikeRuns, strikeEvents, strikeHitTimes = scintStrikeCollection.getArrays()
+
+    strawHits = strawMatcher.getStrawHits()
+    scintStrikeCollection.setStrawHits(strawHits.hitTime, strawHits.wire)
+    strawFirst, strawLasts = strawMatcher.matchCuts(strikeRuns, strikeEvents, strikeHitTimes, cutTimes)
+    for cutTime in cutTimes:
+        scintStrikeCollection.setStrawClusters(cutTime, strawFirst, strawLasts[cutTime])
+
+
+def analyse(scintChunks, strawChunks, analyses, streaming=False):
+
+    # Generator finding strikes in chunks of scintillator tree, matching chunks of straw tree to
+    # them, and filling coincidence histograms, for each of a list of CoincidenceAnalysis. Each
+    # tree is read once for all analyses. Gives each scintillator chunk once it is read.
+    # If streaming, each event is filled once read from both trees (trees must be ordered by run
+    # and event); if not, all strikes and straw hits are read, then matched
+    if streaming:
+        streams = [(analysis.strikeFinder,
+                    coincidence_engine.StreamingMatcher(analysis.coincidenceHistograms.cutTimes,
+                                                        analysis.coincidenceHistograms.fill,
+                                                        analysis.coincidenceHistograms.backgroundShifts,
+                                                        analysis.coincidenceHistograms.fillBackground),
+                    analysis.scintLastEntry, analysis.strawLastEntry) for analysis in analyses]
+        for hits in coincidence_engine.streamCoincidences(scintChunks, strawChunks, streams):
+            yield hits
+        return
+
+    # Create collection of scintillator strikes for each analysis, and add strikes found in each
+    # chunk
+    scintStrikeCollections = [ScintStrikeCollection() for analysis in analyses]
+    for hits in scintChunks:
+        for analysis, scintStrikeCollection in zip(analyses, scintStrikeCollections):
+            analysisHits = hits.limit(analysis.scintLastEntry)
+            if len(analysisHits) > 0:
+                scintStrikeCollection.addStrikes(*analysis.strikeFinder.process(analysisHits))
+        yield hits
+
+    # Add strikes left in each strike finder at end of tree
+    for analysis, scintStrikeCollection in zip(analyses, scintStrikeCollections):
+        scintStrikeCollection.addStrikes(*analysis.strikeFinder.finish())
+
+    # Read all straw hits (if none, strikes are still matched, so every strike is counted), and
+    # sort them by run, event and hit time once for all analyses
+    strawBlocks = list(strawChunks)
+    with instrumentation.stage(instrumentation.STRAW_MATCH):
+        strawHits = hit_reader.HitArrays.concatenate(strawBlocks)
+        order = coincidence_engine.sortOrder(strawHits)
+
+    # Match straw hits to strikes for each analysis. Analyses using the same straw entries share
+    # one matcher; those using fewer take the sorted hits from their entries, which stay sorted
+    strawMatchers = dict()
+    for analysis, scintStrikeCollection in zip(analyses, scintStrikeCollections):
+
+        if analysis.strawLastEntry not in strawMatchers:
+            with instrumentation.stage(instrumentation.STRAW_MATCH):
+                if (analysis.strawLastEntry is None) or (analysis.strawLastEntry >= strawHits.firstEntry + len(strawHits)):
+                    analysisOrder = order
+                else:
+                    analysisOrder = order[order < analysis.strawLastEntry - strawHits.firstEntry]
+                strawMatchers[analysis.strawLastEntry] = coincidence_engine.StrawMatcher(strawHits.take(analysisOrder))
+
+        matchStrikes(scintStrikeCollection, strawMatchers[analysis.strawLastEntry],
+                     analysis.coincidenceHistograms.cutTimes)
+
+        # Fill histograms from clusters
+        analysis.coincidenceHistograms.fillFromCollection(scintStrikeCollection)
+
+        # Fill background histograms from off-time windows of strikes
+        coincidenceHistograms = analysis.coincidenceHistograms
+        if len(coincidenceHistograms.backgroundShifts) > 0:
+            strikeRuns, strikeEvents, strikeHitTimes = scintStrikeCollection.getArrays()
+            coincidence_engine.fillBackground(strawMatchers[analysis.strawLastEntry], strikeRuns, strikeEvents,
+                                              strikeHitTimes, coincidenceHistograms.cutTimes,
+                                              coincidenceHistograms.backgroundShifts, coincidenceHistograms.fillBackground)
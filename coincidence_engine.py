@@ -0,0 +1,596 @@
+#
+# Sort-merge engine matching straw hits to scintillator strikes.
+# Straw hits are sorted by run, event and hit time, so the straw hits following a strike within a
+# delay cut form one contiguous range of the sorted hits. The ends of each range are found by
+# binary search, rather than by comparing every straw hit in an event with every strike.
+#
+
+import numpy
+
+import instrumentation
+from hit_reader import HitArrays
+
+
+# Key greater than that of any run and event
+LAST_KEY = numpy.iinfo(numpy.int64).max
+
+
+def eventKey(run, event):
+
+    # Returns single integer key for run number and event number, ordered by run then event
+    return (run << 32) | event
+
+
+def eventKeys(run, event):
+
+    # Returns single integer key for each run and event number pair, ordered by run then event
+    return (numpy.asarray(run, dtype=numpy.int64) << 32) | numpy.asarray(event, dtype=numpy.int64)
+
+
+class OrderError(Exception):
+    pass
+
+
+def checkOrder(chunks, treeName, previousKey=-1):
+
+    # Generator giving chunks of hits of tree in turn, raising OrderError once the run and event
+    # keys of the entries go down, for readers relying on the tree being ordered by run and
+    # event. PreviousKey is the key of the entry before the first chunk, if any
+    for hits in chunks:
+
+        if len(hits) > 0:
+            keys = eventKeys(hits.run, hits.event)
+            if (keys[0] < previousKey) or bool((keys[1:] < keys[:-1]).any()):
+                raise OrderError(treeName + " is not ordered by run and event. Read it from the hit cache (--cache, "
+                                 "see hit_cache.py), which holds it sorted, or without --streaming or --jobs")
+            previousKey = keys[-1]
+
+        yield hits
+
+
+def sortOrder(hits):
+
+    # Returns index array putting hits in order of run, event, then hit time. Sort is stable, so
+    # hits with equal values keep their order in the tree
+    return numpy.lexsort((hits.hitTime, hits.event, hits.run))
+
+
+def sortHits(hits):
+
+    # Returns hits sorted by run, event, then hit time
+    return hits.take(sortOrder(hits))
+
+
+def searchSortedRanges(values, lo, hi, targets, side):
+
+    # Binary search of values[lo:hi] for each target, where each range of values is sorted.
+    # As numpy.searchsorted, with side "left" returns first index with value >= target, and with
+    # side "right" returns first index with value > target
+    lo = numpy.array(lo, dtype=numpy.int64)
+    hi = numpy.array(hi, dtype=numpy.int64)
+
+    active = numpy.flatnonzero(lo < hi)
+    while len(active) > 0:
+
+        mid = (lo[active] + hi[active]) // 2
+
+        # Move lower end above mid for targets beyond value at mid, else move upper end to mid
+        if side == "left":
+            above = values[mid] < targets[active]
+        else:
+            above = values[mid] <= targets[active]
+
+        lo[active[above]] = mid[above] + 1
+        hi[active[~above]] = mid[~above]
+
+        active = active[lo[active] < hi[active]]
+
+    return lo
+
+
+def expandRanges(first, counts):
+
+    # Returns index of every element in ranges starting at first, of given lengths, and index of
+    # range each element belongs to
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+    rangeIndex = numpy.repeat(numpy.arange(len(counts)), counts)
+
+    # Position of each element within its range
+    rangeStarts = numpy.cumsum(counts) - counts
+    positions = numpy.arange(len(rangeIndex)) - rangeStarts[rangeIndex]
+
+    return numpy.asarray(first, dtype=numpy.int64)[rangeIndex] + positions, rangeIndex
+
+
+class StrawMatcher:
+
+    # Class for finding straw hits following scintillator strikes
+
+    def __init__(self, strawHits):
+
+        # Get straw hits, which must be sorted by run, event and hit time, and key for event of
+        # each straw hit
+        self.strawHits = strawHits
+        self.strawKeys = eventKeys(strawHits.run, strawHits.event)
+
+    # Returns sorted straw hits
+    def getStrawHits(self):
+        return self.strawHits
+
+    def findEvents(self, runs, events):
+
+        # Returns first and last (exclusive) index of straw hits in each given run and event
+        keys = eventKeys(runs, events)
+        return (numpy.searchsorted(self.strawKeys, keys, side="left"),
+                numpy.searchsorted(self.strawKeys, keys, side="right"))
+
+    def match(self, runs, events, hitTimes, cutTime):
+
+        # Returns first and last (exclusive) index of straw hits for each strike, with straw hit
+        # time after scintillator hit time, and before scintillator hit time plus cut time
+        hitTimes = numpy.asarray(hitTimes)
+        eventFirst, eventLast = self.findEvents(runs, events)
+
+        first = searchSortedRanges(self.strawHits.hitTime, eventFirst, eventLast, hitTimes, "right")
+        last = searchSortedRanges(self.strawHits.hitTime, first, eventLast, hitTimes + cutTime, "left")
+
+        return first, last
+
+    @instrumentation.timed(instrumentation.STRAW_MATCH)
+    def matchCuts(self, runs, events, hitTimes, cutTimes):
+
+        # Returns first index of straw hits for each strike, and dictionary of last (exclusive)
+        # index for each strike for each cut time. Straws are found once for the longest cut, and
+        # each cut then only searches within the straws found for the next longer cut
+        cutTimes = sorted(cutTimes, reverse=True)
+        hitTimes = numpy.asarray(hitTimes)
+
+        first, last = self.match(runs, events, hitTimes, cutTimes[0])
+        lasts = {cutTimes[0]: last}
+
+        for cutTime in cutTimes[1:]:
+            last = searchSortedRanges(self.strawHits.hitTime, first, last, hitTimes + cutTime, "left")
+            lasts[cutTime] = last
+
+        return first, lasts
+
+    @instrumentation.timed(instrumentation.STRAW_MATCH)
+    def matchShifts(self, runs, events, hitTimes, cutTimes, shifts):
+
+        # Returns first and last (exclusive) index of straw hits in off-time window of each strike
+        # for each shift, for random background: straw hit time after scintillator hit time minus
+        # shift minus cut time, and before scintillator hit time minus shift. Windows are ordered
+        # by shift, then by strike. Gives dictionary of first index for each cut time, last index,
+        # and dictionary of start time of each window for each cut time. Windows for all shifts
+        # are searched together, and the end of each window is found once for all cut times
+        hitTimes = numpy.asarray(hitTimes)
+        nShifts = len(shifts)
+        eventFirst, eventLast = self.findEvents(runs, events)
+        eventFirst = numpy.tile(eventFirst, nShifts)
+        eventLast = numpy.tile(eventLast, nShifts)
+
+        windowEnds = (hitTimes[numpy.newaxis, :] - numpy.asarray(shifts, dtype=numpy.float64)[:, numpy.newaxis]).ravel()
+        last = searchSortedRanges(self.strawHits.hitTime, eventFirst, eventLast, windowEnds, "left")
+
+        # Each cut only searches within the straws found for the next longer cut
+        firsts = dict()
+        starts = dict()
+        first = eventFirst
+        for cutTime in sorted(cutTimes, reverse=True):
+            starts[cutTime] = windowEnds - cutTime
+            first = searchSortedRanges(self.strawHits.hitTime, first, last, starts[cutTime], "right")
+            firsts[cutTime] = first
+
+        return firsts, last, starts
+
+
+def strawDelays(strawHits, first, last, strikeHitTimes):
+
+    # Returns number of straw hits for each strike, from first and last (exclusive) index of its
+    # straw hits, and delay time and wire of each straw hit after its strike, in order of strike
+    counts = last - first
+    strawIndex, strikeIndex = expandRanges(first, counts)
+    return counts, strawHits.hitTime[strawIndex] - strikeHitTimes[strikeIndex], strawHits.wire[strawIndex]
+
+
+def fillBackground(matcher, runs, events, hitTimes, cutTimes, shifts, fill):
+
+    # Matches straw hits in off-time windows of strikes for each shift (see
+    # StrawMatcher.matchShifts), and calls fill(cutTime, strawCounts, strawDelays) for each cut
+    # time with those of all shifts together. Delays are from the start of each window
+    firsts, last, starts = matcher.matchShifts(runs, events, hitTimes, cutTimes, shifts)
+    for cutTime in cutTimes:
+        strawCounts, delays, wires = strawDelays(matcher.getStrawHits(), firsts[cutTime], last, starts[cutTime])
+        fill(cutTime, strawCounts, delays)
+
+
+def noStrikes():
+
+    # Returns run number, event number, hit time and wire number arrays holding no strikes
+    return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64),
+            numpy.zeros(0, dtype=numpy.float64), numpy.zeros(0, dtype=numpy.int64))
+
+
+class AdjacentStrikeFinder:
+
+    # Class finding strikes of two scintillators from consecutive hits in the scintillator tree:
+    # a hit on a different wire to the hit before it, in the same event and run, and less than
+    # the window time after it. Strike time is the mean of the two hit times. Follows the tree
+    # chunk by chunk
+
+    def __init__(self, windowTime=10):
+
+        self.windowTime = windowTime
+
+        # Values for entry before first entry in tree
+        self.previousEvent = 0
+        self.previousRun = 0
+        self.previousWire = 1000
+        self.previousHitTime = 0
+
+    def process(self, hits):
+
+        # Returns run number, event number, hit time and wire number (of second hit) of each
+        # strike in this chunk of hits
+        runs, events, hitTimes, wires, separations = self.findPairs(hits)
+        return runs, events, hitTimes, wires
+
+    @instrumentation.timed(instrumentation.STRIKE_BUILD)
+    def findPairs(self, hits):
+
+        # Returns run number, event number, hit time, wire number (of second hit) and time between
+        # the two hits of each strike in this chunk of hits
+        if len(hits) == 0:
+            return hits.run, hits.event, hits.hitTime, hits.wire, hits.hitTime
+
+        # Values for entry before each entry, carried over from last chunk for first entry
+        previousEvent = numpy.concatenate(([self.previousEvent], hits.event[:-1]))
+        previousRun = numpy.concatenate(([self.previousRun], hits.run[:-1]))
+        previousWire = numpy.concatenate(([self.previousWire], hits.wire[:-1]))
+        previousHitTime = numpy.concatenate(([self.previousHitTime], hits.hitTime[:-1])).astype(hits.hitTime.dtype)
+
+        isStrike = ((previousEvent == hits.event) & (previousRun == hits.run) & (previousWire != hits.wire)
+                    & ((hits.hitTime - previousHitTime) < self.windowTime))
+
+        self.previousEvent = hits.event[-1]
+        self.previousRun = hits.run[-1]
+        self.previousWire = hits.wire[-1]
+        self.previousHitTime = hits.hitTime[-1]
+
+        return (hits.run[isStrike], hits.event[isStrike],
+                (previousHitTime[isStrike] + hits.hitTime[isStrike]) / 2, hits.wire[isStrike],
+                hits.hitTime[isStrike] - previousHitTime[isStrike])
+
+    # Returns strikes left at end of tree, of which there are none, as each strike is found from
+    # the hit completing it
+    def finish(self):
+        return noStrikes()
+
+
+class SharedPairSearch:
+
+    # Search for strikes of two scintillators from consecutive hits, as AdjacentStrikeFinder with
+    # the longest of several window times, shared by a WindowStrikeFinder for each window time.
+    # Each chunk is searched once, whichever finder asks first, and the strikes found with the
+    # time between their two hits are given to every finder
+
+    def __init__(self, windowTime):
+
+        self.pairFinder = AdjacentStrikeFinder(windowTime)
+
+        # First entry and length of last chunk searched, and strikes found in it
+        self.chunk = None
+        self.pairs = None
+
+    def process(self, hits):
+
+        # Returns run number, event number, hit time, wire number and time between hits of each
+        # strike in chunk of hits, searching it if not already searched
+        chunk = (hits.firstEntry, len(hits))
+        if chunk != self.chunk:
+            self.chunk = chunk
+            self.pairs = self.pairFinder.findPairs(hits)
+        return self.pairs
+
+
+class WindowStrikeFinder:
+
+    # Class finding strikes of two scintillators from consecutive hits, as AdjacentStrikeFinder,
+    # from the strikes of a shared search with a window time at least as long: those whose hits
+    # are less than this window time apart. Strikes for any number of window times come from one
+    # search of each chunk
+
+    def __init__(self, pairSearch, windowTime):
+        self.pairSearch = pairSearch
+        self.windowTime = windowTime
+
+    @instrumentation.timed(instrumentation.STRIKE_BUILD)
+    def process(self, hits):
+
+        # Returns run number, event number, hit time and wire number of each strike in this chunk
+        # of hits
+        runs, events, hitTimes, wires, separations = self.pairSearch.process(hits)
+        inWindow = separations < self.windowTime
+        return runs[inWindow], events[inWindow], hitTimes[inWindow], wires[inWindow]
+
+    # Returns strikes left at end of tree, of which there are none
+    def finish(self):
+        return noStrikes()
+
+
+class CoincidentStrikeFinder:
+
+    # Class finding strikes from hits on at least nWires distinct scintillator wires within the
+    # window time, in the same run and event. The hits of each event are taken in order of hit
+    # time, and each strike is the first window (from a hit, up to but not including the window
+    # time after it) holding hits on enough wires; the next strike can only start after the
+    # hits of that window. Strike time is the mean time of the hits in its window, and its wire
+    # is that of its first hit.
+    # Hits of each event must be together in the tree. The last event of each chunk is held until
+    # the next chunk, as more of its hits may follow, so finish() must be called after the last
+    # chunk
+
+    def __init__(self, nWires=2, windowTime=10):
+
+        self.nWires = nWires
+        self.windowTime = windowTime
+
+        # Hits of last event of last chunk, not yet searched
+        self.heldHits = None
+
+    @instrumentation.timed(instrumentation.STRIKE_BUILD)
+    def process(self, hits):
+
+        # Returns run number, event number, hit time and wire number of each strike in events
+        # completed by this chunk of hits
+        if self.heldHits is not None:
+            hits = hits.concatenate([self.heldHits, hits])
+            self.heldHits = None
+
+        if len(hits) == 0:
+            return noStrikes()
+
+        # Hold hits from start of last event
+        keys = eventKeys(hits.run, hits.event)
+        otherEvents = numpy.flatnonzero(keys != keys[-1])
+        lastEventStart = otherEvents[-1] + 1 if len(otherEvents) > 0 else 0
+        self.heldHits = hits.slice(lastEventStart, len(hits))
+
+        return self.findStrikes(hits.slice(0, lastEventStart))
+
+    @instrumentation.timed(instrumentation.STRIKE_BUILD)
+    def finish(self):
+
+        # Returns strikes in hits held for last event of tree
+        heldHits = self.heldHits
+        self.heldHits = None
+        return self.findStrikes(heldHits) if heldHits is not None else noStrikes()
+
+    def findStrikes(self, hits):
+
+        # Returns strikes in block of hits holding whole events
+        if len(hits) == 0:
+            return noStrikes()
+
+        hits = sortHits(hits)
+        keys = eventKeys(hits.run, hits.event)
+        nHits = len(hits)
+
+        # End (exclusive) of each event, and of window starting at each hit
+        eventLast = numpy.searchsorted(keys, keys, side="right")
+        windowLast = searchSortedRanges(hits.hitTime, numpy.arange(nHits), eventLast,
+                                        hits.hitTime + self.windowTime, "left")
+
+        # Number of distinct wires hit in each window, from count of hits on each wire before each
+        # hit. Scintillator arrays have few wires, so this is done wire by wire
+        windowWires = numpy.zeros(nHits, dtype=numpy.int64)
+        for wire in numpy.unique(hits.wire):
+            wireCounts = numpy.concatenate(([0], numpy.cumsum(hits.wire == wire)))
+            windowWires += (wireCounts[windowLast] - wireCounts[:-1]) > 0
+
+        # Windows with enough wires, and for each, the next window starting after its hits
+        candidates = numpy.flatnonzero(windowWires >= self.nWires)
+        nCandidates = len(candidates)
+        if nCandidates == 0:
+            return noStrikes()
+        nextCandidate = numpy.searchsorted(candidates, windowLast[candidates], side="left")
+
+        # Strikes are the windows reached from the first by following the next window in turn.
+        # Jumps are doubled on each pass, so a chain of n strikes takes log(n) passes; the jump
+        # from beyond the last window stays there
+        jumps = numpy.append(nextCandidate, nCandidates)
+        isStrike = numpy.zeros(nCandidates + 1, dtype=bool)
+        isStrike[0] = True
+        while (jumps[:nCandidates] < nCandidates).any():
+            isStrike[jumps[numpy.flatnonzero(isStrike)]] = True
+            jumps = jumps[jumps]
+
+        strikeFirst = candidates[isStrike[:nCandidates]]
+        strikeCounts = windowLast[strikeFirst] - strikeFirst
+
+        # Mean hit time of each strike, over hits of its window
+        hitIndex, strikeIndex = expandRanges(strikeFirst, strikeCounts)
+        hitTimes = numpy.bincount(strikeIndex, weights=hits.hitTime[hitIndex].astype(numpy.float64),
+                                  minlength=len(strikeFirst)) / strikeCounts
+
+        return hits.run[strikeFirst], hits.event[strikeFirst], hitTimes, hits.wire[strikeFirst]
+
+
+class StreamingMatcher:
+
+    # Class matching straw hits to strikes while both trees are read, in order of run and event.
+    # Once an event is complete in both trees, its straw counts, delays and wires are passed to the fill
+    # function given, for each cut time, and the event is discarded. Only events not yet complete
+    # are held, so memory depends on the chunk size and largest event, not on the size of the file.
+    # If background shifts are given, straws in off-time windows of each strike are passed to the
+    # background fill function in the same way
+
+    def __init__(self, cutTimes, fill, backgroundShifts=(), fillBackground=None):
+
+        # Get cut times, and function called as fill(cutTime, strawCounts, strawDelays, strawWires)
+        self.cutTimes = sorted(cutTimes)
+        self.fill = fill
+
+        # Shifts of off-time windows, and function called as fillBackground(cutTime, strawCounts,
+        # strawDelays)
+        self.backgroundShifts = list(backgroundShifts)
+        self.fillBackground = fillBackground
+
+        # Strikes and straw hits held for events not yet processed
+        self.strikeBlocks = []
+        self.strawBlocks = []
+
+        # Key of last event read from each tree. Events before these are complete
+        self.strikeScanKey = -1
+        self.strawScanKey = -1
+
+        # Whether all strikes, or all straw hits, have been added
+        self.strikesFinished = False
+        self.strawsFinished = False
+
+    def addStrikes(self, runs, events, hitTimes, scanKey):
+
+        # Hold strikes found in a chunk of scintillator tree, and key of last event in the chunk
+        self.strikeBlocks.append((runs, events, hitTimes))
+        self.strikeScanKey = scanKey
+
+    def addStraws(self, hits):
+
+        # Hold a chunk of straw hits
+        if len(hits) > 0:
+            self.strawBlocks.append(hits)
+            self.strawScanKey = eventKey(int(hits.run[-1]), int(hits.event[-1]))
+
+    def finishStrikes(self):
+
+        # No more strikes will be added, so events need only be complete in straw tree
+        self.strikesFinished = True
+
+    def finishStraws(self):
+
+        # No more straw hits will be added, so events need only be complete in scintillator tree
+        self.strawsFinished = True
+
+    # Returns whether straw hits for events up to last strike may still be added
+    def needsStraws(self):
+        return (not self.strawsFinished) and (self.strawScanKey <= self.strikeScanKey)
+
+    @instrumentation.timed(instrumentation.STRAW_MATCH)
+    def process(self, final=False):
+
+        # Match and fill all events complete in both trees (or all events held, if final)
+        if final:
+            self.finishStrikes()
+            self.finishStraws()
+
+        if len(self.strikeBlocks) == 0:
+            return
+
+        runs, events, hitTimes = [numpy.concatenate([block[i] for block in self.strikeBlocks]) for i in xrange(3)]
+        strawHits = self.strawBlocks[0].concatenate(self.strawBlocks) if len(self.strawBlocks) > 0 else None
+
+        # Events before this key are complete in both trees
+        completeKey = min(LAST_KEY if self.strikesFinished else self.strikeScanKey,
+                          LAST_KEY if self.strawsFinished else self.strawScanKey)
+
+        strikeKeys = eventKeys(runs, events)
+        completeStrikes = strikeKeys < completeKey
+
+        # Keep strikes for events not yet complete, and straws which could still match them
+        self.strikeBlocks = [(runs[~completeStrikes], events[~completeStrikes], hitTimes[~completeStrikes])]
+        self.strawBlocks = []
+
+        if strawHits is not None:
+            strawKeys = eventKeys(strawHits.run, strawHits.event)
+            laterStraws = numpy.flatnonzero(strawKeys >= completeKey)
+            if len(laterStraws) > 0:
+                self.strawBlocks = [strawHits.take(laterStraws)]
+
+        if not completeStrikes.any():
+            return
+
+        # Match complete strikes against straws (none, if no straws are held, so that every strike
+        # is still counted), and fill histograms with each cut time
+        strikeHitTimes = hitTimes[completeStrikes]
+        matcher = StrawMatcher(sortHits(strawHits) if strawHits is not None else HitArrays.concatenate([]))
+        first, lasts = matcher.matchCuts(runs[completeStrikes], events[completeStrikes], strikeHitTimes, self.cutTimes)
+
+        for cutTime in self.cutTimes:
+            strawCounts, delays, wires = strawDelays(matcher.getStrawHits(), first, lasts[cutTime], strikeHitTimes)
+            self.fill(cutTime, strawCounts, delays, wires)
+
+        if len(self.backgroundShifts) > 0:
+            fillBackground(matcher, runs[completeStrikes], events[completeStrikes], strikeHitTimes, self.cutTimes,
+                           self.backgroundShifts, self.fillBackground)
+
+
+def finishStream(strikeFinder, streamingMatcher):
+
+    # Adds strikes left in strike finder to streaming matcher, once no more hits are read for it.
+    # These are from events up to the last one read, so straws already read cover them
+    runs, events, hitTimes, wires = strikeFinder.finish()
+    streamingMatcher.addStrikes(runs, events, hitTimes, streamingMatcher.strikeScanKey)
+    streamingMatcher.finishStrikes()
+
+
+def streamCoincidences(scintChunks, strawChunks, streams):
+
+    # Generator reading scintillator and straw trees in step, by chunks, and matching straws to
+    # strikes for each of a list of streams. Each stream is (strikeFinder, streamingMatcher,
+    # scintLastEntry, strawLastEntry): strikeFinder.process(hits) gives arrays of run, event, hit
+    # time and wire of strikes in a chunk, and strikeFinder.finish() those left once no more
+    # chunks follow, and entries from the last entries given on (if not None) are not used by the
+    # stream. Each tree is read once for all streams. Gives each scintillator chunk once it is
+    # processed. Both trees must be ordered by run and event, and OrderError is raised if not
+    scintChunks = checkOrder(scintChunks, "Scintillator tree")
+    strawChunks = checkOrder(strawChunks, "Straw tree")
+    strawsFinished = False
+
+    for hits in scintChunks:
+
+        if len(hits) == 0:
+            continue
+
+        for strikeFinder, streamingMatcher, scintLastEntry, strawLastEntry in streams:
+
+            if streamingMatcher.strikesFinished:
+                continue
+
+            streamHits = hits.limit(scintLastEntry)
+            if len(streamHits) > 0:
+                runs, events, hitTimes, wires = strikeFinder.process(streamHits)
+                streamingMatcher.addStrikes(runs, events, hitTimes,
+                                            eventKey(int(streamHits.run[-1]), int(streamHits.event[-1])))
+
+            if len(streamHits) < len(hits):
+                finishStream(strikeFinder, streamingMatcher)
+
+        # Read straw tree until past last event in scintillator chunk, for every stream
+        while (not strawsFinished) and any(stream[1].needsStraws() for stream in streams):
+
+            try:
+                strawHits = next(strawChunks)
+            except StopIteration:
+                strawsFinished = True
+                break
+
+            for strikeFinder, streamingMatcher, scintLastEntry, strawLastEntry in streams:
+
+                if streamingMatcher.strawsFinished:
+                    continue
+
+                streamHits = strawHits.limit(strawLastEntry)
+                streamingMatcher.addStraws(streamHits)
+                if len(streamHits) < len(strawHits):
+                    streamingMatcher.finishStraws()
+
+        for stream in streams:
+            stream[1].process()
+
+        yield hits
+
+    # Straws for events after last strike can not match, so are not read
+    for strikeFinder, streamingMatcher, scintLastEntry, strawLastEntry in streams:
+        if not streamingMatcher.strikesFinished:
+            finishStream(strikeFinder, streamingMatcher)
+        streamingMatcher.process(final=True)
@@ -0,0 +1,221 @@
+#
+# Histograms of straw hits coinciding with scintillator strikes, for a list of delay cut times,
+# shared by scint_straw_coincidence.py and double_scint_straw_coincidence.py.
+#
+
+import copy
+
+import ROOT
+
+import histograms
+import instrumentation
+
+
+# Number of straw channels (wire numbers from 0) given a bin in channel histograms. Hits on
+# higher wires go to overflow
+STRAW_CHANNELS = 128
+
+
+class CoincidenceHistograms:
+
+    # Class for histograms of number of straws coinciding with each strike, and delay time of each
+    # straw after its strike, for each cut time. Delay times and numbers of coinciding hits are
+    # also kept for each straw channel. If background shifts are given, the same histograms are
+    # filled from off-time windows before each strike, one for each shift, to estimate the random
+    # background, which is subtracted from them on writing
+
+    def __init__(self, cutTimes, tag="", backgroundShifts=()):
+
+        # Get cut times, tag put before names of ROOT histograms, so that several sets of
+        # histograms can be held at once, and shifts of off-time windows, in ns
+        self.cutTimes = sorted(cutTimes)
+        self.tag = tag
+        self.backgroundShifts = list(backgroundShifts)
+
+        # Number of strikes matched
+        self.nStrikes = 0
+
+        # Histograms for number of straws in clusters, and delay time for each straw in cluster
+        self.hStrawsCoinciding = dict()
+        self.hStrawDelay = dict()
+
+        # Histograms for delay time against channel, and number of hits in clusters on each channel
+        self.hStrawChannelDelay = dict()
+        self.hStrawChannelHits = dict()
+
+        # Histograms for number of straws, and delay times, in off-time windows of all shifts
+        self.hStrawsCoincidingBackground = dict()
+        self.hStrawDelayBackground = dict()
+
+        for cutTime in self.cutTimes:
+            self.hStrawsCoinciding[cutTime] = histograms.Histogram(10, 0, 10)
+            self.hStrawDelay[cutTime] = histograms.Histogram(50, 0, cutTime)
+            self.hStrawChannelDelay[cutTime] = histograms.Histogram(STRAW_CHANNELS, 0, STRAW_CHANNELS, 50, 0, cutTime)
+            self.hStrawChannelHits[cutTime] = histograms.Histogram(STRAW_CHANNELS, 0, STRAW_CHANNELS)
+            self.hStrawsCoincidingBackground[cutTime] = histograms.Histogram(10, 0, 10)
+            self.hStrawDelayBackground[cutTime] = histograms.Histogram(50, 0, cutTime)
+
+        # ROOT histograms for drawing and writing, made once filling is done
+        self.rootStrawsCoinciding = None
+        self.rootStrawDelay = None
+        self.rootStrawChannelDelay = None
+        self.rootStrawChannelHits = None
+        self.rootBackground = None
+
+    @instrumentation.timed(instrumentation.HISTOGRAM_FILL)
+    def fill(self, cutTime, strawCounts, strawDelays, strawWires=None):
+
+        # Fill histograms for number of straws for each strike which has straws, and delay time of
+        # each straw, with given cut time. Channel histograms are filled if the wire of each straw
+        # is given. Strikes are counted once, with the shortest cut time
+        if cutTime == self.cutTimes[0]:
+            self.nStrikes += len(strawCounts)
+
+        self.hStrawsCoinciding[cutTime].fill(strawCounts[strawCounts > 0])
+        self.hStrawDelay[cutTime].fill(strawDelays)
+
+        if strawWires is not None:
+            self.hStrawChannelDelay[cutTime].fill(strawWires, strawDelays)
+            self.hStrawChannelHits[cutTime].fill(strawWires)
+
+    @instrumentation.timed(instrumentation.HISTOGRAM_FILL)
+    def fillBackground(self, cutTime, strawCounts, strawDelays):
+
+        # Fill background histograms for number of straws in each off-time window which has
+        # straws, and delay time of each straw from start of its window, with given cut time
+        self.hStrawsCoincidingBackground[cutTime].fill(strawCounts[strawCounts > 0])
+        self.hStrawDelayBackground[cutTime].fill(strawDelays)
+
+    @instrumentation.timed(instrumentation.HISTOGRAM_FILL)
+    def fillFromCollection(self, scintStrikeCollection):
+
+        # Fill histograms from clusters held for each strike in collection
+        for cutTime in self.cutTimes:
+            self.fill(cutTime, scintStrikeCollection.getStrawCounts(cutTime),
+                      scintStrikeCollection.getStrawDelays(cutTime),
+                      scintStrikeCollection.getStrawWires(cutTime))
+
+    def getHistograms(self):
+
+        # Returns list of all histograms
+        return [hists[cutTime] for hists in (self.hStrawsCoinciding, self.hStrawDelay, self.hStrawChannelDelay,
+                                             self.hStrawChannelHits, self.hStrawsCoincidingBackground,
+                                             self.hStrawDelayBackground)
+                for cutTime in self.cutTimes]
+
+    def getBackground(self, hist):
+
+        # Returns copy of background histogram scaled to the mean of one off-time window
+        background = copy.deepcopy(hist)
+        background.scale(1.0 / len(self.backgroundShifts))
+        return background
+
+    def getSubtracted(self, hist, background):
+
+        # Returns copy of histogram with scaled background histogram subtracted, keeping number of
+        # entries of histogram
+        subtracted = copy.deepcopy(background)
+        subtracted.scale(-1)
+        subtracted.add(hist)
+        subtracted.entries = hist.entries
+        return subtracted
+
+    def add(self, other):
+
+        # Add contents of histograms from another CoincidenceHistograms with the same cut times
+        # (e.g. for another part of the trees)
+        for hist, otherHist in zip(self.getHistograms(), other.getHistograms()):
+            hist.add(otherHist)
+        self.nStrikes += other.nStrikes
+
+    def makeROOTHistograms(self):
+
+        # Returns ROOT histograms made from filled histograms (making them if not made already),
+        # for number of straws, delay times, delay times against channel and hits on each channel,
+        # each as dict by cut time. Plots are drawn from the written histograms by render.py
+        if self.rootStrawsCoinciding is None:
+
+            self.rootStrawsCoinciding = dict()
+            self.rootStrawDelay = dict()
+            self.rootStrawChannelDelay = dict()
+            self.rootStrawChannelHits = dict()
+
+            for cutTime in self.cutTimes:
+                name = histograms.cutSuffix(cutTime)
+                self.rootStrawsCoinciding[cutTime] = self.hStrawsCoinciding[cutTime].toROOT(ROOT.TH1I, self.tag + "hStrawsCoinciding" + name,
+                                                                                             "hStrawsCoinciding" + name)
+                self.rootStrawDelay[cutTime] = self.hStrawDelay[cutTime].toROOT(ROOT.TH1I, self.tag + "hStrawDelay" + name,
+                                                                                 "hStrawDelay" + name)
+                self.rootStrawChannelDelay[cutTime] = self.hStrawChannelDelay[cutTime].toROOT(ROOT.TH2I, self.tag + "hStrawChannelDelay" + name,
+                                                                                               "hStrawChannelDelay" + name)
+                self.rootStrawChannelHits[cutTime] = self.hStrawChannelHits[cutTime].toROOT(ROOT.TH1I, self.tag + "hStrawChannelHits" + name,
+                                                                                             "hStrawChannelHits" + name)
+
+        return self.rootStrawsCoinciding, self.rootStrawDelay, self.rootStrawChannelDelay, self.rootStrawChannelHits
+
+    def makeROOTBackgroundHistograms(self):
+
+        # Returns ROOT histograms for background, scaled to one off-time window, and for
+        # histograms with background subtracted (making them if not made already), as dict by
+        # name, without tag, for each cut time
+        if self.rootBackground is None:
+
+            self.rootBackground = dict()
+            for cutTime in self.cutTimes:
+
+                name = histograms.cutSuffix(cutTime)
+                self.rootBackground[cutTime] = dict()
+                for histName, hist, background in (("hStrawsCoinciding", self.hStrawsCoinciding[cutTime], self.hStrawsCoincidingBackground[cutTime]),
+                                                   ("hStrawDelay", self.hStrawDelay[cutTime], self.hStrawDelayBackground[cutTime])):
+
+                    background = self.getBackground(background)
+                    for suffix, result in (("Background", background), ("Subtracted", self.getSubtracted(hist, background))):
+                        self.rootBackground[cutTime][histName + suffix + name] = result.toROOT(ROOT.TH1D, self.tag + histName + suffix + name,
+                                                                                              histName + suffix + name)
+
+        return self.rootBackground
+
+    def write(self):
+
+        # Write histograms to current output file, named without tag
+        rootStrawsCoinciding, rootStrawDelay, rootStrawChannelDelay, rootStrawChannelHits = self.makeROOTHistograms()
+        for cutTime in self.cutTimes:
+            name = histograms.cutSuffix(cutTime)
+            rootStrawsCoinciding[cutTime].Write("hStrawsCoinciding" + name)
+            rootStrawDelay[cutTime].Write("hStrawDelay" + name)
+            rootStrawChannelDelay[cutTime].Write("hStrawChannelDelay" + name)
+            rootStrawChannelHits[cutTime].Write("hStrawChannelHits" + name)
+
+        # Background histograms are only written if off-time windows were filled
+        if len(self.backgroundShifts) > 0:
+            rootBackground = self.makeROOTBackgroundHistograms()
+            for cutTime in self.cutTimes:
+                for name in sorted(rootBackground[cutTime]):
+                    rootBackground[cutTime][name].Write(name)
+
+
+def getWindowDirectoryName(windowTime):
+
+    # Returns name of output directory holding histograms for window time of window scan
+    return "window" + histograms.cutSuffix(windowTime)
+
+
+def writeWindowScan(windowTimes, coincidenceHistograms):
+
+    # Write histograms for each window time of a scan of double scintillator strike window times
+    # to current output file, each set in a directory named from its window time, and number of
+    # strikes found with each window time, with a bin for each window time
+    outputDirectory = ROOT.gDirectory
+    hDoubleStrikes = ROOT.TH1D("hDoubleStrikes", "hDoubleStrikes", len(windowTimes), 0, len(windowTimes))
+
+    for index, (windowTime, windowHistograms) in enumerate(zip(windowTimes, coincidenceHistograms)):
+
+        outputDirectory.mkdir(getWindowDirectoryName(windowTime)).cd()
+        windowHistograms.write()
+        outputDirectory.cd()
+
+        hDoubleStrikes.SetBinContent(index + 1, windowHistograms.nStrikes)
+        hDoubleStrikes.GetXaxis().SetBinLabel(index + 1, histograms.cutSuffix(windowTime))
+
+    hDoubleStrikes.SetEntries(sum(windowHistograms.nStrikes for windowHistograms in coincidenceHistograms))
+    hDoubleStrikes.Write()
@@ -0,0 +1,62 @@
+#
+# Histograms of scintillator hit counts and delay times between scintillator hits, made by
+# scint_coincidence_delays.py.
+#
+
+import ROOT
+
+import histograms
+import instrumentation
+
+
+class DelayHistograms:
+
+    # Class for histograms of number of hits on each scintillator in each event, and lowest
+    # delay time between hits on different scintillators in each event
+
+    def __init__(self):
+
+        # Histogram for number of hits for each scintillator
+        self.hScintWireHits = histograms.Histogram(15, 0, 15, 15, 0, 15)
+
+        # Histograms for delay times between scintillator hits, with and without 100ns cut.
+        self.hTimeOffsets = histograms.Histogram(100, 0, 100)
+        self.hTimeOffsetsNocut = histograms.Histogram(100, 0, 20000000)
+
+        # ROOT histograms for drawing and writing, made once filling is done
+        self.rootHistograms = None
+
+    # Fill histograms with EventDelays for completed events
+    @instrumentation.timed(instrumentation.HISTOGRAM_FILL)
+    def fill(self, eventDelays):
+        eventDelays.fill(self.hScintWireHits, self.hTimeOffsets, self.hTimeOffsetsNocut)
+
+    # Returns list of all histograms
+    def getHistograms(self):
+        return [self.hScintWireHits, self.hTimeOffsets, self.hTimeOffsetsNocut]
+
+    def add(self, other):
+
+        # Add contents of histograms from another DelayHistograms (e.g. for another part of the tree)
+        for hist, otherHist in zip(self.getHistograms(), other.getHistograms()):
+            hist.add(otherHist)
+
+    def makeROOTHistograms(self):
+
+        # Returns ROOT histograms made from filled histograms (making them if not made already), for
+        # number of hits for each scintillator, and delay times with and without cut. Plots are
+        # drawn from the written histograms by render.py
+        if self.rootHistograms is None:
+            hScintWireHits = self.hScintWireHits.toROOT(ROOT.TH2D, "hScintWireHits", "hScintWireHits")
+            hScintWireHits.SetStats(0)
+            self.rootHistograms = (hScintWireHits,
+                                   self.hTimeOffsets.toROOT(ROOT.TH1D, "hTimeOffsets", "hTimeOffsets"),
+                                   self.hTimeOffsetsNocut.toROOT(ROOT.TH1D, "hTimeOffsetsNocut", "hTimeOffsetsNocut"))
+
+        return self.rootHistograms
+
+    def write(self):
+
+        # Write histograms to current output file
+        for hist in self.makeROOTHistograms():
+            hist.Write()
@@ -0,0 +1,122 @@
+#
+# Script to examine straw strikes which follow single and double scintillator strikes, making
+# the outputs of both scint_straw_coincidence.py and double_scint_straw_coincidence.py (for
+# overlay_double_single_coinc.py) from one read of each tree.
+# Straw hits are read and sorted once, and matched against both kinds of strike.
+#
+
+import argparse
+
+import ROOT
+
+import coincidence_analysis
+import event_index
+import hit_reader
+import incremental
+import instrumentation
+import parallel
+import render
+
+
+# Get delay time cuts for coincidences between scintillator and straw strikes, in ns
+parser = argparse.ArgumentParser(description="Examine straw strikes which follow single and double scintillator strikes")
+parser.add_argument("--cuts", type=float, nargs="+", default=[75, 500], help="delay time cuts, in ns")
+parser.add_argument("--wires", type=int,
+                    help="find strikes from hits on at least this many distinct scintillators within the window, "
+                         "rather than from consecutive hits on both scintillators")
+parser.add_argument("--window", type=float, default=coincidence_analysis.DOUBLE_STRIKE_WINDOW,
+                    help="time window for scintillator hits to count as one strike, in ns")
+parser.add_argument("--background-shifts", type=float, nargs="+", default=[],
+                    help="shifts of off-time windows before each strike, in ns, to estimate and subtract random background from")
+parser.add_argument("--streaming", action="store_true",
+                    help="fill histograms as each event is read, without keeping clusters (trees must be ordered by run and event)")
+parser.add_argument("--input", default=hit_reader.INPUT_FILE_NAME,
+                    help="input ROOT file, or directory of hit columns (see generate_hits.py)")
+parser.add_argument("--cache", action="store_true",
+                    help="read trees from memory-mapped hit cache, built from input file if missing or out of date")
+parser.add_argument("--runs", type=int, nargs="+",
+                    help="analyse only these runs, reading only their entries (see event_index.py)")
+parser.add_argument("--event-range", type=int, nargs=2, metavar=("FIRST", "LAST"),
+                    help="analyse only events FIRST to LAST (inclusive) of each run, reading only their entries")
+parser.add_argument("--incremental", action="store_true",
+                    help="process trees run by run, reusing results stored for runs already processed (see incremental.py)")
+parser.add_argument("--jobs", type=int, default=1, help="number of processes to split trees across, and to draw plots in")
+parser.add_argument("--progress", action="store_true", help="show live progress line, with rate and time left")
+parser.add_argument("--report", default="double_single_straw_coincidence_report.json",
+                    help="JSON file to write time spent in each stage, and peak memory, to")
+parser.add_argument("--no-render", action="store_true", help="only save histograms, without drawing plots (see render.py)")
+args = parser.parse_args()
+instrumentation.setProgress(args.progress)
+selection = event_index.makeSelection(args.runs, args.event_range)
+cutTimes = sorted(set(args.cuts))
+
+# Arguments for analyses of strikes from every scintillator hit, using first entries of each tree,
+# and of double scintillator strikes, using all entries of each tree, as in the separate scripts
+analysisArgs = [(False, cutTimes, "single_", 100000, 500000, None, coincidence_analysis.DOUBLE_STRIKE_WINDOW,
+                 args.background_shifts),
+                (True, cutTimes, "double_", None, None, args.wires, args.window, args.background_shifts)]
+
+if args.incremental:
+
+    # Process each run, or take its histograms from earlier runs of script, and merge histograms
+    singleHistograms, doubleHistograms = incremental.runCoincidences(args.input, analysisArgs,
+                                                                     args.jobs, args.cache, selection)
+
+elif args.jobs > 1:
+
+    # Process parts of trees in separate processes, and merge histograms
+    singleHistograms, doubleHistograms = parallel.runCoincidences(args.input, analysisArgs,
+                                                                  args.streaming, args.jobs, args.cache, selection)
+
+else:
+
+    # Get input file, and tree of straw and scintillator strikes
+    f, scintTree, strawTree = event_index.openTrees(args.input, args.cache, selection)
+
+    # Strike finders, and histograms for number of straws coinciding with strikes, and their
+    # delay times, for each analysis
+    analyses = coincidence_analysis.makeAnalyses(analysisArgs)
+
+    # Read each tree as far as needed by any analysis
+    scintLastEntry = coincidence_analysis.readLimit([analysis.scintLastEntry for analysis in analyses])
+    strawLastEntry = coincidence_analysis.readLimit([analysis.strawLastEntry for analysis in analyses])
+
+    print ""
+    print "Iterating Across Scintillator Tree"
+
+    # Loop across entries in scintillator tree, reading a chunk of entries at a time. Strikes of
+    # each kind are found in each chunk, then matched to straw hits, and histograms filled
+    scintChunks = hit_reader.iterHits(scintTree, lastEntry=scintLastEntry)
+    strawChunks = hit_reader.iterHits(strawTree, lastEntry=strawLastEntry)
+    for hits in coincidence_analysis.analyse(instrumentation.timeChunks(scintChunks, instrumentation.SCINT_READ),
+                                             instrumentation.timeChunks(strawChunks, instrumentation.STRAW_READ),
+                                             analyses, args.streaming):
+
+        # To show progress
+        instrumentation.progress(hits.firstEntry + len(hits), hit_reader.countEntries(scintTree, scintLastEntry))
+
+    singleHistograms, doubleHistograms = [analysis.coincidenceHistograms for analysis in analyses]
+
+
+# Post-processing
+
+# Create output files, then write histograms to each
+with instrumentation.stage(instrumentation.HISTOGRAM_WRITE):
+
+    single_out_file = ROOT.TFile(render.SINGLE_COINCIDENCE_FILE_NAME, "RECREATE")
+    singleHistograms.write()
+    single_out_file.Close()
+
+    double_out_file = ROOT.TFile(render.DOUBLE_COINCIDENCE_FILE_NAME, "RECREATE")
+    doubleHistograms.write()
+    double_out_file.Close()
+
+# Draw histograms from output files, and print each to pdf, with names used by separate scripts,
+# and overlays of the two
+if not args.no_render:
+    render.renderPlots(render.coincidencePlots(render.SINGLE_COINCIDENCE_FILE_NAME, "")
+                       + render.coincidencePlots(render.DOUBLE_COINCIDENCE_FILE_NAME, "double_")
+                       + render.overlayPlots(), args.jobs)
+
+# Write time spent in each stage, and peak memory, to report
+instrumentation.writeReport(args.report)
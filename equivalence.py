@@ -0,0 +1,617 @@
+#
+# Golden-output equivalence harness for the analysis engines.
+# Runs the per-entry loops of the original scripts (kept here as the reference) and each engine
+# on the same inputs, synthetic trees from generate_hits.py (including trees with the entries of
+# each event shuffled, and with event numbers shared by runs at their boundaries) and any real
+# input files, and compares every histogram bin by bin: contents, errors and entries must be the same, and the
+# sums for the statistics the same to within a tolerance, as they may be added in another
+# order. Where an engine differs, the events are bisected to find the first events whose
+# results differ, which are reported with their entries in each tree.
+# Engines are listed in ENGINES, by analysis and backend; a new backend is checked by adding it
+# there. Engines reading the hit cache are compared with the reference loops over the hits as the
+# cache holds them, sorted by run, event and hit time, and engines reading a selection of events
+# (as --runs and --event-range) with the reference loops over the selected hits. Exits with status 1 if any engine differs, so performance work can be gated on it.
+#
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy
+
+import coincidence_analysis
+import coincidence_engine
+import event_index
+import generate_hits
+import hit_cache
+import hit_reader
+import histograms
+import incremental
+import parallel
+import rdf_delays
+import scint_delays
+from delay_histograms import DelayHistograms
+
+
+# Analyses checked, and backends run for them
+ANALYSES = ("delays", "single", "double")
+BACKENDS = ("chunked", "streaming", "jobs", "incremental", "rdataframe", "cache", "cache-jobs", "selection",
+            "selection-jobs", "selection-incremental")
+
+# Variants of synthetic trees made for each seed: hit times as floats, and as whole ns, giving
+# hits exactly at the edges of time windows; entries of each event in random order; and each run
+# starting at the event number the run before it ends at
+SYNTHETIC_VARIANTS = {"float": "float times", "integer": "integer times", "shuffled": "entries shuffled within events",
+                      "colliding": "event numbers shared at run boundaries"}
+
+# Arguments to CoincidenceAnalysis (after cut times) for coincidence analyses, as in
+# scint_straw_coincidence.py and double_scint_straw_coincidence.py
+COINCIDENCE_ARGS = {"single": (False, "", 100000, 500000),
+                    "double": (True, "", None, None)}
+
+# Default number of entries read in each chunk by chunked engines, small so that events are
+# often split between chunks
+DEFAULT_CHUNK_SIZE = 1000
+
+# Default relative tolerance of sums for statistics
+DEFAULT_TOLERANCE = 1e-9
+
+
+#################################################################################
+# Reference loops, as in the original scripts. Values are filled into histograms once the loops
+# are done, in the order the scripts filled them
+
+def referenceDelays(scintHits):
+
+    # Returns histograms of scint_coincidence_delays.py, by name, from loop over each entry of
+    # scintillator tree
+    hScintWireHits = histograms.Histogram(15, 0, 15, 15, 0, 15)
+    hTimeOffsets = histograms.Histogram(100, 0, 100)
+    hTimeOffsetsNocut = histograms.Histogram(100, 0, 20000000)
+    wireHits, timeOffsets, timeOffsetsNocut = [], [], []
+
+    scint0Hits = 0
+    scint1Hits = 0
+    eventCount = 0
+    currentScintHit = 1000
+    currentHitTime = 0
+    currentRun = 0
+    delayTimes = []
+
+    for run, event, wire, hitTime in zip(scintHits.run.tolist(), scintHits.event.tolist(),
+                                         scintHits.wire.tolist(), scintHits.hitTime.tolist()):
+
+        previousScintHit = currentScintHit
+        currentScintHit = wire
+        previousHitTime = currentHitTime
+        currentHitTime = hitTime
+        previousRun = currentRun
+        currentRun = run
+
+        # New event: fill lowest delay time, and number of hits on each scintillator, of event before
+        if event != eventCount:
+            eventCount = event
+            if len(delayTimes) > 0:
+                if min(delayTimes) < 100:
+                    timeOffsets.append(min(delayTimes))
+                timeOffsetsNocut.append(min(delayTimes))
+            wireHits.append((scint0Hits, scint1Hits))
+            scint0Hits = 0
+            scint1Hits = 0
+            delayTimes = []
+
+        # Not new event, but different scintillator struck to last time, and not new run
+        elif (currentScintHit != previousScintHit) & (currentRun == previousRun):
+            delayTimes.append(currentHitTime - previousHitTime)
+
+        if currentScintHit == 0:
+            scint0Hits += 1
+        elif currentScintHit == 1:
+            scint1Hits += 1
+
+    hScintWireHits.fill([x for x, y in wireHits], [y for x, y in wireHits])
+    hTimeOffsets.fill(timeOffsets)
+    hTimeOffsetsNocut.fill(timeOffsetsNocut)
+
+    return {"hScintWireHits": hScintWireHits, "hTimeOffsets": hTimeOffsets, "hTimeOffsetsNocut": hTimeOffsetsNocut}
+
+
+def referenceCoincidences(scintHits, strawHits, analysisArgs):
+
+    # Returns histograms of scint_straw_coincidence.py (or double_scint_straw_coincidence.py, for
+    # double scintillator strikes), by name, from loops over each entry of both trees
+    doubleScint, cutTimes, tag, scintLastEntry, strawLastEntry = analysisArgs
+    scintHits = scintHits.limit(scintLastEntry)
+    strawHits = strawHits.limit(strawLastEntry)
+
+    # Strikes for each run and event, each with list of straw hit times for each cut time
+    strikes = dict()
+    previousWire = 1000
+    previousHitTime = 0
+    previousRun = 0
+    previousEvent = 0
+
+    for run, event, wire, hitTime in zip(scintHits.run.tolist(), scintHits.event.tolist(),
+                                         scintHits.wire.tolist(), scintHits.hitTime.tolist()):
+
+        if not doubleScint:
+            strikes.setdefault((run, event), []).append((hitTime, dict((cutTime, []) for cutTime in cutTimes)))
+        elif ((previousEvent == event) & (previousRun == run) & (previousWire != wire)
+              & ((hitTime - previousHitTime) < coincidence_analysis.DOUBLE_STRIKE_WINDOW)):
+            strikes.setdefault((run, event), []).append(((previousHitTime + hitTime) / 2,
+                                                         dict((cutTime, []) for cutTime in cutTimes)))
+
+        previousEvent = event
+        previousRun = run
+        previousWire = wire
+        previousHitTime = hitTime
+
+    for run, event, hitTime in zip(strawHits.run.tolist(), strawHits.event.tolist(), strawHits.hitTime.tolist()):
+        for strikeTime, clusters in strikes.get((run, event), []):
+            for cutTime in cutTimes:
+                if (hitTime > strikeTime) & (hitTime < strikeTime + cutTime):
+                    clusters[cutTime].append(hitTime)
+
+    results = dict()
+    for cutTime in cutTimes:
+
+        strawCounts, strawDelays = [], []
+        for eventStrikes in strikes.values():
+            for strikeTime, clusters in eventStrikes:
+                if len(clusters[cutTime]) > 0:
+                    strawCounts.append(len(clusters[cutTime]))
+                    for strawHitTime in clusters[cutTime]:
+                        strawDelays.append(strawHitTime - strikeTime)
+
+        results["hStrawsCoinciding" + histograms.cutSuffix(cutTime)] = histograms.Histogram(10, 0, 10)
+        results["hStrawsCoinciding" + histograms.cutSuffix(cutTime)].fill(strawCounts)
+        results["hStrawDelay" + histograms.cutSuffix(cutTime)] = histograms.Histogram(50, 0, cutTime)
+        results["hStrawDelay" + histograms.cutSuffix(cutTime)].fill(strawDelays)
+
+    return results
+
+
+#################################################################################
+# Engines checked against the reference loops, each run on an input file or directory
+
+def getDelayResults(delayHistograms):
+
+    # Returns histograms of DelayHistograms, by name
+    return {"hScintWireHits": delayHistograms.hScintWireHits, "hTimeOffsets": delayHistograms.hTimeOffsets,
+            "hTimeOffsetsNocut": delayHistograms.hTimeOffsetsNocut}
+
+
+def getCoincidenceResults(coincidenceHistograms):
+
+    # Returns histograms of CoincidenceHistograms compared with the reference, by name
+    results = dict()
+    for cutTime in coincidenceHistograms.cutTimes:
+        results["hStrawsCoinciding" + histograms.cutSuffix(cutTime)] = coincidenceHistograms.hStrawsCoinciding[cutTime]
+        results["hStrawDelay" + histograms.cutSuffix(cutTime)] = coincidenceHistograms.hStrawDelay[cutTime]
+    return results
+
+
+def chunkedDelays(inputName, analysisArgs, options, useCache=False, selection=None):
+
+    # Delays engine reading tree in chunks, as scint_coincidence_delays.py with one job
+    inputFile, scintTree, strawTree = event_index.openTrees(inputName, useCache, selection)
+    delayHistograms = DelayHistograms()
+    delaysEngine = scint_delays.ScintDelayEngine()
+    for hits in hit_reader.iterHits(scintTree, options.chunk_size):
+        delayHistograms.fill(delaysEngine.process(hits))
+    return getDelayResults(delayHistograms)
+
+
+def chunkedCoincidences(inputName, analysisArgs, options, streaming=False, useCache=False, selection=None):
+
+    # Coincidence engine reading trees in chunks, as scint_straw_coincidence.py with one job
+    inputFile, scintTree, strawTree = event_index.openTrees(inputName, useCache, selection)
+    analysis = coincidence_analysis.CoincidenceAnalysis(*analysisArgs)
+    scintChunks = hit_reader.iterHits(scintTree, options.chunk_size, lastEntry=analysis.scintLastEntry)
+    strawChunks = hit_reader.iterHits(strawTree, options.chunk_size, lastEntry=analysis.strawLastEntry)
+    for hits in coincidence_analysis.analyse(scintChunks, strawChunks, [analysis], streaming):
+        pass
+    return getCoincidenceResults(analysis.coincidenceHistograms)
+
+
+# Functions running each engine, by analysis and backend, taking input name, arguments to
+# CoincidenceAnalysis and options of harness (with the events selected, for selection backends),
+# and returning histograms by name. Engines reading ROOT files only are listed in ROOT_ONLY
+ENGINES = {
+    ("delays", "chunked"): chunkedDelays,
+    ("delays", "jobs"): lambda inputName, analysisArgs, options:
+        getDelayResults(parallel.runDelays(inputName, options.jobs)),
+    ("delays", "incremental"): lambda inputName, analysisArgs, options:
+        getDelayResults(incremental.runDelays(inputName, options.jobs)),
+    ("delays", "rdataframe"): lambda inputName, analysisArgs, options:
+        getDelayResults(rdf_delays.runDelays(inputName, 0, options.chunk_size)),
+    ("delays", "cache"): lambda inputName, analysisArgs, options:
+        chunkedDelays(inputName, analysisArgs, options, useCache=True),
+    ("delays", "cache-jobs"): lambda inputName, analysisArgs, options:
+        getDelayResults(parallel.runDelays(inputName, options.jobs, True)),
+    ("delays", "selection"): lambda inputName, analysisArgs, options:
+        chunkedDelays(inputName, analysisArgs, options, selection=options.selection),
+    ("delays", "selection-jobs"): lambda inputName, analysisArgs, options:
+        getDelayResults(parallel.runDelays(inputName, options.jobs, False, options.selection)),
+    ("delays", "selection-incremental"): lambda inputName, analysisArgs, options:
+        getDelayResults(incremental.runDelays(inputName, options.jobs, False, options.selection)),
+    ("coincidence", "chunked"): chunkedCoincidences,
+    ("coincidence", "streaming"): lambda inputName, analysisArgs, options:
+        chunkedCoincidences(inputName, analysisArgs, options, streaming=True),
+    ("coincidence", "jobs"): lambda inputName, analysisArgs, options:
+        getCoincidenceResults(parallel.runCoincidences(inputName, [analysisArgs], False, options.jobs)[0]),
+    ("coincidence", "incremental"): lambda inputName, analysisArgs, options:
+        getCoincidenceResults(incremental.runCoincidences(inputName, [analysisArgs], options.jobs)[0]),
+    ("coincidence", "cache"): lambda inputName, analysisArgs, options:
+        chunkedCoincidences(inputName, analysisArgs, options, useCache=True),
+    ("coincidence", "cache-jobs"): lambda inputName, analysisArgs, options:
+        getCoincidenceResults(parallel.runCoincidences(inputName, [analysisArgs], False, options.jobs, True)[0]),
+    ("coincidence", "selection"): lambda inputName, analysisArgs, options:
+        chunkedCoincidences(inputName, analysisArgs, options, selection=options.selection),
+    ("coincidence", "selection-jobs"): lambda inputName, analysisArgs, options:
+        getCoincidenceResults(parallel.runCoincidences(inputName, [analysisArgs], False, options.jobs, False,
+                                                       options.selection)[0]),
+    ("coincidence", "selection-incremental"): lambda inputName, analysisArgs, options:
+        getCoincidenceResults(incremental.runCoincidences(inputName, [analysisArgs], options.jobs, False,
+                                                          options.selection)[0]),
+}
+ROOT_ONLY = ("rdataframe", "cache", "cache-jobs")
+
+
+def getReferenceHits(backend, scintHits, strawHits, options):
+
+    # Returns scintillator and straw hits the reference loops are run over, to compare with engine
+    # of backend: sorted as the hit cache holds them for cache backends, and only the selected
+    # events for selection backends
+    if backend.startswith("cache"):
+        return coincidence_engine.sortHits(scintHits), coincidence_engine.sortHits(strawHits)
+    if backend.startswith("selection"):
+        return selectHits(scintHits, options.selection), selectHits(strawHits, options.selection)
+    return scintHits, strawHits
+
+
+class Check:
+
+    # Class for one analysis, with its reference loop and its arguments, run by each engine
+
+    def __init__(self, analysis, cutTimes):
+
+        self.analysis = analysis
+        if analysis == "delays":
+            self.kind = "delays"
+            self.analysisArgs = None
+        else:
+            self.kind = "coincidence"
+            doubleScint, tag, scintLastEntry, strawLastEntry = COINCIDENCE_ARGS[analysis]
+            self.analysisArgs = (doubleScint, cutTimes, tag, scintLastEntry, strawLastEntry)
+
+    # Returns whether analysis has an engine for backend
+    def hasBackend(self, backend):
+        return (self.kind, backend) in ENGINES
+
+    # Returns histograms from reference loop over hits
+    def runReference(self, scintHits, strawHits):
+        if self.kind == "delays":
+            return referenceDelays(scintHits)
+        return referenceCoincidences(scintHits, strawHits, self.analysisArgs)
+
+    # Returns histograms from engine of backend run on input
+    def runEngine(self, backend, inputName, options):
+        return ENGINES[(self.kind, backend)](inputName, self.analysisArgs, options)
+
+    # Returns number of events after an event before its results are filled: an event of the
+    # delays analysis is filled once the next event starts
+    def getFillDelay(self):
+        return 1 if self.kind == "delays" else 0
+
+
+#################################################################################
+# Comparison of histograms, and search for differing events
+
+def describeCell(hist, cell):
+
+    # Returns description of global bin of histogram, with its range on each axis
+    nBinsX, xLow, xHigh = hist.binsX
+    axes = [(cell % (nBinsX + 2), hist.binsX)]
+    if hist.binsY is not None:
+        axes.append((cell // (nBinsX + 2), hist.binsY))
+
+    parts = []
+    for binNumber, (nBins, low, high) in axes:
+        if binNumber == 0:
+            parts.append("underflow")
+        elif binNumber == nBins + 1:
+            parts.append("overflow")
+        else:
+            width = (high - low) / nBins
+            parts.append("bin %d [%g, %g)" % (binNumber, low + (binNumber - 1) * width, low + binNumber * width))
+
+    return ", ".join(parts)
+
+
+def compareHistograms(reference, result, tolerance):
+
+    # Returns list of descriptions of differences between histograms of result and of reference,
+    # by name: the first differing bin of each histogram and the number differing, entries, and
+    # sums for statistics differing by more than tolerance relative to the reference
+    differences = []
+    for name in sorted(reference):
+
+        expected = reference[name]
+        hist = result.get(name)
+        if hist is None:
+            differences.append("%s: missing" % name)
+            continue
+        if not expected.isCompatible(hist):
+            differences.append("%s: binning %s, reference %s" % (name, (hist.binsX, hist.binsY),
+                                                                 (expected.binsX, expected.binsY)))
+            continue
+
+        cells = numpy.flatnonzero((hist.contents != expected.contents) | (hist.sumw2 != expected.sumw2))
+        if len(cells) > 0:
+            differences.append("%s: %d bins differ, first %s: %r, reference %r"
+                               % (name, len(cells), describeCell(hist, cells[0]), hist.contents[cells[0]],
+                                  expected.contents[cells[0]]))
+
+        if hist.entries != expected.entries:
+            differences.append("%s: %d entries, reference %d" % (name, hist.entries, expected.entries))
+
+        stats = numpy.flatnonzero(numpy.abs(hist.stats - expected.stats) > tolerance * numpy.maximum(numpy.abs(expected.stats), 1))
+        if len(stats) > 0:
+            differences.append("%s: statistics %r, reference %r" % (name, hist.stats.tolist(), expected.stats.tolist()))
+
+    return differences
+
+
+def selectEvents(hits, keys):
+
+    # Returns hits of events with given keys, in order
+    return hits.take(numpy.flatnonzero(numpy.in1d(coincidence_engine.eventKeys(hits.run, hits.event), keys)))
+
+
+def selectHits(hits, selection):
+
+    # Returns hits of events selected by EventSelection, in order
+    return hits.take(numpy.flatnonzero(selection.selectBlocks(coincidence_engine.eventKeys(hits.run, hits.event))))
+
+
+def removePartials():
+
+    # Removes partial results of incremental engines, so that the next input is processed from
+    # nothing stored: inputs with the same events and entry counts (e.g. the same trees with the
+    # entries of each event shuffled) would otherwise share them
+    if os.path.exists(incremental.PARTIALS_DIRECTORY):
+        shutil.rmtree(incremental.PARTIALS_DIRECTORY)
+
+
+def writeInput(directoryName, scintHits, strawHits, writeROOT):
+
+    # Writes hits to directory of columns, or to ROOT file if writeROOT, returning its name
+    if writeROOT:
+        fileName = directoryName + ".root"
+        generate_hits.writeROOT(fileName, scintHits, strawHits)
+        return fileName
+
+    generate_hits.writeColumns(directoryName, scintHits, strawHits, {})
+    return directoryName
+
+
+def findDifferingEvents(check, backend, scintHits, strawHits, options):
+
+    # Returns (run, event) of first events whose results differ between engine of backend and
+    # reference, at most options.max_events, found by bisection: the hits of the first m events
+    # of the scintillator tree (and the straw hits of these events) are analysed, for the least m
+    # at which results differ, leaving out events already found
+    keys = coincidence_engine.eventKeys(scintHits.run, scintHits.event)
+    uniqueKeys, firstIndices = numpy.unique(keys, return_index=True)
+    eventOrder = uniqueKeys[numpy.argsort(firstIndices)]
+    subsetName = os.path.join(options.work_directory, "subset")
+
+    def differs(events):
+        subsetScint = selectEvents(scintHits, events)
+        subsetStraw = selectEvents(strawHits, events)
+        inputName = writeInput(subsetName, subsetScint, subsetStraw, backend in ROOT_ONLY)
+        reference = check.runReference(*getReferenceHits(backend, subsetScint, subsetStraw, options))
+        removePartials()
+        return len(compareHistograms(reference, check.runEngine(backend, inputName, options), options.tolerance)) > 0
+
+    found = []
+    while len(found) < options.max_events:
+
+        candidates = eventOrder[~numpy.in1d(eventOrder, found)]
+        if (len(candidates) == 0) or not differs(candidates):
+            break
+
+        # Results of no events are the same, and of all candidates differ
+        low, high = 0, len(candidates)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if differs(candidates[:middle]):
+                high = middle
+            else:
+                low = middle
+
+        # Event whose results are filled once the first high candidates are read
+        index = high - 1 - check.getFillDelay()
+        if index < 0:
+            found.append(None)
+            break
+        found.append(candidates[index])
+
+    return found
+
+
+def describeEvent(key, scintHits, strawHits):
+
+    # Returns description of event with given key, with its entries in each tree
+    if key is None:
+        return "empty event before first hit"
+
+    parts = ["run %d event %d" % (key >> 32, key & 0xffffffff)]
+    for treeName, hits in (("scint", scintHits), ("straw", strawHits)):
+        entries = numpy.flatnonzero(coincidence_engine.eventKeys(hits.run, hits.event) == key)
+        if len(entries) > 0:
+            parts.append("%s entries %d-%d" % (treeName, hits.firstEntry + entries[0], hits.firstEntry + entries[-1]))
+    return ", ".join(parts)
+
+
+#################################################################################
+
+def shuffleEvents(hits, random):
+
+    # Returns hits with the entries of each event in random order, events staying in order
+    keys = coincidence_engine.eventKeys(hits.run, hits.event)
+    return hits.take(numpy.lexsort((random.uniform(size=len(hits)), keys)))
+
+
+def collideRuns(scintHits, strawHits):
+
+    # Renumbers events of each run of both trees so that each run starts at the event number the
+    # run before it ends at in the scintillator tree, so that the last event of each run and the
+    # first of the next share their event number
+    lastEvent = None
+    for run in numpy.unique(scintHits.run):
+
+        isScintRun = scintHits.run == run
+        offset = 0 if lastEvent is None else lastEvent - scintHits.event[isScintRun].min()
+        for hits in (scintHits, strawHits):
+            hits.event[hits.run == run] += offset
+        lastEvent = scintHits.event[isScintRun].max()
+
+
+def makeSyntheticInputs(seeds, options):
+
+    # Generates synthetic trees for each seed, in each of SYNTHETIC_VARIANTS. Returns list of
+    # (name, input name)
+    inputs = []
+    for seed in seeds:
+        for variant in ("float", "integer", "shuffled", "colliding"):
+
+            name = "synthetic seed %d, %s" % (seed, SYNTHETIC_VARIANTS[variant])
+            inputName = os.path.join(options.work_directory, "synthetic_%d_%s" % (seed, variant))
+            scintHits, strawHits = generate_hits.generateHits(seed=seed, runs=options.runs, eventsPerRun=options.events,
+                                                              integerTimes=variant in ("integer", "colliding"))
+
+            if variant == "shuffled":
+                random = numpy.random.RandomState(seed)
+                scintHits = shuffleEvents(scintHits, random)
+                strawHits = shuffleEvents(strawHits, random)
+            elif variant == "colliding":
+                collideRuns(scintHits, strawHits)
+
+            inputs.append((name, writeInput(inputName, scintHits, strawHits, options.root_inputs)))
+
+    return inputs
+
+
+def makeSelection(scintHits, options):
+
+    # Returns EventSelection for selection backends: runs and event range given by options, or by
+    # default all runs but the first, and the middle half of the range of event numbers
+    runs = options.select_runs
+    if runs is None:
+        runs = numpy.unique(scintHits.run).tolist()
+        runs = runs[1:] if len(runs) > 1 else runs
+
+    eventRange = options.select_events
+    if (eventRange is None) and (len(scintHits) > 0):
+        first, last = int(scintHits.event.min()), int(scintHits.event.max())
+        eventRange = (first + (last - first) // 4, last - (last - first) // 4)
+
+    return event_index.EventSelection(runs, eventRange)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Check analysis engines against the original per-entry loops, histogram by histogram")
+    parser.add_argument("--input", nargs="*", default=[],
+                        help="real inputs to check on: ROOT files, or directories of columns")
+    parser.add_argument("--seeds", type=int, nargs="*", default=[1, 2], help="seeds of synthetic trees to check on")
+    parser.add_argument("--runs", type=int, default=3, help="number of runs in synthetic trees")
+    parser.add_argument("--events", type=int, default=500, help="number of events in each run of synthetic trees")
+    parser.add_argument("--analyses", nargs="+", choices=ANALYSES, default=list(ANALYSES), help="analyses to check")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS), help="engines to check")
+    parser.add_argument("--cuts", type=float, nargs="+", default=[75, 500], help="delay time cuts, in ns")
+    parser.add_argument("--select-runs", type=int, nargs="+",
+                        help="runs selected by selection backends (all runs but the first if not given)")
+    parser.add_argument("--select-events", type=int, nargs=2, metavar=("FIRST", "LAST"),
+                        help="event numbers selected by selection backends (middle half of events if not given)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="number of entries in each chunk read by chunked engines")
+    parser.add_argument("--jobs", type=int, default=3, help="number of processes for multi-process engines")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="relative tolerance of sums for statistics, which may be added in another order")
+    parser.add_argument("--max-events", type=int, default=3, help="number of differing events to report for each difference")
+    parser.add_argument("--work-directory", help="directory for synthetic trees and partial results (temporary if not given)")
+    options = parser.parse_args()
+
+    # RDataFrame engine needs ROOT files, and a ROOT version with RDataFrame. Synthetic trees are
+    # written as ROOT files if any engine reading ROOT files only is checked
+    if ("rdataframe" in options.backends) and not rdf_delays.isAvailable():
+        print "RDataFrame not available, not checking rdataframe backend"
+        options.backends.remove("rdataframe")
+    options.root_inputs = any(backend in ROOT_ONLY for backend in options.backends)
+
+    inputNames = [os.path.abspath(inputName) for inputName in options.input]
+    isTemporary = not options.work_directory
+    options.work_directory = os.path.abspath(options.work_directory or tempfile.mkdtemp(prefix="equivalence-"))
+    if not os.path.isdir(options.work_directory):
+        os.makedirs(options.work_directory)
+
+    # Partial results of incremental engine, hit caches and event indexes are stored in work directory
+    os.chdir(options.work_directory)
+
+    checks = [Check(analysis, sorted(set(options.cuts))) for analysis in options.analyses]
+    nDiffering = 0
+    try:
+        inputs = makeSyntheticInputs(options.seeds, options) + [(inputName, inputName) for inputName in inputNames]
+        for name, inputName in inputs:
+
+            print ""
+            print "Input: " + name
+            inputFile, scintTree, strawTree = hit_cache.openTrees(inputName)
+            scintHits = hit_reader.readHits(scintTree)
+            strawHits = hit_reader.readHits(strawTree)
+            options.selection = makeSelection(scintHits, options)
+            print "Selection: runs %s, events %s" % (options.selection.runs, options.selection.eventRange)
+            removePartials()
+
+            for check in checks:
+                for backend in options.backends:
+
+                    if not check.hasBackend(backend):
+                        continue
+                    if (backend in ROOT_ONLY) and hit_cache.isColumnDirectory(inputName):
+                        print "  %-8s %-21s skipped, reads ROOT files only" % (check.analysis, backend)
+                        continue
+
+                    reference = check.runReference(*getReferenceHits(backend, scintHits, strawHits, options))
+                    differences = compareHistograms(reference, check.runEngine(backend, inputName, options),
+                                                    options.tolerance)
+                    if len(differences) == 0:
+                        print "  %-8s %-21s same as reference" % (check.analysis, backend)
+                        continue
+
+                    nDiffering += 1
+                    print "  %-8s %-21s DIFFERS from reference" % (check.analysis, backend)
+                    for difference in differences:
+                        print "    " + difference
+                    for key in findDifferingEvents(check, backend, scintHits, strawHits, options):
+                        print "    differing event: " + describeEvent(key, scintHits, strawHits)
+
+    finally:
+        if isTemporary:
+            shutil.rmtree(options.work_directory)
+
+    print ""
+    if nDiffering > 0:
+        print "%d engine results differ from reference" % nDiffering
+        return 1
+    print "All engine results same as reference"
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
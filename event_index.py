@@ -0,0 +1,229 @@
+#
+# Index of the entries of each hit tree by run and event, so that analyses of selected runs and
+# events (--runs, --event-range) read only the entries of those events.
+# The index holds the (run, event) key, and first and last entries, of each block of
+# consecutive entries with the same run and event number. The index of a ROOT tree is built with
+# one pass over its Run and Event branches the first time it is needed, and saved with the path, size and
+# modification time of the input file; it is built again whenever any of these change. Trees
+# read as arrays (from the hit cache, or a directory of columns) are indexed from their memory
+# mapped Run and Event columns when opened. The selected entries are read through
+# hit_reader.SelectedTree, as if they were the only entries of the tree, so the histograms are
+# those of trees holding only the selected events. The index also gives incremental.py the runs
+# of each tree, and the events and entry counts identifying their partial results, without
+# reading any hits. Run this module to build the index of an input file ahead of the analyses.
+#
+
+import argparse
+import errno
+import json
+import os
+
+import numpy
+
+import coincidence_engine
+import hit_cache
+import hit_reader
+
+
+# Directory holding indexes of input files
+INDEX_DIRECTORY = "event_index"
+
+# Version of index layout. Indexes with another version are built again
+INDEX_VERSION = 1
+
+
+class EventSelection:
+
+    # Class for selection of events by run number, and by range of event numbers within each run
+
+    def __init__(self, runs=None, eventRange=None):
+
+        # Get run numbers selected, and first and last event numbers selected (inclusive). None
+        # selects all runs, or all events
+        self.runs = sorted(set(runs)) if runs else None
+        self.eventRange = tuple(eventRange) if eventRange else None
+
+    def selectBlocks(self, keys):
+
+        # Returns whether each block of entries, given by its run and event key, is selected
+        selected = numpy.ones(len(keys), dtype=bool)
+        if self.runs is not None:
+            selected &= numpy.in1d(keys >> 32, self.runs)
+        if self.eventRange is not None:
+            events = keys & 0xffffffff
+            selected &= (events >= self.eventRange[0]) & (events <= self.eventRange[1])
+
+        return selected
+
+
+def makeSelection(runs=None, eventRange=None):
+
+    # Returns EventSelection of given runs and range of events, or None if neither is given
+    if (not runs) and (not eventRange):
+        return None
+    return EventSelection(runs, eventRange)
+
+
+def iterKeys(tree, chunkSize=hit_reader.DEFAULT_CHUNK_SIZE):
+
+    # Generator giving first entry, and run and event keys of entries, of each block of at most
+    # chunkSize entries of tree. Only the Run and Event branches of a ROOT tree are read
+    nEntries = tree.GetEntries()
+
+    if isinstance(tree, hit_reader.ArrayTree):
+        for start in xrange(0, nEntries, chunkSize):
+            hits = tree.hits.slice(start, min(start + chunkSize, nEntries))
+            yield start, coincidence_engine.eventKeys(hits.run, hits.event)
+        return
+
+    for start in xrange(0, nEntries, chunkSize):
+        with hit_reader.READ_LOCK:
+            tree.SetEstimate(chunkSize + 1)
+            count = tree.Draw("Run:Event", "", "goff", min(chunkSize, nEntries - start), start)
+            runs = hit_reader.bufferToArray(tree.GetV1(), count).astype(numpy.int64)
+            events = hit_reader.bufferToArray(tree.GetV2(), count).astype(numpy.int64)
+        yield start, coincidence_engine.eventKeys(runs, events)
+
+
+def indexTree(tree):
+
+    # Returns index of tree: arrays of run and event key, first entry, and last entry (exclusive)
+    # of each block of consecutive entries with the same run and event number
+    keyBlocks = []
+    firstBlocks = []
+    for start, keys in iterKeys(tree):
+        starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+        keyBlocks.append(keys[starts])
+        firstBlocks.append(start + starts)
+
+    keys = numpy.concatenate(keyBlocks) if len(keyBlocks) > 0 else numpy.zeros(0, dtype=numpy.int64)
+    firstEntries = numpy.concatenate(firstBlocks) if len(firstBlocks) > 0 else numpy.zeros(0, dtype=numpy.int64)
+
+    # Join blocks split between chunks
+    isStart = numpy.ones(len(keys), dtype=bool)
+    isStart[1:] = keys[1:] != keys[:-1]
+    keys = keys[isStart]
+    firstEntries = firstEntries[isStart].astype(numpy.int64)
+    lastEntries = numpy.append(firstEntries[1:], numpy.int64(tree.GetEntries()))
+
+    return keys, firstEntries, lastEntries
+
+
+def getIndexFileName(indexPath, treeName, suffix):
+
+    # Returns name of file holding index of given tree, or its key
+    return os.path.join(indexPath, os.path.basename(treeName) + suffix)
+
+
+def loadIndex(fileName, tree, treeName, indexDirectory=INDEX_DIRECTORY):
+
+    # Returns index of ROOT tree of input file, from index directory, building and saving it
+    # first if it is missing or was built from another version of input file. The index is
+    # written to a temporary file, which is moved into place once complete
+    indexPath = hit_cache.getCachePath(fileName, indexDirectory)
+    arraysFileName = getIndexFileName(indexPath, treeName, "_index.npz")
+    keyFileName = getIndexFileName(indexPath, treeName, "_key.json")
+    key = {"version": INDEX_VERSION, "file": hit_cache.getFileKey(fileName), "entries": tree.GetEntries()}
+
+    if os.path.isfile(keyFileName) and os.path.isfile(arraysFileName):
+        with open(keyFileName) as keyFile:
+            if json.load(keyFile) == key:
+                arrays = numpy.load(arraysFileName)
+                return arrays["keys"], arrays["firstEntries"], arrays["lastEntries"]
+
+    print "Building event index of " + treeName
+    keys, firstEntries, lastEntries = indexTree(tree)
+
+    try:
+        os.makedirs(indexPath)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+    with open(arraysFileName + ".tmp", "wb") as arraysFile:
+        numpy.savez(arraysFile, keys=keys, firstEntries=firstEntries, lastEntries=lastEntries)
+    os.rename(arraysFileName + ".tmp", arraysFileName)
+    with open(keyFileName, "w") as keyFile:
+        json.dump(key, keyFile, indent=2)
+
+    return keys, firstEntries, lastEntries
+
+
+def getIndex(fileName, tree, treeName):
+
+    # Returns index of tree of input file: saved for ROOT trees, made from the arrays of others
+    if isinstance(tree, hit_reader.ArrayTree):
+        return indexTree(tree)
+    return loadIndex(fileName, tree, treeName)
+
+
+def selectEntryRanges(index, selection):
+
+    # Returns list of (first, last) ranges of entries (last exclusive) of blocks of index selected,
+    # in order, joining blocks which follow on from each other
+    keys, firstEntries, lastEntries = index
+    selected = selection.selectBlocks(keys)
+    firstEntries = firstEntries[selected]
+    lastEntries = lastEntries[selected]
+
+    starts = numpy.flatnonzero(numpy.concatenate(([True], firstEntries[1:] != lastEntries[:-1])))
+    ends = numpy.append(starts[1:], len(firstEntries))
+    return [(int(firstEntries[start]), int(lastEntries[end - 1])) for start, end in zip(starts, ends) if end > start]
+
+
+def selectTree(fileName, tree, treeName, selection):
+
+    # Returns SelectedTree holding entries of tree of input file in selected events
+    return hit_reader.SelectedTree(tree, selectEntryRanges(getIndex(fileName, tree, treeName), selection))
+
+
+def selectIndex(index, selection):
+
+    # Returns index of blocks of given index selected, with entries numbered as entries of the
+    # SelectedTree holding them
+    keys, firstEntries, lastEntries = index
+    selected = selection.selectBlocks(keys)
+    counts = (lastEntries - firstEntries)[selected]
+    lastEntries = numpy.cumsum(counts)
+
+    return keys[selected], lastEntries - counts, lastEntries
+
+
+def getTreeIndex(fileName, tree, treeName, selection=None):
+
+    # Returns index of tree of input file, as opened by openTrees with the same selection
+    if selection is None:
+        return getIndex(fileName, tree, treeName)
+    return selectIndex(getIndex(fileName, tree.tree, treeName), selection)
+
+
+def openTrees(fileName=hit_reader.INPUT_FILE_NAME, useCache=False, selection=None):
+
+    # Returns input file, and its scintillator and straw trees, as hit_cache.openTrees. If
+    # selection is given, trees hold only the entries of the selected events
+    inputFile, scintTree, strawTree = hit_cache.openTrees(fileName, useCache)
+    if selection is None:
+        return inputFile, scintTree, strawTree
+
+    return (inputFile, selectTree(fileName, scintTree, hit_reader.SCINT_TREE_NAME, selection),
+            selectTree(fileName, strawTree, hit_reader.STRAW_TREE_NAME, selection))
+
+
+if __name__ == "__main__":
+
+    # Build index of input file ahead of the analyses, and show the events and entries of each run
+    parser = argparse.ArgumentParser(description="Build index of entries of each hit tree of input file by run and event")
+    parser.add_argument("--input", default=hit_reader.INPUT_FILE_NAME, help="input ROOT file")
+    args = parser.parse_args()
+
+    inputFile, scintTree, strawTree = hit_reader.openTrees(args.input)
+    for tree, treeName in ((scintTree, hit_reader.SCINT_TREE_NAME), (strawTree, hit_reader.STRAW_TREE_NAME)):
+
+        keys, firstEntries, lastEntries = loadIndex(args.input, tree, treeName)
+        runs = keys >> 32
+        print "%s: %d entries" % (treeName, tree.GetEntries())
+        for run in numpy.unique(runs):
+            inRun = runs == run
+            events = keys[inRun] & 0xffffffff
+            print "  run %d: events %d to %d, %d entries" % (run, events.min(), events.max(),
+                                                            (lastEntries[inRun] - firstEntries[inRun]).sum())
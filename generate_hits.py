@@ -0,0 +1,208 @@
+#
+# Generator of synthetic scintHits and strawHits trees, for benchmarks and for trying the analysis
+# scripts without the Lab3TreeDumper file.
+# Each event recording period holds a number of particles passing through the scintillators at
+# random times. Each particle strikes one scintillator, and for some particles the other
+# scintillator shortly after, then strikes a number of straws after a random delay. Noise hits
+# at random times are added to both trees. Trees are written ordered by run, event and hit time,
+# either as a ROOT file or as a directory of columns laid out as the hit cache, which the
+# analysis scripts read with --input.
+#
+
+import argparse
+import json
+import os
+import shutil
+
+import numpy
+import ROOT
+
+import hit_cache
+import hit_reader
+
+
+# Default settings of generated trees
+DEFAULT_SETTINGS = {
+    "runs": 3,                  # number of runs
+    "firstRun": 695,            # run number of first run
+    "eventsPerRun": 10000,      # number of events in each run
+    "window": 20000.0,          # length of event recording period, in ns
+    "particles": 2.0,           # mean number of particles in each event
+    "scintWires": 2,            # number of scintillator wires
+    "doubleFraction": 0.5,      # fraction of particles striking a second scintillator
+    "scintDelay": 20.0,         # mean delay of second scintillator strike, in ns
+    "scintNoise": 0.5,          # mean number of scintillator noise hits in each event
+    "strawWires": 64,           # number of straw wires
+    "strawHits": 3.0,           # mean number of straws struck by each particle
+    "strawDelay": 150.0,        # mean delay of straw strikes after particle, in ns
+    "strawNoise": 2.0,          # mean number of straw noise hits in each event
+    "integerTimes": False,      # whether hit times are whole ns, held as integers
+    "seed": 1,                  # seed of random number generator
+}
+
+
+def makeHits(eventIndex, wires, hitTimes, settings):
+
+    # Returns HitArrays of hits in given events (counted from first event of first run), on given
+    # wires at given times, ordered by run, event and hit time
+    order = numpy.lexsort((hitTimes, eventIndex))
+    eventIndex = eventIndex[order]
+
+    if settings["integerTimes"]:
+        hitTimes = numpy.floor(hitTimes[order]).astype(numpy.int64)
+    else:
+        hitTimes = hitTimes[order]
+
+    return hit_reader.HitArrays(settings["firstRun"] + eventIndex // settings["eventsPerRun"],
+                                eventIndex % settings["eventsPerRun"] + 1,
+                                wires[order].astype(numpy.int64), hitTimes)
+
+
+def generateHits(**options):
+
+    # Returns HitArrays of scintillator and straw hits, from default settings changed by options
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(options)
+
+    random = numpy.random.RandomState(settings["seed"])
+    nEvents = settings["runs"] * settings["eventsPerRun"]
+
+    # Event, time and scintillator struck of each particle
+    particleEvents = numpy.repeat(numpy.arange(nEvents), random.poisson(settings["particles"], nEvents))
+    nParticles = len(particleEvents)
+    particleTimes = random.uniform(0, settings["window"], nParticles)
+    particleWires = random.randint(0, settings["scintWires"], nParticles)
+
+    # Second scintillator strikes, on the next scintillator, and noise hits
+    isDouble = random.uniform(size=nParticles) < settings["doubleFraction"]
+    nNoise = random.poisson(settings["scintNoise"], nEvents)
+    noiseEvents = numpy.repeat(numpy.arange(nEvents), nNoise)
+
+    scintHits = makeHits(
+        numpy.concatenate((particleEvents, particleEvents[isDouble], noiseEvents)),
+        numpy.concatenate((particleWires, (particleWires[isDouble] + 1) % settings["scintWires"],
+                           random.randint(0, settings["scintWires"], len(noiseEvents)))),
+        numpy.concatenate((particleTimes,
+                           particleTimes[isDouble] + random.exponential(settings["scintDelay"], isDouble.sum()),
+                           random.uniform(0, settings["window"], len(noiseEvents)))),
+        settings)
+
+    # Straws struck after each particle, and noise hits
+    strawParticles = numpy.repeat(numpy.arange(nParticles), random.poisson(settings["strawHits"], nParticles))
+    nStrikes = len(strawParticles)
+    noiseEvents = numpy.repeat(numpy.arange(nEvents), random.poisson(settings["strawNoise"], nEvents))
+
+    strawHits = makeHits(
+        numpy.concatenate((particleEvents[strawParticles], noiseEvents)),
+        random.randint(0, settings["strawWires"], nStrikes + len(noiseEvents)),
+        numpy.concatenate((particleTimes[strawParticles] + random.exponential(settings["strawDelay"], nStrikes),
+                           random.uniform(0, settings["window"], len(noiseEvents)))),
+        settings)
+
+    return scintHits, strawHits
+
+
+def writeROOT(fileName, scintHits, strawHits):
+
+    # Writes hits to ROOT file, with trees and branches named as in Lab3TreeDumper files
+    outputFile = ROOT.TFile(fileName, "RECREATE")
+
+    for treeName, hits in ((hit_reader.SCINT_TREE_NAME, scintHits), (hit_reader.STRAW_TREE_NAME, strawHits)):
+
+        directoryName, treeName = treeName.split("/")
+        directory = outputFile.GetDirectory(directoryName) or outputFile.mkdir(directoryName)
+        directory.cd()
+        tree = ROOT.TTree(treeName, treeName)
+
+        # One value buffer for each branch, with type of its array
+        buffers = []
+        for branch, column in zip(hit_reader.HIT_BRANCHES, (hits.run, hits.event, hits.wire, hits.hitTime)):
+            isInteger = numpy.issubdtype(column.dtype, numpy.integer)
+            buffers.append(numpy.zeros(1, dtype=numpy.int32 if isInteger else numpy.float64))
+            tree.Branch(branch, buffers[-1], branch + ("/I" if isInteger else "/D"))
+
+        # Fill tree one entry at a time
+        columns = (hits.run, hits.event, hits.wire, hits.hitTime)
+        for i in xrange(len(hits)):
+            for buffer, column in zip(buffers, columns):
+                buffer[0] = column[i]
+            tree.Fill()
+
+        tree.Write()
+
+    outputFile.Close()
+
+
+def writeColumns(directoryName, scintHits, strawHits, settings):
+
+    # Writes hits to directory of columns, laid out as the hit cache, replacing any already there
+    if os.path.exists(directoryName):
+        shutil.rmtree(directoryName)
+    os.makedirs(directoryName)
+
+    trees = dict()
+    for treeName, hits in ((hit_reader.SCINT_TREE_NAME, scintHits), (hit_reader.STRAW_TREE_NAME, strawHits)):
+        hit_cache.writeHits(hits, treeName, directoryName)
+        trees[treeName] = {"entries": len(hits), "sorted": True}
+
+    with open(os.path.join(directoryName, hit_cache.KEY_FILE_NAME), "w") as keyFile:
+        json.dump({"version": hit_cache.CACHE_VERSION, "generated": settings, "trees": trees}, keyFile, indent=2)
+
+
+def generate(outputName, outputFormat="columns", **options):
+
+    # Generates hits from default settings changed by options, and writes them to ROOT file or
+    # directory of columns
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(options)
+
+    scintHits, strawHits = generateHits(**settings)
+    if outputFormat == "root":
+        writeROOT(outputName, scintHits, strawHits)
+    else:
+        writeColumns(outputName, scintHits, strawHits, settings)
+
+    return len(scintHits), len(strawHits)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Generate synthetic scintHits and strawHits trees")
+    parser.add_argument("output", help="output ROOT file, or directory of columns")
+    parser.add_argument("--format", choices=["root", "columns"], default="columns",
+                        help="write ROOT file, or directory of columns laid out as the hit cache")
+    parser.add_argument("--runs", type=int, default=DEFAULT_SETTINGS["runs"], help="number of runs")
+    parser.add_argument("--first-run", type=int, default=DEFAULT_SETTINGS["firstRun"], help="run number of first run")
+    parser.add_argument("--events", type=int, default=DEFAULT_SETTINGS["eventsPerRun"], help="number of events in each run")
+    parser.add_argument("--window", type=float, default=DEFAULT_SETTINGS["window"],
+                        help="length of event recording period, in ns")
+    parser.add_argument("--particles", type=float, default=DEFAULT_SETTINGS["particles"],
+                        help="mean number of particles in each event")
+    parser.add_argument("--scint-wires", type=int, default=DEFAULT_SETTINGS["scintWires"],
+                        help="number of scintillator wires")
+    parser.add_argument("--double-fraction", type=float, default=DEFAULT_SETTINGS["doubleFraction"],
+                        help="fraction of particles striking a second scintillator")
+    parser.add_argument("--scint-delay", type=float, default=DEFAULT_SETTINGS["scintDelay"],
+                        help="mean delay of second scintillator strike, in ns")
+    parser.add_argument("--scint-noise", type=float, default=DEFAULT_SETTINGS["scintNoise"],
+                        help="mean number of scintillator noise hits in each event")
+    parser.add_argument("--straw-wires", type=int, default=DEFAULT_SETTINGS["strawWires"], help="number of straw wires")
+    parser.add_argument("--straw-hits", type=float, default=DEFAULT_SETTINGS["strawHits"],
+                        help="mean number of straws struck by each particle")
+    parser.add_argument("--straw-delay", type=float, default=DEFAULT_SETTINGS["strawDelay"],
+                        help="mean delay of straw strikes after particle, in ns")
+    parser.add_argument("--straw-noise", type=float, default=DEFAULT_SETTINGS["strawNoise"],
+                        help="mean number of straw noise hits in each event")
+    parser.add_argument("--integer-times", action="store_true", help="give hit times in whole ns, as integers")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SETTINGS["seed"], help="seed of random number generator")
+    args = parser.parse_args()
+
+    nScint, nStraw = generate(args.output, args.format, runs=args.runs, firstRun=args.first_run,
+                              eventsPerRun=args.events, window=args.window, particles=args.particles,
+                              scintWires=args.scint_wires, doubleFraction=args.double_fraction,
+                              scintDelay=args.scint_delay, scintNoise=args.scint_noise,
+                              strawWires=args.straw_wires, strawHits=args.straw_hits,
+                              strawDelay=args.straw_delay, strawNoise=args.straw_noise,
+                              integerTimes=args.integer_times, seed=args.seed)
+
+    print "Wrote %d scintillator hits and %d straw hits to %s" % (nScint, nStraw, args.output)
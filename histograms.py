@@ -0,0 +1,235 @@
+#
+# Histograms with fixed binning held in NumPy arrays, and helpers for filling ROOT histograms
+# from NumPy arrays.
+# Histogram is filled from whole arrays at once, and is only turned into a ROOT TH1 or TH2 for
+# drawing and writing, so analyses can fill and merge histograms without calling into ROOT.
+#
+
+import numpy
+
+
+def fillHistogram(hist, xValues, yValues=None):
+
+    # Fills histogram with each value in array (or each x, y pair for 2D histograms), in a single
+    # call to FillN. Unit weights are passed so the bin contents, errors and statistics are the
+    # same as calling Fill once per value, in order
+    nValues = len(xValues)
+    if nValues == 0:
+        return
+
+    xValues = numpy.ascontiguousarray(xValues, dtype=numpy.float64)
+    weights = numpy.ones(nValues, dtype=numpy.float64)
+
+    if yValues is None:
+        hist.FillN(nValues, xValues, weights)
+    else:
+        yValues = numpy.ascontiguousarray(yValues, dtype=numpy.float64)
+        hist.FillN(nValues, xValues, yValues, weights)
+
+
+# Returns suffix for names of histograms and plots made with given delay cut time
+def cutSuffix(cutTime):
+    return "%gns" % cutTime
+
+
+def findBins(values, nBins, low, high):
+
+    # Returns bin number of each value on an axis of nBins fixed bins from low to high, as
+    # TAxis::FindFixBin: 0 for underflow, nBins + 1 for overflow (including NaN)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    bins = numpy.empty(len(values), dtype=numpy.int64)
+
+    # NaN is neither below low nor below high, so goes to overflow
+    with numpy.errstate(invalid="ignore"):
+        isUnderflow = values < low
+        isOverflow = ~(values < high) & ~isUnderflow
+    inRange = ~(isUnderflow | isOverflow)
+
+    bins[isUnderflow] = 0
+    bins[isOverflow] = nBins + 1
+    bins[inRange] = 1 + (nBins * (values[inRange] - low) / (high - low)).astype(numpy.int64)
+
+    return bins
+
+
+class Histogram:
+
+    # Class for a 1D or 2D histogram with fixed binning, following the conventions of ROOT: bin 0
+    # is underflow and bin nBins + 1 overflow on each axis, entries count every fill, and the sums
+    # for the statistics (mean, RMS) only include fills within range on every axis
+
+    def __init__(self, nBinsX, xLow, xHigh, nBinsY=None, yLow=None, yHigh=None):
+
+        # Get binning for each axis (no y axis for 1D histogram)
+        self.binsX = (nBinsX, float(xLow), float(xHigh))
+        self.binsY = None if nBinsY is None else (nBinsY, float(yLow), float(yHigh))
+
+        # Sum of weights, and sum of squared weights, in each bin including underflow and
+        # overflow. Bins are numbered as global bins of ROOT: x bin + (nBinsX + 2) * y bin
+        nCells = (nBinsX + 2) * (1 if nBinsY is None else nBinsY + 2)
+        self.contents = numpy.zeros(nCells, dtype=numpy.float64)
+        self.sumw2 = numpy.zeros(nCells, dtype=numpy.float64)
+
+        # Number of fills, and sums for statistics as TH1::GetStats: sum of weights, sum of
+        # squared weights, sum of weight * x, sum of weight * x^2 (and for 2D, sum of weight * y,
+        # sum of weight * y^2, sum of weight * x * y)
+        self.entries = 0
+        self.stats = numpy.zeros(4 if nBinsY is None else 7, dtype=numpy.float64)
+
+    # Returns number of axes of histogram
+    def getDimension(self):
+        return 1 if self.binsY is None else 2
+
+    def fill(self, xValues, yValues=None, weights=None):
+
+        # Fill histogram with each value in array (or each x, y pair for 2D histograms), with
+        # weights given, or unit weights
+        xValues = numpy.asarray(xValues, dtype=numpy.float64)
+        if weights is None:
+            weights = numpy.ones(len(xValues), dtype=numpy.float64)
+        else:
+            weights = numpy.asarray(weights, dtype=numpy.float64)
+
+        binsX = findBins(xValues, *self.binsX)
+        inRange = (binsX > 0) & (binsX <= self.binsX[0])
+
+        if self.binsY is None:
+            cells = binsX
+        else:
+            yValues = numpy.asarray(yValues, dtype=numpy.float64)
+            binsY = findBins(yValues, *self.binsY)
+            inRange &= (binsY > 0) & (binsY <= self.binsY[0])
+            cells = binsX + (self.binsX[0] + 2) * binsY
+
+        self.contents += numpy.bincount(cells, weights, minlength=len(self.contents))
+        self.sumw2 += numpy.bincount(cells, weights * weights, minlength=len(self.contents))
+        self.entries += len(xValues)
+
+        # Statistics use fills within range only
+        w = weights[inRange]
+        x = xValues[inRange]
+        sums = [w.sum(), (w * w).sum(), (w * x).sum(), (w * x * x).sum()]
+        if self.binsY is not None:
+            y = yValues[inRange]
+            sums += [(w * y).sum(), (w * y * y).sum(), (w * x * y).sum()]
+        self.stats += sums
+
+    # Returns sums of weights in bins within range on every axis (no underflow or overflow)
+    def getInRangeContents(self):
+        if self.binsY is None:
+            return self.contents[1:-1]
+        return self.contents.reshape((self.binsY[0] + 2, self.binsX[0] + 2))[1:-1, 1:-1].ravel()
+
+    # Returns sum of weights within range, as TH1::Integral
+    def integral(self):
+        return self.getInRangeContents().sum()
+
+    # Returns highest bin content within range, as content of TH1::GetMaximumBin
+    def maximum(self):
+        return self.getInRangeContents().max()
+
+    def scale(self, factor):
+
+        # Multiply contents by factor, as TH1::Scale: errors and statistics are scaled to match,
+        # and number of entries is kept
+        self.contents *= factor
+        self.sumw2 *= factor * factor
+        self.stats[0] *= factor
+        self.stats[1] *= factor * factor
+        self.stats[2:] *= factor
+
+    # Returns whether other histogram has the same binning as this one
+    def isCompatible(self, other):
+        return (self.binsX == other.binsX) and (self.binsY == other.binsY)
+
+    def add(self, other):
+
+        # Add contents of another histogram with the same binning (e.g. for another part of the
+        # trees), as TH1::Add
+        if not self.isCompatible(other):
+            raise ValueError("Can not add histograms with different binning")
+
+        self.contents += other.contents
+        self.sumw2 += other.sumw2
+        self.entries += other.entries
+        self.stats += other.stats
+
+    def toROOT(self, rootClass, name, title):
+
+        # Returns new ROOT histogram of given class (e.g. ROOT.TH1D, ROOT.TH2D) with contents,
+        # errors, entries and statistics of this histogram
+        if self.binsY is None:
+            hist = rootClass(name, title, *self.binsX)
+        else:
+            hist = rootClass(name, title, *(self.binsX + self.binsY))
+
+        hist.SetContent(self.contents)
+
+        # Errors are only stored if any weight was not 1, as for ROOT histograms filled without
+        # Sumw2
+        if not numpy.array_equal(self.sumw2, self.contents):
+            hist.Sumw2()
+            hist.SetError(numpy.sqrt(self.sumw2))
+
+        hist.PutStats(self.stats.copy())
+        hist.SetEntries(self.entries)
+
+        return hist
+
+    @staticmethod
+    def fromROOT(hist):
+
+        # Returns Histogram with contents, errors, entries and statistics of ROOT histogram, which
+        # must have fixed binning
+        axes = [hist.GetXaxis()] if hist.GetDimension() == 1 else [hist.GetXaxis(), hist.GetYaxis()]
+        if (hist.GetDimension() > 2) or any(axis.GetXbins().GetSize() > 0 for axis in axes):
+            raise ValueError("Histogram " + hist.GetName() + " does not have fixed binning in 1 or 2 dimensions")
+
+        binning = []
+        for axis in axes:
+            binning += [axis.GetNbins(), axis.GetXmin(), axis.GetXmax()]
+        result = Histogram(*binning)
+
+        cells = xrange(len(result.contents))
+        result.contents[:] = [hist.GetBinContent(cell) for cell in cells]
+        if hist.GetSumw2N() > 0:
+            result.sumw2[:] = [hist.GetBinError(cell) ** 2 for cell in cells]
+        else:
+            result.sumw2[:] = result.contents
+
+        stats = numpy.zeros(13, dtype=numpy.float64)
+        hist.GetStats(stats)
+        result.stats[:] = stats[:len(result.stats)]
+        result.entries = int(round(hist.GetEntries()))
+
+        return result
+
+
+def normaliseHistograms(hists, modes, names=None):
+
+    # Scales each histogram in list by one over its integral ("integral") or over its highest bin
+    # ("maximum"), or leaves it as it is (None), with one mode given for each histogram. All
+    # factors are found before any histogram is scaled. A histogram with nothing to normalise by
+    # raises ValueError, naming it by its entry in names if given
+    if names is None:
+        names = ["%d" % index for index in xrange(len(hists))]
+
+    factors = []
+    for hist, mode, name in zip(hists, modes, names):
+        if mode == "integral":
+            norm = hist.integral()
+        elif mode == "maximum":
+            norm = hist.maximum()
+        elif mode is None:
+            factors.append(None)
+            continue
+        else:
+            raise ValueError("Unknown normalisation " + str(mode))
+
+        if norm == 0:
+            raise ValueError("Can not normalise histogram %s by its %s, which is 0" % (name, mode))
+        factors.append(1.0 / norm)
+
+    for hist, factor in zip(hists, factors):
+        if factor is not None:
+            hist.scale(factor)
@@ -0,0 +1,331 @@
+#
+# Memory-mapped columnar cache of the scintHits and strawHits trees.
+# The Run, Event, Wire and HitTime branches of each tree are read once, sorted by run, event and
+# hit time, and saved as one .npy file per branch. Later runs map these files into memory rather
+# than decompressing the trees again, and only page in the parts of the columns they use.
+# Trees are sorted in bounded memory: runs of entries are sorted in memory and written out, then
+# merged, so trees larger than memory can be cached. Whether each tree was already in order is
+# kept with the cache, and the analyses can rely on the cached trees being in order.
+# The cache is kept with the path, size and modification time of the input file, and is built
+# again whenever any of these change. Run this module to build the cache ahead of the analyses.
+#
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy
+
+import coincidence_engine
+import hit_reader
+
+
+# Directory holding caches of input files
+CACHE_DIRECTORY = "hit_cache"
+
+# Version of cache layout. Caches with another version are built again
+CACHE_VERSION = 1
+
+# Name of file in cache holding input file key and details of each tree
+KEY_FILE_NAME = "key.json"
+
+# Number of entries sorted in memory at once. Larger trees are sorted in runs of this many
+# entries, which are then merged
+SORT_RUN_SIZE = 4000000
+
+# Number of entries of all runs held in memory at once while merging
+MERGE_BUFFER_SIZE = 4000000
+
+
+class CacheError(Exception):
+    pass
+
+
+def getCachePath(fileName, cacheDirectory=CACHE_DIRECTORY):
+
+    # Returns directory holding cache of given input file, named from the input file name and its
+    # full path, so that input files with the same name in different places are kept apart
+    path = os.path.realpath(fileName)
+    return os.path.join(cacheDirectory, os.path.basename(path) + "-" + hashlib.md5(path).hexdigest()[:12])
+
+
+def getFileKey(fileName):
+
+    # Returns key identifying version of input file: its full path, size and modification time
+    status = os.stat(fileName)
+    return {"path": os.path.realpath(fileName), "size": status.st_size, "mtime": status.st_mtime}
+
+
+def getColumnFileName(cachePath, treeName, branch):
+
+    # Returns name of file holding given branch of given tree in cache
+    return os.path.join(cachePath, "%s_%s.npy" % (os.path.basename(treeName), branch))
+
+
+def readKey(cachePath):
+
+    # Returns contents of key file of cache, or None if it has none
+    keyFileName = os.path.join(cachePath, KEY_FILE_NAME)
+    if not os.path.isfile(keyFileName):
+        return None
+
+    with open(keyFileName) as keyFile:
+        return json.load(keyFile)
+
+
+def isCacheValid(fileName, cachePath):
+
+    # Returns whether cache at given path was built from the current version of input file
+    key = readKey(cachePath)
+    return (key is not None) and (key.get("version") == CACHE_VERSION) and (key.get("file") == getFileKey(fileName))
+
+
+def openColumns(cachePath, treeName, types, nEntries, suffix=""):
+
+    # Returns new memory-mapped column files for each branch of tree in cache, of given types and
+    # length. Suffix is added to file names, for temporary columns
+    return [numpy.lib.format.open_memmap(getColumnFileName(cachePath, treeName, branch) + suffix, mode="w+",
+                                         dtype=dtype, shape=(nEntries,))
+            for branch, dtype in zip(hit_reader.HIT_BRANCHES, types)]
+
+
+def isAtOrBefore(keys, hitTimes, positions, bound):
+
+    # Returns whether each hit, given by event key, hit time and position, comes at or before
+    # bound (key, hit time, position) in order of event key, hit time, then position. As in
+    # sortOrder, NaN hit times come after all others
+    boundKey, boundTime, boundPosition = bound
+    if numpy.isnan(boundTime):
+        timeBefore = ~numpy.isnan(hitTimes)
+        timeEqual = numpy.isnan(hitTimes)
+    else:
+        timeBefore = hitTimes < boundTime
+        timeEqual = hitTimes == boundTime
+
+    return (keys < boundKey) | ((keys == boundKey) & (timeBefore | (timeEqual & (positions <= boundPosition))))
+
+
+def getBound(keys, hitTimes, positions, index):
+
+    # Returns (key, hit time, position) of hit at index, for isAtOrBefore
+    return keys[index], hitTimes[index], positions[index]
+
+
+def getBoundOrder(bound):
+
+    # Returns value ordering bounds as isAtOrBefore does, with NaN hit times after all others
+    key, hitTime, position = bound
+    isNaN = bool(numpy.isnan(hitTime))
+    return key, isNaN, 0 if isNaN else hitTime, position
+
+
+def writeTree(tree, treeName, cachePath):
+
+    # Reads hits from tree, sorts them by run, event and hit time, and saves each branch in cache.
+    # Each run of SORT_RUN_SIZE entries is sorted in memory and saved, and runs are then merged,
+    # unless the tree was in order already. Returns details of tree for key file: number of
+    # entries, whether tree was already sorted, and number of runs sorted
+    nEntries = tree.GetEntries()
+    types = hit_reader.getBranchTypes(tree)
+    runColumns = openColumns(cachePath, treeName, types, nEntries, ".runs")
+
+    # Sort each run, checking whether it, and the join with the run before it, is in order
+    runStarts = [0]
+    isSorted = True
+    for hits in hit_reader.iterHits(tree, SORT_RUN_SIZE):
+
+        order = coincidence_engine.sortOrder(hits)
+        keys = coincidence_engine.eventKeys(hits.run, hits.event)
+        start = runStarts[-1]
+
+        if isSorted and (start > 0):
+            lastKeys = coincidence_engine.eventKeys(runColumns[0][start - 1:start], runColumns[1][start - 1:start])
+            lastHit = getBound(lastKeys, runColumns[3][start - 1:start], numpy.array([start - 1]), 0)
+            isSorted = not isAtOrBefore(keys[:1], hits.hitTime[:1], numpy.array([start]), lastHit)[0]
+        isSorted = isSorted and bool(numpy.all(order == numpy.arange(len(order))))
+
+        for runColumn, column in zip(runColumns, (hits.run, hits.event, hits.wire, hits.hitTime)):
+            runColumn[start:start + len(hits)] = column[order]
+        runStarts.append(start + len(hits))
+
+    # Runs in order already form the sorted columns
+    runFileNames = []
+    for runColumn in runColumns:
+        runColumn.flush()
+        runFileNames.append(runColumn.filename)
+
+    if isSorted:
+        del runColumns
+        for branch, runFileName in zip(hit_reader.HIT_BRANCHES, runFileNames):
+            os.rename(runFileName, getColumnFileName(cachePath, treeName, branch))
+    else:
+        mergeRuns(runColumns, runStarts, openColumns(cachePath, treeName, types, nEntries))
+        del runColumns
+        for runFileName in runFileNames:
+            os.remove(runFileName)
+
+    return {"entries": nEntries, "sorted": isSorted, "runs": len(runStarts) - 1}
+
+
+def mergeRuns(runColumns, runStarts, columns):
+
+    # Merges runs of sorted hits in runColumns (run, event, wire and hit time columns, with each
+    # run from one of runStarts to the next) into columns, holding at most about
+    # MERGE_BUFFER_SIZE hits of all runs at once. Hits sorting equal keep their order in the tree,
+    # as the runs hold them in that order
+    nRuns = len(runStarts) - 1
+    bufferSize = max(MERGE_BUFFER_SIZE // nRuns, 1000)
+
+    # Event key, hit time and position in runColumns of hits of each run read but not yet merged,
+    # and position of next hit of each run to read
+    buffers = [None] * nRuns
+    nextRead = list(runStarts[:-1])
+
+    written = 0
+    while written < len(columns[0]):
+
+        # Read more hits of each run whose buffer is running low
+        for run in xrange(nRuns):
+
+            held = 0 if buffers[run] is None else len(buffers[run][0])
+            if (held >= bufferSize // 2) or (nextRead[run] == runStarts[run + 1]):
+                continue
+
+            stop = min(nextRead[run] + bufferSize - held, runStarts[run + 1])
+            positions = numpy.arange(nextRead[run], stop)
+            read = (coincidence_engine.eventKeys(runColumns[0][nextRead[run]:stop], runColumns[1][nextRead[run]:stop]),
+                    numpy.asarray(runColumns[3][nextRead[run]:stop]), positions)
+            buffers[run] = read if buffers[run] is None else tuple(numpy.concatenate(pair) for pair in zip(buffers[run], read))
+            nextRead[run] = stop
+
+        # Every hit not yet read comes after the last hit read from its run, so hits up to the
+        # earliest of these, for runs not read to the end, can be merged
+        bounds = [getBound(buffers[run][0], buffers[run][1], buffers[run][2], -1) for run in xrange(nRuns)
+                  if nextRead[run] < runStarts[run + 1]]
+        bound = min(bounds, key=getBoundOrder) if len(bounds) > 0 else None
+
+        # Take hits up to bound from start of each buffer, sort them together and write them
+        blocks = []
+        for run in xrange(nRuns):
+
+            if (buffers[run] is None) or (len(buffers[run][0]) == 0):
+                continue
+
+            if bound is None:
+                nTaken = len(buffers[run][0])
+            else:
+                nTaken = int(numpy.count_nonzero(isAtOrBefore(buffers[run][0], buffers[run][1], buffers[run][2], bound)))
+
+            blocks.append(tuple(array[:nTaken] for array in buffers[run]))
+            buffers[run] = tuple(array[nTaken:] for array in buffers[run])
+
+        keys, hitTimes, positions = [numpy.concatenate([block[i] for block in blocks]) for i in xrange(3)]
+        positions = positions[numpy.lexsort((positions, hitTimes, keys))]
+
+        for column, runColumn in zip(columns, runColumns):
+            column[written:written + len(positions)] = runColumn[positions]
+        written += len(positions)
+
+    for column in columns:
+        column.flush()
+
+
+def writeHits(hits, treeName, cachePath):
+
+    # Saves each branch of hits as a column of given tree in cache
+    for branch, column in zip(hit_reader.HIT_BRANCHES, (hits.run, hits.event, hits.wire, hits.hitTime)):
+        numpy.save(getColumnFileName(cachePath, treeName, branch), column)
+
+
+def buildCache(fileName, cachePath):
+
+    # Builds cache of both trees of input file at given path, replacing any cache already there.
+    # Cache is written to a temporary directory, which is only moved into place once complete
+    print "Building hit cache " + cachePath
+
+    temporaryPath = cachePath + ".tmp"
+    if os.path.exists(temporaryPath):
+        shutil.rmtree(temporaryPath)
+    os.makedirs(temporaryPath)
+
+    inputFile, scintTree, strawTree = hit_reader.openTrees(fileName)
+    if (not scintTree) or (not strawTree):
+        raise CacheError("Could not read hit trees from " + fileName)
+
+    trees = dict()
+    for tree, treeName in ((scintTree, hit_reader.SCINT_TREE_NAME), (strawTree, hit_reader.STRAW_TREE_NAME)):
+        trees[treeName] = writeTree(tree, treeName, temporaryPath)
+
+    with open(os.path.join(temporaryPath, KEY_FILE_NAME), "w") as keyFile:
+        json.dump({"version": CACHE_VERSION, "file": getFileKey(fileName), "trees": trees}, keyFile, indent=2)
+
+    if os.path.exists(cachePath):
+        shutil.rmtree(cachePath)
+    os.rename(temporaryPath, cachePath)
+
+
+def openCachedTree(cachePath, treeName):
+
+    # Returns ArrayTree for tree in cache, with each branch memory mapped
+    columns = [numpy.load(getColumnFileName(cachePath, treeName, branch), mmap_mode="r")
+               for branch in hit_reader.HIT_BRANCHES]
+    return hit_reader.ArrayTree(hit_reader.HitArrays(*columns))
+
+
+def openCache(fileName=hit_reader.INPUT_FILE_NAME, cacheDirectory=CACHE_DIRECTORY):
+
+    # Returns scintillator and straw trees of input file from cache, building cache first if it
+    # is missing or was built from another version of input file
+    cachePath = getCachePath(fileName, cacheDirectory)
+    if not isCacheValid(fileName, cachePath):
+        buildCache(fileName, cachePath)
+
+    key = readKey(cachePath)
+    for treeName in (hit_reader.SCINT_TREE_NAME, hit_reader.STRAW_TREE_NAME):
+        if not key["trees"][treeName]["sorted"]:
+            print "Note: " + treeName + " is not ordered by run, event and hit time, so cache holds it reordered"
+
+    return (openCachedTree(cachePath, hit_reader.SCINT_TREE_NAME),
+            openCachedTree(cachePath, hit_reader.STRAW_TREE_NAME))
+
+
+def isColumnDirectory(fileName):
+
+    # Returns whether input is a directory of columns laid out as a cache (e.g. from
+    # generate_hits.py), rather than a ROOT file
+    return os.path.isdir(fileName) and os.path.isfile(os.path.join(fileName, KEY_FILE_NAME))
+
+
+def openTrees(fileName=hit_reader.INPUT_FILE_NAME, useCache=False):
+
+    # Returns input file, and its scintillator and straw trees, as hit_reader.openTrees. If
+    # useCache, trees are read from cache, and no file is returned. Trees of a directory of
+    # columns are always read from it directly
+    if isColumnDirectory(fileName):
+        return (None, openCachedTree(fileName, hit_reader.SCINT_TREE_NAME),
+                openCachedTree(fileName, hit_reader.STRAW_TREE_NAME))
+
+    if useCache:
+        scintTree, strawTree = openCache(fileName)
+        return None, scintTree, strawTree
+
+    return hit_reader.openTrees(fileName)
+
+
+if __name__ == "__main__":
+
+    # Build cache of input file ahead of the analyses, sorting trees where needed
+    parser = argparse.ArgumentParser(description="Build hit cache of input file, with trees sorted by run, event and hit time")
+    parser.add_argument("--input", default=hit_reader.INPUT_FILE_NAME, help="input ROOT file")
+    parser.add_argument("--rebuild", action="store_true", help="build cache again, even if up to date")
+    args = parser.parse_args()
+
+    cachePath = getCachePath(args.input)
+    if args.rebuild or not isCacheValid(args.input, cachePath):
+        buildCache(args.input, cachePath)
+
+    for treeName, details in sorted(readKey(cachePath)["trees"].items()):
+        print "%s: %d entries, %s" % (treeName, details["entries"],
+                                      "in order" if details["sorted"] else "reordered (sorted in %d runs)" % details.get("runs", 1))
@@ -0,0 +1,359 @@
+#
+# Shared reader for the scintHits and strawHits trees.
+# Reads the Run, Event, Wire and HitTime branches as NumPy arrays, a bounded number of entries
+# at a time, using TTree::Draw so that each chunk costs a few calls into ROOT rather than
+# several calls per entry. The next chunks of a tree are read on a background thread while the
+# current one is analysed, holding a bounded number of chunks at once.
+#
+
+import Queue
+import sys
+import threading
+
+import numpy
+import ROOT
+
+
+# Input file read by the analysis scripts, and names of its hit trees
+INPUT_FILE_NAME = "Lab3TreeDumper_00695_00696_00697_00698_00699_00702_00706_00707_00708.root"
+SCINT_TREE_NAME = "professorTreeDumper/scintHits"
+STRAW_TREE_NAME = "professorTreeDumper/strawHits"
+
+# Branches read from each hit tree
+HIT_BRANCHES = ("Run", "Event", "Wire", "HitTime")
+
+# Default number of tree entries read in each chunk
+DEFAULT_CHUNK_SIZE = 1000000
+
+# Default number of chunks of a tree held at once when reading ahead: the chunk being analysed,
+# and those read after it on a background thread (2 for double buffering). With fewer than 2,
+# each chunk is read when asked for
+PREFETCH_CHUNKS = 2
+
+# Lock held while reading a chunk from a ROOT tree, so that trees of one file read ahead on
+# separate threads are not read at the same time
+READ_LOCK = threading.Lock()
+
+# ROOT leaf types read as integers. PyROOT hands these back as Python ints, so they are kept as
+# integers here to give the same arithmetic (e.g. integer division) as the per-entry loops
+INTEGER_LEAF_TYPES = ("Char_t", "UChar_t", "Short_t", "UShort_t", "Int_t", "UInt_t",
+                      "Long_t", "ULong_t", "Long64_t", "ULong64_t", "Bool_t")
+
+
+class HitArrays:
+
+    # Class for a block of consecutive tree entries, held as one NumPy array per branch
+
+    def __init__(self, run, event, wire, hitTime, firstEntry=0):
+
+        # Get arrays for each branch, and tree entry number of first hit in block
+        self.run = run
+        self.event = event
+        self.wire = wire
+        self.hitTime = hitTime
+        self.firstEntry = firstEntry
+
+    # Returns number of hits in block
+    def __len__(self):
+        return len(self.run)
+
+    # Returns block holding hits start to stop (relative to start of this block)
+    def slice(self, start, stop):
+        return HitArrays(self.run[start:stop], self.event[start:stop], self.wire[start:stop],
+                         self.hitTime[start:stop], self.firstEntry + start)
+
+    # Returns block holding hits before tree entry lastEntry (all hits if lastEntry is None)
+    def limit(self, lastEntry):
+        if lastEntry is None:
+            return self
+        return self.slice(0, max(lastEntry - self.firstEntry, 0))
+
+    # Returns block with hits reordered by given index array
+    def take(self, index):
+        return HitArrays(self.run[index], self.event[index], self.wire[index],
+                         self.hitTime[index], self.firstEntry)
+
+    # Returns single block joining list of blocks, in order given
+    @staticmethod
+    def concatenate(blocks, dtypes=None):
+
+        # If no blocks, return empty block, with types given if any
+        if len(blocks) == 0:
+            if dtypes is None:
+                dtypes = (numpy.int64, numpy.int64, numpy.int64, numpy.float64)
+            return HitArrays(*[numpy.zeros(0, dtype=dtype) for dtype in dtypes])
+
+        return HitArrays(numpy.concatenate([block.run for block in blocks]),
+                         numpy.concatenate([block.event for block in blocks]),
+                         numpy.concatenate([block.wire for block in blocks]),
+                         numpy.concatenate([block.hitTime for block in blocks]),
+                         blocks[0].firstEntry)
+
+
+class ArrayTree:
+
+    # Class standing in for a hit tree whose branches are already held as arrays (e.g. memory
+    # mapped from the hit cache). Entries are read by slicing the arrays, so only the parts of
+    # them used are paged in
+
+    def __init__(self, hits):
+
+        # Get HitArrays holding every entry of tree
+        self.hits = hits
+
+    # Returns number of entries in tree, as TTree::GetEntries
+    def GetEntries(self):
+        return len(self.hits)
+
+    # Returns type of array held for each hit branch
+    def getBranchTypes(self):
+        return [self.hits.run.dtype, self.hits.event.dtype, self.hits.wire.dtype, self.hits.hitTime.dtype]
+
+
+class SelectedTree:
+
+    # Class standing in for a hit tree holding only selected ranges of entries of another tree (a
+    # ROOT tree or ArrayTree), as if they were its only entries. Entries are numbered from 0
+    # across the ranges, in order, and only entries within the ranges are read
+
+    def __init__(self, tree, entryRanges):
+
+        # Get tree, and list of (first, last) ranges of its entries (last exclusive), in order.
+        # Keep number of first selected entry of each range, and of entry after last range
+        self.tree = tree
+        self.entryRanges = entryRanges
+        self.rangeStarts = numpy.cumsum([0] + [last - first for first, last in entryRanges])
+
+    # Returns number of selected entries, as TTree::GetEntries
+    def GetEntries(self):
+        return int(self.rangeStarts[-1])
+
+    # Returns type of array held for each hit branch, as of tree
+    def getBranchTypes(self):
+        return getBranchTypes(self.tree)
+
+    def getTreeRanges(self, firstEntry, lastEntry):
+
+        # Returns list of (first, last) ranges of entries of tree holding selected entries
+        # firstEntry to lastEntry (exclusive)
+        treeRanges = []
+        index = max(numpy.searchsorted(self.rangeStarts, firstEntry, side="right") - 1, 0)
+        while (index < len(self.entryRanges)) and (self.rangeStarts[index] < lastEntry):
+            offset = self.entryRanges[index][0] - int(self.rangeStarts[index])
+            first = max(firstEntry, int(self.rangeStarts[index])) + offset
+            last = min(lastEntry, int(self.rangeStarts[index + 1])) + offset
+            if first < last:
+                treeRanges.append((first, last))
+            index += 1
+
+        return treeRanges
+
+
+def openTrees(fileName=INPUT_FILE_NAME):
+
+    # Returns input file, and its scintillator and straw trees. The file must be kept while the
+    # trees are used
+    inputFile = ROOT.TFile.Open(fileName, "read")
+    return inputFile, inputFile.Get(SCINT_TREE_NAME), inputFile.Get(STRAW_TREE_NAME)
+
+
+def getBranchTypes(tree):
+
+    # Returns NumPy type to hold each hit branch, from type of leaf in tree
+    if isinstance(tree, (ArrayTree, SelectedTree)):
+        return tree.getBranchTypes()
+
+    types = []
+    for branch in HIT_BRANCHES:
+        if tree.GetLeaf(branch).GetTypeName() in INTEGER_LEAF_TYPES:
+            types.append(numpy.int64)
+        else:
+            types.append(numpy.float64)
+
+    return types
+
+
+def bufferToArray(buffer, count):
+
+    # Copies first count values of buffer returned by TTree::GetV1 etc. into new NumPy array.
+    # Older PyROOT buffers need their size set before NumPy can view them, newer ones are reshaped
+    if hasattr(buffer, "SetSize"):
+        buffer.SetSize(count)
+    else:
+        buffer = buffer.reshape((count,))
+
+    return numpy.frombuffer(buffer, dtype=numpy.float64, count=count).copy()
+
+
+def countEntries(tree, lastEntry=None):
+
+    # Returns number of entries of tree before lastEntry (all entries if lastEntry is None)
+    if (lastEntry is None) or (lastEntry > tree.GetEntries()):
+        return tree.GetEntries()
+    return lastEntry
+
+
+def sliceChunks(tree, chunkSize, firstEntry, lastEntry):
+
+    # Generator giving hits from entries firstEntry to lastEntry (exclusive) of ArrayTree, as
+    # blocks of at most chunkSize entries sliced from its arrays, without copying
+    for start in xrange(firstEntry, lastEntry, chunkSize):
+        yield tree.hits.slice(start, min(start + chunkSize, lastEntry))
+
+
+def readChunks(tree, chunkSize, firstEntry, lastEntry):
+
+    # Generator giving hits from entries firstEntry to lastEntry (exclusive) of ROOT tree, as
+    # blocks of HitArrays of at most chunkSize entries
+    types = getBranchTypes(tree)
+
+    for start in xrange(firstEntry, lastEntry, chunkSize):
+
+        nEntries = min(chunkSize, lastEntry - start)
+
+        with READ_LOCK:
+
+            # Draw buffers must hold a whole chunk
+            tree.SetEstimate(chunkSize + 1)
+
+            # Fill draw buffers with all four branches for chunk, without drawing anything
+            count = tree.Draw(":".join(HIT_BRANCHES), "", "goff", nEntries, start)
+
+            buffers = (tree.GetV1(), tree.GetV2(), tree.GetV3(), tree.GetV4())
+            columns = [bufferToArray(buffer, count).astype(dtype) for buffer, dtype in zip(buffers, types)]
+
+        yield HitArrays(columns[0], columns[1], columns[2], columns[3], start)
+
+
+def selectedChunks(tree, chunkSize, firstEntry, lastEntry):
+
+    # Generator giving hits from selected entries firstEntry to lastEntry (exclusive) of
+    # SelectedTree, as blocks of HitArrays of at most chunkSize entries, numbered as selected
+    # entries. Each block joins the parts of the ranges of the tree it covers, read in turn
+    types = getBranchTypes(tree)
+
+    for start in xrange(firstEntry, lastEntry, chunkSize):
+
+        stop = min(start + chunkSize, lastEntry)
+        blocks = []
+        for first, last in tree.getTreeRanges(start, stop):
+            blocks.extend(iterHits(tree.tree, chunkSize, first, last, prefetch=0))
+
+        hits = HitArrays.concatenate(blocks, types)
+        yield HitArrays(hits.run, hits.event, hits.wire, hits.hitTime, start)
+
+
+# Whether ROOT has been set up for reading on background threads
+threadsEnabled = False
+
+
+def enableThreads():
+
+    # Sets up ROOT for use from several threads, once: makes it thread safe, and lets other Python
+    # threads run while a tree is drawn (the method attribute is named differently by older
+    # PyROOT and by cppyy)
+    global threadsEnabled
+    if threadsEnabled:
+        return
+    threadsEnabled = True
+
+    if hasattr(ROOT, "EnableThreadSafety"):
+        ROOT.EnableThreadSafety()
+
+    try:
+        ROOT.TTree.Draw._threaded = True
+        ROOT.TTree.Draw.__release_gil__ = True
+    except (AttributeError, TypeError):
+        pass
+
+
+def prefetchChunks(chunks, nChunks=PREFETCH_CHUNKS):
+
+    # Generator giving each chunk of iterator chunks, read on a background thread ahead of the
+    # chunk being used. A chunk counts as held from when it starts to be read until the next one
+    # is asked for, and at most nChunks are held at once, so memory stays bounded
+    enableThreads()
+
+    slots = threading.Semaphore(nChunks)
+    ready = Queue.Queue()
+    stopped = threading.Event()
+
+    def readAhead():
+
+        # Read each chunk once a slot is free, passing it on with its kind: "hits", "end" once no
+        # more chunks follow, or "error" with the exception raised by reading
+        try:
+            chunkIterator = iter(chunks)
+            while True:
+                slots.acquire()
+                if stopped.is_set():
+                    return
+                try:
+                    hits = next(chunkIterator)
+                except StopIteration:
+                    ready.put(("end", None))
+                    return
+                ready.put(("hits", hits))
+        except Exception:
+            ready.put(("error", sys.exc_info()))
+
+    reader = threading.Thread(target=readAhead, name="hit reader")
+    reader.daemon = True
+    reader.start()
+
+    try:
+        while True:
+
+            kind, value = ready.get()
+            if kind == "end":
+                return
+            if kind == "error":
+                raise value[0], value[1], value[2]
+
+            yield value
+
+            # Chunk given last is no longer held once the next is asked for
+            slots.release()
+
+    finally:
+
+        # Stop reader if chunks are no longer wanted, and wait for it to finish any chunk it is
+        # reading
+        stopped.set()
+        slots.release()
+        reader.join()
+
+
+def iterHits(tree, chunkSize=DEFAULT_CHUNK_SIZE, firstEntry=0, lastEntry=None, prefetch=PREFETCH_CHUNKS):
+
+    # Returns iterator giving hits from entries firstEntry to lastEntry (exclusive) of tree, as
+    # blocks of HitArrays of at most chunkSize entries. Chunks of ROOT trees are read ahead on a
+    # background thread, holding at most prefetch chunks at once (see prefetchChunks), unless
+    # prefetch is less than 2. Chunks of arrays held for tree are only sliced, so are not read
+    # ahead. Chunks of SelectedTree are joined from the selected ranges of its tree
+
+    # If no last entry given, read to end of tree
+    if (lastEntry is None) or (lastEntry > tree.GetEntries()):
+        lastEntry = tree.GetEntries()
+
+    if isinstance(tree, ArrayTree):
+        return sliceChunks(tree, chunkSize, firstEntry, lastEntry)
+
+    if isinstance(tree, SelectedTree):
+        chunks = selectedChunks(tree, chunkSize, firstEntry, lastEntry)
+        if isinstance(tree.tree, ArrayTree):
+            return chunks
+    else:
+        chunks = readChunks(tree, chunkSize, firstEntry, lastEntry)
+
+    if prefetch < 2:
+        return chunks
+    return prefetchChunks(chunks, prefetch)
+
+
+def readHits(tree, chunkSize=DEFAULT_CHUNK_SIZE, firstEntry=0, lastEntry=None):
+
+    # Returns hits from entries firstEntry to lastEntry (exclusive) of tree as single HitArrays.
+    # Nothing is done between chunks, so they are not read ahead
+    return HitArrays.concatenate(list(iterHits(tree, chunkSize, firstEntry, lastEntry, prefetch=0)),
+                                 getBranchTypes(tree))
@@ -0,0 +1,398 @@
+#
+# Incremental processing of the input trees, one run at a time.
+# The histograms from each run are kept as partial results for each analysis and its settings
+# (e.g. cut times), with a fingerprint of the run: its events, and the number of entries of each,
+# from the event index of each tree (see event_index.py). When the analyses are run again, runs
+# whose fingerprints are unchanged take their partial results from the store before any of their
+# hits are read, and only new or changed runs are read and processed. Absolute entry numbers are
+# only part of the fingerprint for analyses limited to the first entries of a tree, so adding a
+# run leaves the partial results of the other runs in place. A run rewritten with the same events
+# and entry counts is taken as unchanged; remove its partial results to have it processed again.
+# The partial results are then merged into the final histograms, which are the same as from a
+# single pass over all runs. Trees must be ordered by run, and OrderError is raised if not.
+#
+
+import cPickle
+import errno
+import hashlib
+import json
+import os
+
+import numpy
+
+import coincidence_analysis
+import coincidence_engine
+import event_index
+import hit_reader
+import instrumentation
+import parallel
+import scint_delays
+from delay_histograms import DelayHistograms
+
+
+# Directory holding partial results
+PARTIALS_DIRECTORY = "partial_results"
+
+# Version of analyses. Partial results made by another version are made again
+RESULTS_VERSION = 4
+
+
+def findRuns(index, lastEntry=None):
+
+    # Returns list of (run, keys, first entries, last entries) for each run in tree index, with
+    # arrays of the (run, event) key and entries of each block of the run, up to lastEntry
+    # (exclusive; None for all entries)
+    keys, firstEntries, lastEntries = index
+    if lastEntry is not None:
+        inRange = firstEntries < lastEntry
+        keys = keys[inRange]
+        firstEntries = firstEntries[inRange]
+        lastEntries = numpy.minimum(lastEntries[inRange], lastEntry)
+
+    runs = keys >> 32
+    starts = numpy.flatnonzero(numpy.concatenate(([True], runs[1:] != runs[:-1])))
+    ends = numpy.append(starts[1:], len(keys))
+
+    return [(int(runs[start]), keys[start:end], firstEntries[start:end], lastEntries[start:end])
+            for start, end in zip(starts, ends) if end > start]
+
+
+def checkRuns(runs, treeName):
+
+    # Raises OrderError if any run, as given by findRuns, is not in one range of entries of tree
+    runNumbers = [runBlocks[0] for runBlocks in runs]
+    if len(set(runNumbers)) < len(runNumbers):
+        raise coincidence_engine.OrderError(treeName + " is not ordered by run. Read it from the hit cache (--cache, "
+                                            "see hit_cache.py), which holds it sorted, or without --incremental")
+
+
+def limitRun(runBlocks, lastEntry):
+
+    # Returns run blocks, as given by findRuns, up to lastEntry (exclusive; None for all entries)
+    run, keys, firstEntries, lastEntries = runBlocks
+    if lastEntry is None:
+        return runBlocks
+
+    inRange = firstEntries < lastEntry
+    return run, keys[inRange], firstEntries[inRange], numpy.minimum(lastEntries[inRange], lastEntry)
+
+
+def getEntryRange(runBlocks):
+
+    # Returns (first entry, last entry) of run blocks, as given by findRuns
+    run, keys, firstEntries, lastEntries = runBlocks
+    if len(keys) == 0:
+        return 0, 0
+    return int(firstEntries[0]), int(lastEntries[-1])
+
+
+def readHits(tree, firstEntry, lastEntry, stageName):
+
+    # Returns hits from entries firstEntry to lastEntry (exclusive) of tree as single HitArrays,
+    # timing reading as given stage
+    chunks = instrumentation.timeChunks(hit_reader.iterHits(tree, firstEntry=firstEntry, lastEntry=lastEntry, prefetch=0),
+                                        stageName)
+    return hit_reader.HitArrays.concatenate(list(chunks), hit_reader.getBranchTypes(tree))
+
+
+def getFingerprint(runBlocks, source, limited=False):
+
+    # Returns hash of the events of a run in each tree, and the number of entries of each, from
+    # list of run blocks as given by findRuns, identifying the hits a partial result is made from
+    # without reading them. Source describes how the trees are read (e.g. their branch types).
+    # If limited, the analysis uses only the first entries of the trees, so the entry numbers of
+    # the blocks are included
+    fingerprint = hashlib.sha1(json.dumps(source, sort_keys=True))
+    for run, keys, firstEntries, lastEntries in runBlocks:
+        fingerprint.update("%d %d\n" % (run, len(keys)))
+        fingerprint.update(keys.astype(numpy.int64).tostring())
+        fingerprint.update((lastEntries - firstEntries).astype(numpy.int64).tostring())
+        if limited:
+            fingerprint.update(firstEntries.astype(numpy.int64).tostring())
+
+    return fingerprint.hexdigest()
+
+
+def getSource(trees, useCache):
+
+    # Returns description of how trees are read, for fingerprints: the types of their branches,
+    # and whether they come from the hit cache, which holds them in order of hit time
+    return {"types": [[str(numpy.dtype(dtype)) for dtype in hit_reader.getBranchTypes(tree)] for tree in trees],
+            "cache": bool(useCache)}
+
+
+def getConfigName(analysisName, settings):
+
+    # Returns name of directory holding partial results of analysis with given settings
+    return analysisName + "-" + hashlib.sha1(json.dumps([RESULTS_VERSION, settings], sort_keys=True)).hexdigest()[:12]
+
+
+def getSelectionSettings(selection, settings, limited=False):
+
+    # Returns settings of analysis, with the events selected, if any. Partial results for part of
+    # the events of a run are kept apart from those for the whole run, as are those of analyses
+    # limited to the first entries of a tree (if limited) for any selection, as selected entries
+    # are numbered from the first selected. Other analyses of runs selected by number share the
+    # partial results of the whole runs
+    if selection is None:
+        return settings
+
+    selected = dict()
+    if selection.eventRange is not None:
+        selected["eventRange"] = list(selection.eventRange)
+    if limited and (selection.runs is not None):
+        selected["runs"] = selection.runs
+    if len(selected) == 0:
+        return settings
+
+    if isinstance(settings, dict):
+        return dict(settings, **selected)
+    return settings + [selected]
+
+
+def getPartialFileName(configName, run):
+
+    # Returns name of file holding partial result for run
+    return os.path.join(PARTIALS_DIRECTORY, configName, "run_%06d.pkl" % run)
+
+
+def loadPartial(configName, run, fingerprint):
+
+    # Returns partial result for run if stored with given fingerprint, or None
+    fileName = getPartialFileName(configName, run)
+    if not os.path.isfile(fileName):
+        return None
+
+    with open(fileName, "rb") as partialFile:
+        stored = cPickle.load(partialFile)
+
+    return stored["result"] if stored["fingerprint"] == fingerprint else None
+
+
+def savePartial(configName, run, fingerprint, result):
+
+    # Stores partial result for run, with fingerprint of hits it was made from. Result is written
+    # to a temporary file, which is moved into place once complete. The directory may be made by
+    # another process at the same time
+    fileName = getPartialFileName(configName, run)
+    try:
+        os.makedirs(os.path.dirname(fileName))
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+    with open(fileName + ".tmp", "wb") as partialFile:
+        cPickle.dump({"fingerprint": fingerprint, "result": result}, partialFile, cPickle.HIGHEST_PROTOCOL)
+    os.rename(fileName + ".tmp", fileName)
+
+
+class RunDelays:
+
+    # Class for partial result of delays analysis for one run. Events are split at the start of
+    # the run, so the first event of the run, and the event open at its end, are kept apart, to
+    # be joined to the event open at the end of the run before and the start of the run after if
+    # they have the same event number, as the loop over the whole tree would
+
+    def __init__(self, hits):
+
+        # Event numbers of first and last hits of run, and run number, wire and hit time of each
+        self.firstEvent = int(hits.event[0])
+        self.lastEvent = int(hits.event[-1])
+        self.firstHit = (hits.run[0].item(), hits.wire[0].item(), hits.hitTime[0].item())
+        self.lastHit = (hits.run[-1].item(), hits.wire[-1].item(), hits.hitTime[-1].item())
+
+        # EventDelays for first event of run, histograms for events completed after it within
+        # run, and EventDelays for event left open at end of run (None if the run has only one
+        # event)
+        self.firstEventDelays = None
+        self.completed = DelayHistograms()
+        self.openEventDelays = None
+
+
+def delaysRun(part):
+
+    # Returns RunDelays for entries of one run of scintillator tree, storing it with the
+    # fingerprint of the run
+    fileName, useCache, selection, configName, run, firstEntry, lastEntry, fingerprint = part
+
+    inputFile, scintTree, strawTree = event_index.openTrees(fileName, useCache, selection)
+    hits = readHits(scintTree, firstEntry, lastEntry, instrumentation.SCINT_READ)
+
+    runDelays = RunDelays(hits)
+
+    # First event of run, up to first change of event number
+    changes = numpy.flatnonzero(hits.event[1:] != hits.event[:-1])
+    firstEventEnd = int(changes[0]) + 1 if len(changes) > 0 else len(hits)
+
+    delaysEngine = scint_delays.ScintDelayEngine(openEvent=False)
+    delaysEngine.process(hits.slice(0, firstEventEnd))
+    runDelays.firstEventDelays = delaysEngine.finish()
+
+    # Events completed after it, and event left open at end of run
+    if firstEventEnd < len(hits):
+        delaysEngine = scint_delays.ScintDelayEngine(openEvent=False)
+        runDelays.completed.fill(delaysEngine.process(hits.slice(firstEventEnd, len(hits))))
+        runDelays.openEventDelays = delaysEngine.finish()
+
+    savePartial(configName, run, fingerprint, runDelays)
+    return runDelays
+
+
+def joinEvent(eventDelays, nextDelays, delay):
+
+    # Returns EventDelays for one event made from the hits of two parts, given as EventDelays of
+    # one event each, with the delay between the last hit of the first and the first hit of the
+    # second (None if it gives no delay)
+    delays = [eventDelays.minDelays[0]] if eventDelays.hasDelay[0] else []
+    if nextDelays.hasDelay[0]:
+        delays.append(nextDelays.minDelays[0])
+    if delay is not None:
+        delays.append(delay)
+
+    return scint_delays.EventDelays(eventDelays.scint0Hits + nextDelays.scint0Hits,
+                                    eventDelays.scint1Hits + nextDelays.scint1Hits,
+                                    numpy.array([min(delays) if len(delays) > 0 else 0]),
+                                    numpy.array([len(delays) > 0]))
+
+
+def runDelays(fileName, nJobs=1, useCache=False, selection=None):
+
+    # Returns DelayHistograms for whole scintillator tree, or the events of selection if given,
+    # processed run by run (in nJobs processes), using stored partial results for unchanged runs
+    inputFile, scintTree, strawTree = event_index.openTrees(fileName, useCache, selection)
+    runs = findRuns(event_index.getTreeIndex(fileName, scintTree, hit_reader.SCINT_TREE_NAME, selection))
+    checkRuns(runs, "Scintillator tree")
+
+    configName = getConfigName("delays", getSelectionSettings(selection, dict()))
+    source = getSource([scintTree], useCache)
+    fingerprints = [getFingerprint([runBlocks], source) for runBlocks in runs]
+
+    # Read and process only runs without stored results
+    results = [loadPartial(configName, runBlocks[0], fingerprint) for runBlocks, fingerprint in zip(runs, fingerprints)]
+    missing = [index for index, result in enumerate(results) if result is None]
+    parts = [(fileName, useCache, selection, configName, runs[index][0]) + getEntryRange(runs[index]) + (fingerprints[index],)
+             for index in missing]
+    for index, result in zip(missing, parallel.mapParts(delaysRun, parts, nJobs)):
+        results[index] = result
+
+    # Event open before first hit of tree, following a hit of run 0 on wire 1000 at time 0, as in
+    # ScintDelayEngine
+    delayHistograms = DelayHistograms()
+    openEventDelays = scint_delays.EventDelays(numpy.array([0]), numpy.array([0]), numpy.array([0]), numpy.array([False]))
+    openEvent = 0
+    lastHit = (0, 1000, 0)
+
+    for runDelays in results:
+
+        # First event of run continues event left open if it has the same event number, with a
+        # delay between them if in the same run on different wires
+        if runDelays.firstEvent == openEvent:
+            delay = None
+            if (runDelays.firstHit[0] == lastHit[0]) and (runDelays.firstHit[1] != lastHit[1]):
+                delay = runDelays.firstHit[2] - lastHit[2]
+            openEventDelays = joinEvent(openEventDelays, runDelays.firstEventDelays, delay)
+        else:
+            delayHistograms.fill(openEventDelays)
+            openEventDelays = runDelays.firstEventDelays
+
+        # Later events of run complete it. Event open at end of tree is never filled
+        if runDelays.openEventDelays is not None:
+            delayHistograms.fill(openEventDelays)
+            delayHistograms.add(runDelays.completed)
+            openEventDelays = runDelays.openEventDelays
+
+        openEvent = runDelays.lastEvent
+        lastHit = runDelays.lastHit
+
+    return delayHistograms
+
+
+def isLimited(arguments):
+
+    # Returns whether coincidence analysis, given by its arguments to CoincidenceAnalysis, uses
+    # only the first entries of either tree
+    return (arguments[3] is not None) or (arguments[4] is not None)
+
+
+def coincidenceRun(part):
+
+    # Returns list of CoincidenceHistograms, one for each analysis given, for one run of
+    # scintillator and straw trees, storing each with its fingerprint. The analyses are run
+    # together, in one pass over the hits of the run
+    fileName, useCache, selection, analysisArgs, configNames, run, scintRange, strawRange, fingerprints = part
+
+    inputFile, scintTree, strawTree = event_index.openTrees(fileName, useCache, selection)
+    scintHits = readHits(scintTree, scintRange[0], scintRange[1], instrumentation.SCINT_READ)
+    strawHits = readHits(strawTree, strawRange[0], strawRange[1], instrumentation.STRAW_READ)
+
+    analyses = coincidence_analysis.makeAnalyses(analysisArgs)
+    for hits in coincidence_analysis.analyse([scintHits], [strawHits], analyses):
+        pass
+
+    for configName, fingerprint, analysis in zip(configNames, fingerprints, analyses):
+        savePartial(configName, run, fingerprint, analysis.coincidenceHistograms)
+
+    return [analysis.coincidenceHistograms for analysis in analyses]
+
+
+def runCoincidences(fileName, analysisArgs, nJobs=1, useCache=False, selection=None):
+
+    # Returns list of CoincidenceHistograms for scintillator and straw trees, or the events of
+    # selection if given, one for each analysis (given by arguments to CoincidenceAnalysis),
+    # processed run by run (in nJobs processes), using stored partial results for unchanged runs
+    inputFile, scintTree, strawTree = event_index.openTrees(fileName, useCache, selection)
+    scintLastEntry = coincidence_analysis.readLimit([arguments[3] for arguments in analysisArgs])
+    strawLastEntry = coincidence_analysis.readLimit([arguments[4] for arguments in analysisArgs])
+
+    # Straws can only match strikes in the same run
+    scintRuns = findRuns(event_index.getTreeIndex(fileName, scintTree, hit_reader.SCINT_TREE_NAME, selection),
+                         scintLastEntry)
+    strawRuns = findRuns(event_index.getTreeIndex(fileName, strawTree, hit_reader.STRAW_TREE_NAME, selection),
+                         strawLastEntry)
+    checkRuns(scintRuns, "Scintillator tree")
+    checkRuns(strawRuns, "Straw tree")
+    strawRuns = dict((runBlocks[0], runBlocks) for runBlocks in strawRuns)
+    noBlocks = numpy.zeros(0, dtype=numpy.int64)
+
+    # Each analysis is stored by its settings, other than the tag naming its histograms
+    configNames = [getConfigName("coincidence", getSelectionSettings(selection, [arguments[0], sorted(arguments[1])]
+                                                                     + list(arguments[3:]), isLimited(arguments)))
+                   for arguments in analysisArgs]
+    source = getSource([scintTree, strawTree], useCache)
+
+    results = []
+    parts = []
+    for scintBlocks in scintRuns:
+
+        run = scintBlocks[0]
+        strawBlocks = strawRuns.get(run, (run, noBlocks, noBlocks, noBlocks))
+
+        # Fingerprint of each analysis covers the entries it uses
+        fingerprints = [getFingerprint([limitRun(scintBlocks, arguments[3]), limitRun(strawBlocks, arguments[4])], source,
+                                       isLimited(arguments))
+                        for arguments in analysisArgs]
+        runResults = [loadPartial(configName, run, fingerprint) for configName, fingerprint in zip(configNames, fingerprints)]
+        results.append(runResults)
+
+        # Run analyses without stored results
+        missing = [index for index, result in enumerate(runResults) if result is None]
+        if len(missing) > 0:
+            parts.append((fileName, useCache, selection, [analysisArgs[index] for index in missing],
+                          [configNames[index] for index in missing], run, getEntryRange(scintBlocks),
+                          getEntryRange(strawBlocks), [fingerprints[index] for index in missing]))
+
+    computed = iter(parallel.mapParts(coincidenceRun, parts, nJobs))
+    for runResults in results:
+        missing = [index for index, result in enumerate(runResults) if result is None]
+        if len(missing) > 0:
+            for index, result in zip(missing, next(computed)):
+                runResults[index] = result
+
+    # Merge results of each run into histograms for each analysis, named with its tag
+    coincidenceHistograms = [coincidence_analysis.CoincidenceAnalysis(*arguments).coincidenceHistograms
+                             for arguments in analysisArgs]
+    for runResults in results:
+        for merged, runHistograms in zip(coincidenceHistograms, runResults):
+            merged.add(runHistograms)
+
+    return coincidenceHistograms
@@ -0,0 +1,220 @@
+#
+# Instrumentation shared by the analysis scripts.
+# Records the wall time spent in each stage of a run (reading each tree, finding strikes, matching
+# straws, filling histograms, drawing plots, ...), the entries read in each, and peak memory. A
+# stage entered within another is timed apart from it, so each stage counts only its own time.
+# Optionally shows a live progress line with rate and estimated time left, and writes a JSON
+# report at the end of the run.
+#
+
+import collections
+import contextlib
+import functools
+import json
+import resource
+import sys
+import time
+
+
+# Names of stages
+SCINT_READ = "scint tree read"
+STRAW_READ = "straw tree read"
+STRIKE_BUILD = "strike build"
+STRAW_MATCH = "straw match"
+DELAY_SEARCH = "delay search"
+HISTOGRAM_FILL = "histogram fill"
+HISTOGRAM_WRITE = "histogram write"
+RENDER = "render"
+
+# Least time between updates of progress line, in s
+PROGRESS_INTERVAL = 0.5
+
+
+class Recorder:
+
+    # Class recording time, calls and entries read for each stage, for one process
+
+    def __init__(self):
+
+        # Time recording started, and totals for each stage, in order first entered
+        self.startTime = time.time()
+        self.stages = collections.OrderedDict()
+
+        # Names of stages entered and not yet left, innermost last, and time the innermost was
+        # entered or last resumed
+        self.stack = []
+        self.stageTime = None
+
+        # Whether progress line is shown, and time it was last shown
+        self.showProgress = False
+        self.progressTime = 0
+
+    def getStage(self, name):
+
+        # Returns totals for stage, starting them if stage not yet entered
+        if name not in self.stages:
+            self.stages[name] = {"seconds": 0.0, "calls": 0, "entries": 0}
+        return self.stages[name]
+
+    def enter(self, name):
+
+        # Starts timing stage, pausing stage it is entered from
+        now = time.time()
+        if len(self.stack) > 0:
+            self.getStage(self.stack[-1])["seconds"] += now - self.stageTime
+
+        self.stack.append(name)
+        self.getStage(name)["calls"] += 1
+        self.stageTime = now
+
+    def leave(self, entries=0):
+
+        # Stops timing innermost stage, adding entries read in it, and resumes stage it was
+        # entered from
+        now = time.time()
+        stage = self.getStage(self.stack.pop())
+        stage["seconds"] += now - self.stageTime
+        stage["entries"] += entries
+        self.stageTime = now
+
+    def merge(self, stages):
+
+        # Adds totals for stages recorded in another process (e.g. by a worker of a pool)
+        for name, other in stages.items():
+            stage = self.getStage(name)
+            for key in ("seconds", "calls", "entries"):
+                stage[key] += other[key]
+
+    def progress(self, done, total, unit="entries"):
+
+        # Shows progress line, if enabled, with rate and estimated time left. Line is updated at
+        # most once every PROGRESS_INTERVAL, and rewritten in place
+        now = time.time()
+        if (not self.showProgress) or ((now - self.progressTime < PROGRESS_INTERVAL) and (done < total)):
+            return
+        self.progressTime = now
+
+        elapsed = now - self.startTime
+        rate = done / elapsed if elapsed > 0 else 0
+        remaining = (total - done) / rate if rate > 0 else 0
+        sys.stderr.write("\r%d / %d %s (%.1f%%), %.0f %s/s, %.0f s left   "
+                         % (done, total, unit, 100.0 * done / max(total, 1), rate, unit, remaining))
+        if done >= total:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+    def getReport(self):
+
+        # Returns report of run: wall time, totals for each stage (summed over processes, for
+        # parts run in a pool) with entries read per second for stages reading entries, and peak
+        # memory of this process and of its finished child processes, in MB (Linux gives these
+        # in kB)
+        wallTime = time.time() - self.startTime
+
+        stages = []
+        for name, stage in self.stages.items():
+            stageReport = dict(stage)
+            stageReport["name"] = name
+            if (stage["entries"] > 0) and (stage["seconds"] > 0):
+                stageReport["entriesPerSecond"] = stage["entries"] / stage["seconds"]
+            else:
+                stageReport["entriesPerSecond"] = None
+            stages.append(stageReport)
+
+        scintEntries = self.stages[SCINT_READ]["entries"] if SCINT_READ in self.stages else 0
+        return {"script": sys.argv[0], "arguments": sys.argv[1:], "wallTime": wallTime,
+                "scintEntriesPerSecond": scintEntries / wallTime if wallTime > 0 else None,
+                "stages": stages,
+                "peakMemory": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+                "peakChildMemory": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0}
+
+
+# Recorder for this process
+recorder = Recorder()
+
+
+def reset():
+
+    # Starts recording afresh (e.g. in a worker process, which starts with a copy of its parent's
+    # recorder), keeping whether progress is shown
+    global recorder
+    showProgress = recorder.showProgress
+    recorder = Recorder()
+    recorder.showProgress = showProgress
+
+
+def setProgress(showProgress):
+
+    # Sets whether progress line is shown
+    recorder.showProgress = showProgress
+
+
+@contextlib.contextmanager
+def stage(name, entries=0):
+
+    # Context timing code within it as stage, adding given entries
+    recorder.enter(name)
+    try:
+        yield
+    finally:
+        recorder.leave(entries)
+
+
+def timed(name):
+
+    # Decorator timing each call of function as stage
+    def decorate(function):
+
+        @functools.wraps(function)
+        def timedFunction(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return timedFunction
+
+    return decorate
+
+
+def timeChunks(chunks, name):
+
+    # Generator giving each chunk of hits from chunks, timing the reading of each as stage, and
+    # adding its entries
+    chunks = iter(chunks)
+    while True:
+
+        recorder.enter(name)
+        entries = 0
+        try:
+            hits = next(chunks)
+            entries = len(hits)
+        except StopIteration:
+            return
+        finally:
+            recorder.leave(entries)
+
+        yield hits
+
+
+def progress(done, total, unit="entries"):
+
+    # Shows progress line, if enabled
+    recorder.progress(done, total, unit)
+
+
+def getStages():
+
+    # Returns totals for each stage, to be merged into recorder of another process
+    return recorder.stages
+
+
+def merge(stages):
+
+    # Adds totals for stages recorded in another process
+    recorder.merge(stages)
+
+
+def writeReport(fileName):
+
+    # Writes report of run to JSON file
+    with open(fileName, "w") as reportFile:
+        json.dump(recorder.getReport(), reportFile, indent=2)
@@ -0,0 +1,26 @@
+#
+# Overlays histograms from any number of analysis output files, as described by manifest files.
+# Each manifest lists plots, and for each plot the files and names of its histograms, their
+# normalisation ("integral" or "maximum") and styles; see render.loadManifest. Each histogram is
+# read once, converted to double precision, and normalised with the others in its plot, then all
+# plots are drawn by the render stage.
+#
+#     python overlay.py manifest.json [manifest.json ...] [--jobs N] [--force]
+#
+
+import argparse
+
+import render
+
+parser = argparse.ArgumentParser(description="Overlay histograms described by manifest files")
+parser.add_argument("manifests", nargs="+", help="manifest files describing plots")
+parser.add_argument("--jobs", type=int, default=1, help="number of processes to draw plots in")
+parser.add_argument("--force", action="store_true", help="draw every plot, even if inputs are unchanged")
+args = parser.parse_args()
+
+plots = []
+for manifestName in args.manifests:
+    plots += render.loadManifest(manifestName)
+
+# Draw overlays, and print each to pdf
+render.renderPlots(plots, args.jobs, args.force)
@@ -0,0 +1,219 @@
+#
+# Runs the analyses over parts of the input trees in a pool of processes, then merges the
+# histograms from each part.
+# The scintillator tree is split into entry ranges starting where the event number changes, and
+# the straw tree into the entry ranges holding the same runs and events, so each part holds whole
+# events and the merged histograms are the same as from a single pass. For the coincidence
+# analyses, trees must be ordered by run and event, and each part raises
+# coincidence_engine.OrderError while reading if they are not.
+#
+
+import multiprocessing
+
+import numpy
+
+import coincidence_analysis
+import coincidence_engine
+import event_index
+import hit_reader
+import instrumentation
+import scint_delays
+from delay_histograms import DelayHistograms
+
+
+# Number of parts each process is given, so that uneven parts balance out across processes
+PARTS_PER_JOB = 4
+
+# Number of entries read at a time when searching for a change of event number
+BOUNDARY_SEARCH_SIZE = 1000
+
+
+def findEventStart(tree, entry, lastEntry):
+
+    # Returns first entry from given entry (at least 1) where event number differs from entry
+    # before it, or lastEntry if there is none
+    while entry < lastEntry:
+
+        hits = hit_reader.readHits(tree, BOUNDARY_SEARCH_SIZE + 1, entry - 1, min(entry + BOUNDARY_SEARCH_SIZE, lastEntry))
+        changes = numpy.flatnonzero(hits.event[1:] != hits.event[:-1])
+        if len(changes) > 0:
+            return entry + int(changes[0])
+
+        entry += BOUNDARY_SEARCH_SIZE
+
+    return lastEntry
+
+
+def splitEntryRanges(tree, nParts, firstEntry=0, lastEntry=None):
+
+    # Returns list of up to nParts (first, last) entry ranges of roughly equal size covering tree
+    # from firstEntry to lastEntry (exclusive), each starting at a change of event number
+    if (lastEntry is None) or (lastEntry > tree.GetEntries()):
+        lastEntry = tree.GetEntries()
+
+    starts = [firstEntry]
+    for part in xrange(1, nParts):
+        target = max(firstEntry + part * (lastEntry - firstEntry) // nParts, starts[-1] + 1)
+        start = findEventStart(tree, target, lastEntry)
+        if start < lastEntry:
+            starts.append(start)
+
+    return list(zip(starts, starts[1:] + [lastEntry]))
+
+
+def readEntryKey(tree, entry):
+
+    # Returns run and event key of given entry of tree
+    hits = hit_reader.readHits(tree, 1, entry, entry + 1)
+    return coincidence_engine.eventKey(int(hits.run[0]), int(hits.event[0]))
+
+
+def readPreviousKey(tree, entry):
+
+    # Returns run and event key of entry before given entry of tree, or -1 for the first entry
+    return readEntryKey(tree, entry - 1) if entry > 0 else -1
+
+
+def findFirstEntry(tree, key, firstEntry, lastEntry):
+
+    # Returns first entry of tree, between firstEntry and lastEntry, with run and event key at
+    # least the given key, by binary search over the entries
+    while firstEntry < lastEntry:
+        middle = (firstEntry + lastEntry) // 2
+        if readEntryKey(tree, middle) < key:
+            firstEntry = middle + 1
+        else:
+            lastEntry = middle
+
+    return firstEntry
+
+
+def runInstrumented(workerPart):
+
+    # Returns result of worker for part, and stage totals recorded while running it, for
+    # mapParts. Recording starts afresh, as a pool process starts with a copy of its parent's
+    worker, part = workerPart
+    instrumentation.reset()
+    result = worker(part)
+    return result, instrumentation.getStages()
+
+
+def mapParts(worker, parts, nJobs):
+
+    # Returns list of results of worker for each part, run in a pool of nJobs processes (or in
+    # this process, for one job). Stage totals recorded in each process are merged into this one
+    results = []
+
+    if nJobs <= 1:
+        for part in parts:
+            results.append(worker(part))
+            instrumentation.progress(len(results), len(parts), "parts")
+        return results
+
+    pool = multiprocessing.Pool(nJobs)
+    try:
+        for result, stages in pool.imap(runInstrumented, [(worker, part) for part in parts]):
+            results.append(result)
+            instrumentation.merge(stages)
+            instrumentation.progress(len(results), len(parts), "parts")
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def runParts(worker, parts, nJobs):
+
+    # Runs worker on each part in a pool of nJobs processes. Each worker gives a list of sets of
+    # histograms, and the sets from all parts are merged, in order
+    results = mapParts(worker, parts, nJobs)
+
+    merged = results[0]
+    for result in results[1:]:
+        for mergedHistograms, partHistograms in zip(merged, result):
+            mergedHistograms.add(partHistograms)
+
+    return merged
+
+
+def delaysPart(part):
+
+    # Returns list of DelayHistograms for scintillator tree entries firstEntry to lastEntry. Unless part
+    # is last, the event left open at its end is filled, as the next part completes it
+    fileName, useCache, selection, firstEntry, lastEntry, isFirst, isLast = part
+
+    delayHistograms = DelayHistograms()
+
+    inputFile, scintTree, strawTree = event_index.openTrees(fileName, useCache, selection)
+    delaysEngine = scint_delays.ScintDelayEngine(openEvent=isFirst)
+
+    scintChunks = hit_reader.iterHits(scintTree, firstEntry=firstEntry, lastEntry=lastEntry)
+    for hits in instrumentation.timeChunks(scintChunks, instrumentation.SCINT_READ):
+        delayHistograms.fill(delaysEngine.process(hits))
+
+    if not isLast:
+        delayHistograms.fill(delaysEngine.finish())
+
+    return [delayHistograms]
+
+
+def runDelays(fileName, nJobs, useCache=False, selection=None):
+
+    # Returns DelayHistograms for whole scintillator tree, processed in nJobs processes, reading
+    # trees from hit cache if useCache, and only the events of selection if given
+    inputFile, scintTree, strawTree = event_index.openTrees(fileName, useCache, selection)
+    ranges = splitEntryRanges(scintTree, nJobs * PARTS_PER_JOB)
+
+    parts = [(fileName, useCache, selection, first, last, i == 0, i == len(ranges) - 1)
+             for i, (first, last) in enumerate(ranges)]
+    return runParts(delaysPart, parts, nJobs)[0]
+
+
+def coincidencePart(part):
+
+    # Returns list of CoincidenceHistograms, one for each analysis, for given ranges of
+    # scintillator and straw tree entries
+    fileName, useCache, selection, analysisArgs, streaming, scintRange, strawRange = part
+
+    analyses = coincidence_analysis.makeAnalyses(analysisArgs)
+
+    inputFile, scintTree, strawTree = event_index.openTrees(fileName, useCache, selection)
+    scintChunks = instrumentation.timeChunks(hit_reader.iterHits(scintTree, firstEntry=scintRange[0], lastEntry=scintRange[1]),
+                                             instrumentation.SCINT_READ)
+    strawChunks = instrumentation.timeChunks(hit_reader.iterHits(strawTree, firstEntry=strawRange[0], lastEntry=strawRange[1]),
+                                             instrumentation.STRAW_READ)
+
+    # Ranges were found by binary search over keys, so each tree must be in order, from the
+    # entry before its range on
+    scintChunks = coincidence_engine.checkOrder(scintChunks, "Scintillator tree", readPreviousKey(scintTree, scintRange[0]))
+    strawChunks = coincidence_engine.checkOrder(strawChunks, "Straw tree", readPreviousKey(strawTree, strawRange[0]))
+
+    for hits in coincidence_analysis.analyse(scintChunks, strawChunks, analyses, streaming):
+        pass
+
+    return [analysis.coincidenceHistograms for analysis in analyses]
+
+
+def runCoincidences(fileName, analysisArgs, streaming, nJobs, useCache=False, selection=None):
+
+    # Returns list of CoincidenceHistograms for scintillator and straw trees, processed in nJobs
+    # processes, for each analysis. Each analysis is given by its arguments to CoincidenceAnalysis
+    # (doubleScint, cutTimes, tag, scintLastEntry, strawLastEntry), and both trees are read once
+    # for all of them, from hit cache if useCache, and only the events of selection if given
+    inputFile, scintTree, strawTree = event_index.openTrees(fileName, useCache, selection)
+    scintLastEntry = coincidence_analysis.readLimit([arguments[3] for arguments in analysisArgs])
+    strawLastEntry = coincidence_analysis.readLimit([arguments[4] for arguments in analysisArgs])
+    if (strawLastEntry is None) or (strawLastEntry > strawTree.GetEntries()):
+        strawLastEntry = strawTree.GetEntries()
+
+    scintRanges = splitEntryRanges(scintTree, nJobs * PARTS_PER_JOB, 0, scintLastEntry)
+
+    # Straw tree is split at first entry of run and event starting each scintillator range
+    strawStarts = [0] + [findFirstEntry(strawTree, readEntryKey(scintTree, first), 0, strawLastEntry)
+                         for first, last in scintRanges[1:]]
+    strawRanges = list(zip(strawStarts, strawStarts[1:] + [strawLastEntry]))
+
+    parts = [(fileName, useCache, selection, analysisArgs, streaming, scintRange, strawRange)
+             for scintRange, strawRange in zip(scintRanges, strawRanges)]
+    return runParts(coincidencePart, parts, nJobs)
@@ -0,0 +1,276 @@
+#
+# RDataFrame backend for scint_coincidence_delays.py.
+# Runs the search for hit counts and lowest delay time in each event as a ROOT RDataFrame graph,
+# with implicit multithreading, so the loop over the scintillator tree runs in compiled code on
+# all cores. The results are the same as from scint_delays.ScintDelayEngine.
+#
+# The search depends on the entry before each entry, but with implicit multithreading each
+# thread is given ranges of entries in no set order. So each thread records, for each range of
+# consecutive entries it is given, the events (or parts of events) within the range, with the
+# first and last hits of the range. Once the loop is done the ranges are joined in entry order,
+# completing events split between ranges as the loop over the whole tree would. The completed
+# events are then filled into the histograms in the same chunks of entries as the chunked loop,
+# so that even the sums for the statistics are added in the same order. If only selected events
+# are searched (see event_index.py), entries outside their ranges are filtered out ahead of the
+# search, and the rest are numbered as the entries of hit_reader.SelectedTree.
+#
+
+import numpy
+import ROOT
+
+import hit_reader
+import instrumentation
+import scint_delays
+from delay_histograms import DelayHistograms
+
+
+# C++ code for the search, compiled when first used. Hit times are read as double, and event,
+# run and wire numbers as Long64_t, whatever the types of their branches; the results are
+# kept as doubles, to be read back through the same buffers as TTree::Draw gives
+SCAN_CODE = """
+namespace scintDelaysRDF {
+
+struct Hit {
+   Long64_t run;
+   Long64_t event;
+   Long64_t wire;
+   double hitTime;
+};
+
+// Hit counts and lowest delay of an event, or of the part of it within a range of entries
+struct EventPart {
+   Long64_t firstEntry;
+   Long64_t event;
+   Long64_t scint0Hits;
+   Long64_t scint1Hits;
+   double minDelay;
+   bool hasDelay;
+};
+
+// Range of consecutive entries given to one thread, with its first and last hits
+struct EntryRange {
+   Long64_t firstEntry;
+   Long64_t lastEntry;
+   Hit first;
+   Hit last;
+   std::vector<EventPart> parts;
+};
+
+inline void addDelay(EventPart &part, double delay)
+{
+   if (!part.hasDelay || delay < part.minDelay) part.minDelay = delay;
+   part.hasDelay = true;
+}
+
+inline void addHit(EventPart &part, Long64_t wire)
+{
+   if (wire == 0) part.scint0Hits++;
+   else if (wire == 1) part.scint1Hits++;
+}
+
+class DelayScan {
+public:
+   // Sets number of threads hits are given by
+   void setSlots(unsigned nSlots) { fRanges.assign(nSlots, std::vector<EntryRange>()); }
+
+   // Adds hit at given entry, read by thread of given slot
+   void fill(unsigned slot, ULong64_t entry, Long64_t run, Long64_t event, Long64_t wire, double hitTime)
+   {
+      std::vector<EntryRange> &ranges = fRanges[slot];
+      Hit hit = {run, event, wire, hitTime};
+
+      if (ranges.empty() || (Long64_t)entry != ranges.back().lastEntry + 1) {
+         EntryRange range;
+         range.firstEntry = entry;
+         range.first = hit;
+         EventPart part = {(Long64_t)entry, event, 0, 0, 0., false};
+         range.parts.push_back(part);
+         ranges.push_back(range);
+      } else {
+         EntryRange &range = ranges.back();
+         if (event != range.last.event) {
+            EventPart part = {(Long64_t)entry, event, 0, 0, 0., false};
+            range.parts.push_back(part);
+         } else if (wire != range.last.wire && run == range.last.run) {
+            addDelay(range.parts.back(), hitTime - range.last.hitTime);
+         }
+      }
+
+      EntryRange &range = ranges.back();
+      addHit(range.parts.back(), wire);
+      range.last = hit;
+      range.lastEntry = entry;
+   }
+
+   // Joins ranges in entry order, keeping results for each completed event, and the entry
+   // completing it. Values before the first entry are those of ScintDelayEngine
+   void join()
+   {
+      std::vector<EntryRange *> ranges;
+      for (size_t slot = 0; slot < fRanges.size(); slot++)
+         for (size_t index = 0; index < fRanges[slot].size(); index++)
+            ranges.push_back(&fRanges[slot][index]);
+      std::sort(ranges.begin(), ranges.end(),
+                [](const EntryRange *a, const EntryRange *b) { return a->firstEntry < b->firstEntry; });
+
+      Hit previous = {0, 0, 1000, 0.};
+      EventPart open = {0, 0, 0, 0, 0., false};
+
+      for (size_t index = 0; index < ranges.size(); index++) {
+         const EntryRange &range = *ranges[index];
+         const EventPart &first = range.parts.front();
+
+         // First part of range continues event open before it, unless event number changes
+         if (range.first.event != previous.event) {
+            complete(open, range.firstEntry);
+            open = first;
+         } else {
+            if (range.first.wire != previous.wire && range.first.run == previous.run)
+               addDelay(open, range.first.hitTime - previous.hitTime);
+            if (first.hasDelay) addDelay(open, first.minDelay);
+            open.scint0Hits += first.scint0Hits;
+            open.scint1Hits += first.scint1Hits;
+         }
+
+         for (size_t part = 1; part < range.parts.size(); part++) {
+            complete(open, range.parts[part].firstEntry);
+            open = range.parts[part];
+         }
+
+         previous = range.last;
+      }
+
+      // Event open at end of tree is never filled
+      fRanges.clear();
+   }
+
+   std::vector<double> fScint0Hits;
+   std::vector<double> fScint1Hits;
+   std::vector<double> fMinDelays;
+   std::vector<double> fHasDelay;
+   std::vector<double> fCompletingEntries;
+
+private:
+   void complete(const EventPart &part, Long64_t completingEntry)
+   {
+      fScint0Hits.push_back(part.scint0Hits);
+      fScint1Hits.push_back(part.scint1Hits);
+      fMinDelays.push_back(part.hasDelay ? part.minDelay : 0.);
+      fHasDelay.push_back(part.hasDelay);
+      fCompletingEntries.push_back(completingEntry);
+   }
+
+   std::vector<std::vector<EntryRange>> fRanges;
+};
+
+// Runs search over tree of file with an RDataFrame, using threads of implicit multithreading
+// if enabled, and joins its results. If select is set, only entries within the given ranges
+// (first entries, and last entries exclusive, in order) are searched
+inline void scan(DelayScan &delayScan, const char *treeName, const char *fileName, bool select,
+                 const std::vector<Long64_t> &firstEntries, const std::vector<Long64_t> &lastEntries)
+{
+   ROOT::RDataFrame frame(treeName, fileName);
+   delayScan.setSlots(frame.GetNSlots());
+
+   ROOT::RDF::RNode node = frame;
+   if (select) {
+      node = frame.Filter(
+         [&firstEntries, &lastEntries](ULong64_t entry) {
+            size_t index = std::upper_bound(firstEntries.begin(), firstEntries.end(), (Long64_t)entry) -
+                           firstEntries.begin();
+            return index > 0 && (Long64_t)entry < lastEntries[index - 1];
+         },
+         {"rdfentry_"});
+   }
+
+   node.Define("scanRun", "(Long64_t)Run")
+       .Define("scanEvent", "(Long64_t)Event")
+       .Define("scanWire", "(Long64_t)Wire")
+       .Define("scanHitTime", "(double)HitTime")
+       .ForeachSlot([&delayScan](unsigned slot, ULong64_t entry, Long64_t run, Long64_t event, Long64_t wire,
+                                 double hitTime) { delayScan.fill(slot, entry, run, event, wire, hitTime); },
+                    {"rdfentry_", "scanRun", "scanEvent", "scanWire", "scanHitTime"});
+
+   delayScan.join();
+}
+}
+"""
+
+# Whether search code has been compiled
+codeDeclared = False
+
+
+def isAvailable():
+
+    # Returns whether this ROOT has RDataFrame
+    return hasattr(ROOT, "RDataFrame")
+
+
+def declareCode():
+
+    # Compiles search code, once
+    global codeDeclared
+    if not codeDeclared:
+        if not ROOT.gInterpreter.Declare("#include <ROOT/RDataFrame.hxx>\n#include <algorithm>\n" + SCAN_CODE):
+            raise RuntimeError("Could not compile RDataFrame delay search")
+        codeDeclared = True
+
+
+def vectorToArray(vector, dtype):
+
+    # Returns copy of std::vector<double> as NumPy array of given type
+    if vector.size() == 0:
+        return numpy.zeros(0, dtype=dtype)
+    return hit_reader.bufferToArray(vector.data(), vector.size()).astype(dtype)
+
+
+def runDelays(fileName, nThreads=0, chunkSize=hit_reader.DEFAULT_CHUNK_SIZE, entryRanges=None):
+
+    # Returns DelayHistograms for whole scintillator tree of ROOT file, or for the given (first,
+    # last) ranges of its entries (last exclusive, in order) taken as the only entries of the
+    # tree, searched by an RDataFrame on nThreads threads (all cores if 0). Histograms are filled
+    # with the events completed in each chunk of chunkSize entries in turn, as
+    # scint_coincidence_delays.py fills them
+    inputFile, scintTree, strawTree = hit_reader.openTrees(fileName)
+    timeType = hit_reader.getBranchTypes(scintTree)[3]
+    select = entryRanges is not None
+    if not select:
+        entryRanges = [(0, scintTree.GetEntries())]
+
+    # Ranges start where ranges before them end, in the numbering of entries selected
+    firstEntries = ROOT.std.vector("Long64_t")()
+    lastEntries = ROOT.std.vector("Long64_t")()
+    for first, last in entryRanges:
+        firstEntries.push_back(first)
+        lastEntries.push_back(last)
+    rangeStarts = numpy.cumsum([0] + [last - first for first, last in entryRanges])
+    nEntries = int(rangeStarts[-1])
+
+    declareCode()
+    ROOT.EnableImplicitMT(nThreads)
+
+    with instrumentation.stage(instrumentation.DELAY_SEARCH, nEntries):
+        delayScan = ROOT.scintDelaysRDF.DelayScan()
+        ROOT.scintDelaysRDF.scan(delayScan, hit_reader.SCINT_TREE_NAME, fileName, select, firstEntries, lastEntries)
+
+        scint0Hits = vectorToArray(delayScan.fScint0Hits, numpy.int64)
+        scint1Hits = vectorToArray(delayScan.fScint1Hits, numpy.int64)
+        minDelays = vectorToArray(delayScan.fMinDelays, timeType)
+        hasDelay = vectorToArray(delayScan.fHasDelay, bool)
+        completingEntries = vectorToArray(delayScan.fCompletingEntries, numpy.int64)
+
+    # Entries completing events, numbered among entries selected
+    if len(entryRanges) > 0:
+        rangeFirsts = numpy.array([first for first, last in entryRanges], dtype=numpy.int64)
+        rangeIndices = numpy.searchsorted(rangeFirsts, completingEntries, side="right") - 1
+        completingEntries = completingEntries - rangeFirsts[rangeIndices] + rangeStarts[rangeIndices]
+
+    # Events completed by entries of each chunk
+    delayHistograms = DelayHistograms()
+    chunkStarts = numpy.arange(0, max(nEntries, 1), chunkSize)
+    bounds = numpy.searchsorted(completingEntries, numpy.append(chunkStarts, nEntries), side="left")
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        delayHistograms.fill(scint_delays.EventDelays(scint0Hits[first:last], scint1Hits[first:last],
+                                                      minDelays[first:last], hasDelay[first:last]))
+
+    return delayHistograms
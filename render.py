@@ -0,0 +1,411 @@
+#
+# Render stage: draws plots from the histograms saved by the analysis scripts, and prints each
+# to pdf.
+# Each plot is described by a dict of its input histograms and style settings, so that a change
+# of title or colour only needs the plots to be drawn again, not the analysis to be run again.
+# Plots are drawn in batch mode, in parallel across processes, and a plot is only drawn again if
+# its style settings or the contents of its input histograms have changed since it was last drawn.
+#
+# Run as script to draw plots from all output files present:
+#     python render.py [--jobs N] [--force]
+# Overlays of any histograms are drawn from manifest files by overlay.py.
+#
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+
+import ROOT
+
+import histograms
+import instrumentation
+
+
+# Draw without opening windows
+ROOT.gROOT.SetBatch(True)
+
+# Output files of the analysis scripts, from which plots are drawn
+DELAYS_FILE_NAME = "scint_coincidence_delays.root"
+SINGLE_COINCIDENCE_FILE_NAME = "scint_straw_coincidence.root"
+DOUBLE_COINCIDENCE_FILE_NAME = "double_scint_straw_coincidence.root"
+DOUBLE_WINDOW_SCAN_FILE_NAME = "double_scint_window_scan.root"
+
+# File holding hash of inputs of each plot when last drawn
+STATE_FILE_NAME = "render_state.json"
+
+# Version of drawing code. Plots drawn with another version are drawn again
+RENDER_VERSION = 1
+
+# Size of canvas for each plot, in pixels
+CANVAS_WIDTH = 2000
+CANVAS_HEIGHT = 1500
+
+# Position of legend on canvas (x1, y1, x2, y2), if not given
+DEFAULT_LEGEND_POSITION = [0.7, 0.7, 0.9, 0.9]
+
+# Line colours given in turn to histograms in manifest plots without one
+LINE_COLORS = [4, 2, 8, 6, 7, 9, 1, 28, 46, 38, 30, 41]
+
+# Manifest of overlays of single and double scintillator strike coincidence histograms
+OVERLAY_MANIFEST_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "overlay_double_single_coinc.json")
+
+
+def delayPlots(fileName=DELAYS_FILE_NAME):
+
+    # Returns plots of scintillator hit counts and delay times, made by scint_coincidence_delays.py
+    return [{"name": "cScintWireHits", "output": "scint_wire_hits.pdf",
+             "title": "Events with Given Number of Strikes on Each Scintillator",
+             "xTitle": "Scintillator 0 Strikes", "yTitle": "Scintillator 1 Strikes",
+             "palette": 53, "stats": False,
+             "histograms": [{"file": fileName, "name": "hScintWireHits", "option": "colz"}]},
+
+            {"name": "cTimeOffsets", "output": "time_offsets.pdf",
+             "title": "Scintillator Hit Time Offsets Below 100ns",
+             "xTitle": "Hit Time Offset / ns", "yTitle": "Events",
+             "histograms": [{"file": fileName, "name": "hTimeOffsets", "option": "HIST"}]},
+
+            {"name": "cTimeOffsetsNocut", "output": "time_offsets_nocut.pdf",
+             "title": "Scintillator Hit Time OffsetsNocut Below 100ns",
+             "xTitle": "Hit Time Offset / ns", "yTitle": "Events",
+             "histograms": [{"file": fileName, "name": "hTimeOffsetsNocut", "option": "HIST"}]}]
+
+
+def getKeyNames(fileName, directoryName=None):
+
+    # Returns names of all keys in output file, or in directory of it
+    inputFile = ROOT.TFile.Open(fileName, "read")
+    directory = inputFile if directoryName is None else inputFile.Get(directoryName)
+    names = [key.GetName() for key in directory.GetListOfKeys()]
+    inputFile.Close()
+
+    return names
+
+
+def getCutSuffixes(fileName, directoryName=None):
+
+    # Returns suffix of each delay cut time with histograms in coincidence output file (or
+    # directory of it), in order of cut time
+    suffixes = []
+    for keyName in getKeyNames(fileName, directoryName):
+        match = re.match(r"^hStrawsCoinciding(.*)ns$", keyName)
+        if match:
+            suffixes.append(match.group(1))
+
+    return [suffix + "ns" for suffix in sorted(set(suffixes), key=float)]
+
+
+def coincidencePlots(fileName, prefix):
+
+    # Returns plots of number of straws coinciding with each strike, straw delay times, delay
+    # times on each straw channel and hits on each channel, for each cut time in coincidence output
+    # file, with pdf names starting with prefix. If the file holds background from off-time
+    # windows, the number of straws and delay times are also drawn over their background, with
+    # background subtracted
+    keyNames = set(getKeyNames(fileName))
+    plots = []
+    for name in getCutSuffixes(fileName):
+
+        plots.append({"name": prefix + "cStrawsCoinciding" + name, "output": prefix + "straw_coincidence_" + name + ".pdf",
+                      "title": "Straw Hits Less Than" + name + " After Scint Hits",
+                      "xTitle": "Number of Straws Coinciding with Scint Hit", "yTitle": "Events",
+                      "histograms": [{"file": fileName, "name": "hStrawsCoinciding" + name, "option": "HIST"}]})
+
+        plots.append({"name": prefix + "cStrawDelay" + name, "output": prefix + "straw_delay_" + name + ".pdf",
+                      "title": "Straw Hits Delay after Scint Hits",
+                      "xTitle": "Delay / ns", "yTitle": "Events",
+                      "histograms": [{"file": fileName, "name": "hStrawDelay" + name, "option": "HIST"}]})
+
+        plots.append({"name": prefix + "cStrawChannelDelay" + name, "output": prefix + "straw_channel_delay_" + name + ".pdf",
+                      "title": "Straw Hits Delay after Scint Hits on Each Channel",
+                      "xTitle": "Straw Channel", "yTitle": "Delay / ns",
+                      "palette": 53, "stats": False,
+                      "histograms": [{"file": fileName, "name": "hStrawChannelDelay" + name, "option": "colz"}]})
+
+        plots.append({"name": prefix + "cStrawChannelHits" + name, "output": prefix + "straw_channel_hits_" + name + ".pdf",
+                      "title": "Straw Hits Less Than" + name + " After Scint Hits on Each Channel",
+                      "xTitle": "Straw Channel", "yTitle": "Straw Hits",
+                      "histograms": [{"file": fileName, "name": "hStrawChannelHits" + name, "option": "HIST"}]})
+
+        if "hStrawDelaySubtracted" + name not in keyNames:
+            continue
+
+        for histName, output, title, xTitle in (("hStrawsCoinciding", "straw_coincidence_subtracted_", "Straw Hits Less Than" + name + " After Scint Hits",
+                                                 "Number of Straws Coinciding with Scint Hit"),
+                                                ("hStrawDelay", "straw_delay_subtracted_", "Straw Hits Delay after Scint Hits", "Delay / ns")):
+            plots.append({"name": prefix + "c" + histName[1:] + "Subtracted" + name, "output": prefix + output + name + ".pdf",
+                          "title": title + ", Background Subtracted", "xTitle": xTitle, "yTitle": "Events",
+                          "stats": False, "legend": {},
+                          "histograms": [{"file": fileName, "name": histName + name, "option": "HIST",
+                                          "lineColor": 4, "label": "Coinciding"},
+                                         {"file": fileName, "name": histName + "Background" + name, "option": "HIST",
+                                          "lineColor": 2, "label": "Off-time background"},
+                                         {"file": fileName, "name": histName + "Subtracted" + name, "option": "HIST",
+                                          "lineColor": 1, "label": "Background subtracted"}]})
+
+    return plots
+
+
+def windowScanPlots(fileName=DOUBLE_WINDOW_SCAN_FILE_NAME):
+
+    # Returns plots of number of straws coinciding with each strike, and straw delay times, with
+    # each window time of window scan made by double_scint_straw_coincidence.py drawn over each
+    # other, for each cut time
+    windows = []
+    for keyName in getKeyNames(fileName):
+        match = re.match(r"^window(.*)ns$", keyName)
+        if match:
+            windows.append(match.group(1))
+    windows.sort(key=float)
+    if len(windows) == 0:
+        return []
+
+    plots = []
+    for name in getCutSuffixes(fileName, "window" + windows[0] + "ns"):
+        for histName, output, title, xTitle in (("hStrawsCoinciding", "window_scan_straw_coincidence_", "Straw Hits Less Than" + name + " After Double Scint Hits",
+                                                 "Number of Straws Coinciding with Scint Hit"),
+                                                ("hStrawDelay", "window_scan_straw_delay_", "Straw Hits Delay after Double Scint Hits", "Delay / ns")):
+            plots.append({"name": "cWindowScan" + histName[1:] + name, "output": output + name + ".pdf",
+                          "title": title, "xTitle": xTitle, "yTitle": "Events", "stats": False,
+                          "legend": {"header": "Double strike window"},
+                          "histograms": [{"file": fileName, "name": "window" + window + "ns/" + histName + name, "option": "HIST",
+                                          "lineColor": LINE_COLORS[index % len(LINE_COLORS)], "label": window + " ns"}
+                                         for index, window in enumerate(windows)]})
+
+    return plots
+
+
+def overlayPlots(manifestName=OVERLAY_MANIFEST_NAME):
+
+    # Returns plots overlaying coincidence histograms for single and double scintillator strikes,
+    # made by overlay_double_single_coinc.py
+    return loadManifest(manifestName)
+
+
+def getAllPlots():
+
+    # Returns plots for every analysis output file present
+    plots = []
+    if os.path.isfile(DELAYS_FILE_NAME):
+        plots += delayPlots()
+    if os.path.isfile(SINGLE_COINCIDENCE_FILE_NAME):
+        plots += coincidencePlots(SINGLE_COINCIDENCE_FILE_NAME, "")
+    if os.path.isfile(DOUBLE_COINCIDENCE_FILE_NAME):
+        plots += coincidencePlots(DOUBLE_COINCIDENCE_FILE_NAME, "double_")
+    if os.path.isfile(SINGLE_COINCIDENCE_FILE_NAME) and os.path.isfile(DOUBLE_COINCIDENCE_FILE_NAME):
+        plots += overlayPlots()
+    if os.path.isfile(DOUBLE_WINDOW_SCAN_FILE_NAME):
+        plots += windowScanPlots()
+
+    return plots
+
+
+def readHistograms(entries):
+
+    # Returns list of Histogram read from ROOT files, for each entry giving file and histogram
+    # name, or None if any file or histogram is missing. Each file is opened once
+    hists = []
+    inputFiles = dict()
+    for entry in entries:
+
+        if entry["file"] not in inputFiles:
+            if not os.path.isfile(entry["file"]):
+                return None
+            inputFiles[entry["file"]] = ROOT.TFile.Open(entry["file"], "read")
+
+        rootHist = inputFiles[entry["file"]].Get(entry["name"])
+        if not rootHist:
+            return None
+        hists.append(histograms.Histogram.fromROOT(rootHist))
+
+    for inputFile in inputFiles.values():
+        inputFile.Close()
+
+    return hists
+
+
+def hashPlot(plot):
+
+    # Returns hash of style settings of plot, and contents of its input histograms, or None if any
+    # input histogram is missing
+    plotHash = hashlib.sha1(json.dumps([RENDER_VERSION, plot], sort_keys=True))
+
+    hists = readHistograms(plot["histograms"])
+    if hists is None:
+        return None
+
+    for hist in hists:
+        for array in (hist.contents, hist.sumw2, hist.stats):
+            plotHash.update(array.tostring())
+        plotHash.update(str(hist.entries))
+
+    return plotHash.hexdigest()
+
+
+def renderPlot(plot):
+
+    # Draws plot on a new canvas and prints it to pdf
+    canvas = ROOT.TCanvas(plot["name"], plot["name"], CANVAS_WIDTH, CANVAS_HEIGHT)
+    if "palette" in plot:
+        ROOT.gStyle.SetPalette(plot["palette"])
+
+    # Read each histogram once, and normalise all of them, before making ROOT histograms in double
+    # precision to draw
+    hists = readHistograms(plot["histograms"])
+    histograms.normaliseHistograms(hists, [entry.get("normalise") for entry in plot["histograms"]],
+                                   ["%s in %s" % (entry["name"], entry["file"]) for entry in plot["histograms"]])
+
+    drawn = []
+    for index, (entry, hist) in enumerate(zip(plot["histograms"], hists)):
+
+        rootClass = ROOT.TH1D if hist.getDimension() == 1 else ROOT.TH2D
+        rootHist = hist.toROOT(rootClass, "%s_%d" % (plot["name"], index), entry["name"])
+
+        if "stats" in plot:
+            rootHist.SetStats(plot["stats"])
+        if "minimum" in plot:
+            rootHist.SetMinimum(plot["minimum"])
+        if "lineColor" in entry:
+            rootHist.SetLineColor(entry["lineColor"])
+
+        # Titles are taken from first histogram drawn, and others are drawn over it
+        option = entry.get("option", "HIST")
+        if index == 0:
+            rootHist.SetTitle(plot["title"])
+            rootHist.GetXaxis().SetTitle(plot["xTitle"])
+            rootHist.GetYaxis().SetTitle(plot["yTitle"])
+        elif "SAME" not in option.upper():
+            option += " SAME"
+
+        canvas.cd()
+        rootHist.Draw(option)
+        drawn.append(rootHist)
+
+    # Draw legend, with entry for each histogram with a label
+    if "legend" in plot:
+        legend = ROOT.TLegend(*plot["legend"].get("position", DEFAULT_LEGEND_POSITION))
+        if "header" in plot["legend"]:
+            legend.SetHeader(plot["legend"]["header"])
+        for entry, rootHist in zip(plot["histograms"], drawn):
+            if "label" in entry:
+                legend.AddEntry(rootHist, entry["label"], "l")
+        legend.Draw()
+
+    canvas.Print(plot["output"])
+
+
+def toStrings(value):
+
+    # Returns value read from JSON with unicode strings made str, as PyROOT takes str for names
+    # and titles
+    if isinstance(value, unicode):
+        return str(value)
+    if isinstance(value, list):
+        return [toStrings(item) for item in value]
+    if isinstance(value, dict):
+        return dict((toStrings(key), toStrings(item)) for key, item in value.items())
+    return value
+
+
+def loadManifest(fileName):
+
+    # Returns list of plots described by manifest file. The manifest is a JSON object holding a
+    # list of "plots", each described as for renderPlot, and optional "defaults" for every plot.
+    # Defaults for each histogram can be given as "histogramDefaults" in the defaults or in a plot
+    # (e.g. the file, or the normalisation). Histograms without a line colour are given one from
+    # LINE_COLORS in turn, and plots without a name are named from their output file
+    with open(fileName) as manifestFile:
+        manifest = toStrings(json.load(manifestFile))
+
+    defaults = manifest.get("defaults", dict())
+
+    plots = []
+    for plotSettings in manifest["plots"]:
+
+        plot = dict(defaults)
+        plot.update(plotSettings)
+
+        histogramDefaults = dict(defaults.get("histogramDefaults", dict()))
+        histogramDefaults.update(plotSettings.get("histogramDefaults", dict()))
+        plot.pop("histogramDefaults", None)
+
+        plot["histograms"] = []
+        for index, histogramSettings in enumerate(plotSettings["histograms"]):
+            entry = dict(histogramDefaults)
+            entry.update(histogramSettings)
+            entry.setdefault("lineColor", LINE_COLORS[index % len(LINE_COLORS)])
+            plot["histograms"].append(entry)
+
+        plot.setdefault("name", "c" + os.path.splitext(os.path.basename(plot["output"]))[0])
+        plot.setdefault("title", "")
+        plot.setdefault("xTitle", "")
+        plot.setdefault("yTitle", "")
+        plots.append(plot)
+
+    return plots
+
+
+def readState():
+
+    # Returns hash of inputs of each plot output when last drawn
+    if not os.path.isfile(STATE_FILE_NAME):
+        return dict()
+
+    with open(STATE_FILE_NAME) as stateFile:
+        return json.load(stateFile)
+
+
+def writeState(state):
+
+    # Saves hash of inputs of each plot output
+    with open(STATE_FILE_NAME, "w") as stateFile:
+        json.dump(state, stateFile, indent=2, sort_keys=True)
+
+
+@instrumentation.timed(instrumentation.RENDER)
+def renderPlots(plots, nJobs=1, force=False):
+
+    # Draws each plot whose inputs have changed since it was last drawn (or every plot, if force),
+    # in a pool of nJobs processes
+    state = readState()
+
+    toRender = []
+    hashes = dict()
+    for plot in plots:
+
+        plotHash = hashPlot(plot)
+        if plotHash is None:
+            print "Skipping " + plot["output"] + ": input histograms missing"
+            continue
+
+        if force or (state.get(plot["output"]) != plotHash) or (not os.path.isfile(plot["output"])):
+            toRender.append(plot)
+            hashes[plot["output"]] = plotHash
+
+    print "Drawing %d of %d plots" % (len(toRender), len(plots))
+
+    if (nJobs > 1) and (len(toRender) > 1):
+        pool = multiprocessing.Pool(min(nJobs, len(toRender)))
+        try:
+            pool.map(renderPlot, toRender)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for plot in toRender:
+            renderPlot(plot)
+
+    state.update(hashes)
+    writeState(state)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Draw plots from histograms saved by the analysis scripts")
+    parser.add_argument("--jobs", type=int, default=1, help="number of processes to draw plots in")
+    parser.add_argument("--force", action="store_true", help="draw every plot, even if inputs are unchanged")
+    args = parser.parse_args()
+
+    renderPlots(getAllPlots(), args.jobs, args.force)
@@ -9,134 +9,102 @@
 #
 
 
-import ROOT
-
-# Get input file
-f = ROOT.TFile.Open("Lab3TreeDumper_00695_00696_00697_00698_00699_00702_00706_00707_00708.root", "read")
-
-# Get tree of straw and scintillator strikes
-strawTree = f.Get("professorTreeDumper/strawHits")
-scintTree = f.Get("professorTreeDumper/scintHits")
-
-# Histogram for number of hits for each scintillator
-hScintWireHits = ROOT.TH2D("hScintWireHits", "hScintWireHits", 15, 0, 15, 15, 0, 15)
-hScintWireHits.SetStats(0)
-
-# Histograms for delay times between scintillator hits, with and without 100ns cut.
-hTimeOffsets = ROOT.TH1D("hTimeOffsets", "hTimeOffsets", 100, 0, 100)
-hTimeOffsetsNocut = ROOT.TH1D("hTimeOffsetsNocut", "hTimeOffsetsNocut", 100, 0, 20000000)
-
-# Number of times each scintillator hit in an event
-scint0Hits = 0
-scint1Hits = 0
-
-eventCount = 0 # Number for event
-
-# Number for scint hit in current and previous entry
-previousScintHit = 1000
-currentScintHit = 1000
-
-# Hit time for current and previous entry
-previousHitTime = 0
-currentHitTime = 0
-
-# Run number for current and previous entry
-currentRun = 0
-previousRun = 0
-
-# List of time differences between hits of each scintillator
-delayTimes = []
-
-print scintTree.GetEntries()
-
-# Loop across all entries in tree
-for i in xrange(scintTree.GetEntries()):
+import argparse
 
-    # To show progress
-    if (i % 50000) == 0:
-        print i
-
-    scintTree.GetEntry(i) # Get entry from tree
-    
-    # Set number of scintillator in previous entry, then get number for current entry
-    previousScintHit = currentScintHit
-    currentScintHit = scintTree.Wire
-
-    # Set hit time of scintillator in previous entry, then get time for current entry
-    previousHitTime = currentHitTime
-    currentHitTime = scintTree.HitTime
-
-    previousRun = currentRun
-    currentRun = scintTree.Run
-
-    # Check if this entry covers new event
-    if (scintTree.Event != eventCount):
-        eventCount = scintTree.Event # Get new event number for this entry
-
-        # Check if times between scintillator hits have been recorded for previous event
-        if (len(delayTimes) > 0):
-
-            # If minimum offset time recorded is below 100ns, fill relevent histogram
-            if (min(delayTimes) < 100):
-                hTimeOffsets.Fill(min(delayTimes))
-
-            # Fill histogram with minimum recorded offset time
-            hTimeOffsetsNocut.Fill(min(delayTimes))
-
-        # Fill histogram with number of times each scintillator hit in previous event
-        hScintWireHits.Fill(scint0Hits, scint1Hits) 
-        
-        # Reset number of times each scintillator hit, and list of hit time offsets
-        scint0Hits = 0
-        scint1Hits = 0
-        delayTimes = []
-
-    # Check if not new event, but different scintillator struck to last time, and not new run.
-    elif ((currentScintHit != previousScintHit) & (currentRun == previousRun)):
-             
-        # Append difference between hit time for current and previous scintillator hit to list
-        delayTimes.append(currentHitTime - previousHitTime)
-        
-    # Increment counter for number of times given scintillator hit
-    if (currentScintHit == 0):
-        scint0Hits += 1
-    elif (currentScintHit == 1):
-        scint1Hits += 1
-
-
-# Create canvas for histogram of number of times each scintillator hit, then set colours
-cScintWireHits = ROOT.TCanvas("cScintWireHits", "cScintWireHits", 2000, 1500)
-ROOT.gStyle.SetPalette(53)
+import ROOT
 
-# Set titles
-hScintWireHits.SetTitle("Events with Given Number of Strikes on Each Scintillator")
-hScintWireHits.GetXaxis().SetTitle("Scintillator 0 Strikes")
-hScintWireHits.GetYaxis().SetTitle("Scintillator 1 Strikes")
-
-# Draw histogram with colours, and output to pdf
-hScintWireHits.Draw("colz")
-cScintWireHits.Print("scint_wire_hits.pdf")
-
-# Create canvas for hit time offsets histogram
-cTimeOffsets = ROOT.TCanvas("cTimeOffsets", "cTimeOffsets", 2000, 1500)
-
-# Set titles
-hTimeOffsets.SetTitle("Scintillator Hit Time Offsets Below 100ns")
-hTimeOffsets.GetXaxis().SetTitle("Hit Time Offset / ns")
-hTimeOffsets.GetYaxis().SetTitle("Events")
-
-# Draw histogram, then output
-hTimeOffsets.Draw("HIST")
-cTimeOffsets.Print("time_offsets.pdf")
-
-# Create canvas for hit time offsets histogram without time cut
-cTimeOffsetsNocut = ROOT.TCanvas("cTimeOffsetsNocut", "cTimeOffsetsNocut", 2000, 1500)
-
-# Set titles
-hTimeOffsetsNocut.SetTitle("Scintillator Hit Time OffsetsNocut Below 100ns")
-hTimeOffsetsNocut.GetXaxis().SetTitle("Hit Time Offset / ns")
-hTimeOffsetsNocut.GetYaxis().SetTitle("Events")
-
-# Draw historam, then output
-hTimeOffsetsNocut.Draw("HIST")
-cTimeOffsetsNocut.Print("time_offsets_nocut.pdf")
+import event_index
+import hit_cache
+import hit_reader
+import incremental
+import instrumentation
+import parallel
+import rdf_delays
+import render
+import scint_delays
+from delay_histograms import DelayHistograms
+
+parser = argparse.ArgumentParser(description="Examine scintillator strikes")
+parser.add_argument("--input", default=hit_reader.INPUT_FILE_NAME,
+                    help="input ROOT file, or directory of hit columns (see generate_hits.py)")
+parser.add_argument("--cache", action="store_true",
+                    help="read trees from memory-mapped hit cache, built from input file if missing or out of date")
+parser.add_argument("--runs", type=int, nargs="+",
+                    help="analyse only these runs, reading only their entries (see event_index.py)")
+parser.add_argument("--event-range", type=int, nargs=2, metavar=("FIRST", "LAST"),
+                    help="analyse only events FIRST to LAST (inclusive) of each run, reading only their entries")
+parser.add_argument("--incremental", action="store_true",
+                    help="process trees run by run, reusing results stored for runs already processed (see incremental.py)")
+parser.add_argument("--jobs", type=int, default=1, help="number of processes to split trees across, and to draw plots in")
+parser.add_argument("--backend", choices=["numpy", "rdataframe"], default="numpy",
+                    help="search tree in chunks of NumPy arrays, or in an RDataFrame graph with implicit multithreading (see rdf_delays.py)")
+parser.add_argument("--threads", type=int, default=0,
+                    help="number of threads for RDataFrame backend (all cores if 0)")
+parser.add_argument("--progress", action="store_true", help="show live progress line, with rate and time left")
+parser.add_argument("--report", default="scint_coincidence_delays_report.json",
+                    help="JSON file to write time spent in each stage, and peak memory, to")
+parser.add_argument("--no-render", action="store_true", help="only save histograms, without drawing plots (see render.py)")
+args = parser.parse_args()
+instrumentation.setProgress(args.progress)
+selection = event_index.makeSelection(args.runs, args.event_range)
+
+if args.backend == "rdataframe":
+
+    # Search tree with RDataFrame on all cores, giving the same histograms as the loop below
+    if args.cache or args.incremental or hit_cache.isColumnDirectory(args.input):
+        parser.error("RDataFrame backend reads the ROOT input file directly, without hit cache or incremental processing")
+    if not rdf_delays.isAvailable():
+        parser.error("RDataFrame backend needs a ROOT version with RDataFrame")
+
+    # Selected events are searched by filtering entries to their ranges in the index
+    entryRanges = None
+    if selection is not None:
+        entryRanges = event_index.openTrees(args.input, False, selection)[1].entryRanges
+    delayHistograms = rdf_delays.runDelays(args.input, args.threads, entryRanges=entryRanges)
+
+elif args.incremental:
+
+    # Process each run, or take its histograms from earlier runs of script, and merge histograms
+    delayHistograms = incremental.runDelays(args.input, args.jobs, args.cache, selection)
+
+elif args.jobs > 1:
+
+    # Process parts of tree in separate processes, and merge histograms
+    delayHistograms = parallel.runDelays(args.input, args.jobs, args.cache, selection)
+
+else:
+
+    # Get input file, and tree of straw and scintillator strikes
+    f, scintTree, strawTree = event_index.openTrees(args.input, args.cache, selection)
+
+    # Histograms for number of hits for each scintillator, and delay times between scintillator hits
+    delayHistograms = DelayHistograms()
+
+    # Engine following scintillator hits from one chunk of tree to the next
+    delaysEngine = scint_delays.ScintDelayEngine()
+
+    print scintTree.GetEntries()
+
+    # Loop across all entries in tree, reading a chunk of entries at a time
+    for hits in instrumentation.timeChunks(hit_reader.iterHits(scintTree), instrumentation.SCINT_READ):
+
+        # To show progress
+        instrumentation.progress(hits.firstEntry + len(hits), scintTree.GetEntries())
+
+        # Find hit counts and lowest delay time for each event completed in this chunk, and fill
+        # histograms with them
+        delayHistograms.fill(delaysEngine.process(hits))
+
+
+# Create output file, then write histograms to it
+with instrumentation.stage(instrumentation.HISTOGRAM_WRITE):
+    out_file = ROOT.TFile(render.DELAYS_FILE_NAME, "RECREATE")
+    delayHistograms.write()
+    out_file.Close()
+
+# Draw histograms from output file, and output each to pdf
+if not args.no_render:
+    render.renderPlots(render.delayPlots(), args.jobs)
+
+# Write time spent in each stage, and peak memory, to report
+instrumentation.writeReport(args.report)
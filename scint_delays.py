@@ -0,0 +1,147 @@
+#
+# Array-based engine for scint_coincidence_delays.py.
+# For each event recording period, counts the hits on each scintillator, and finds the lowest
+# delay between one scintillator being struck and then the other, using whole-array operations on
+# chunks of the scintillator tree rather than a loop over entries.
+#
+
+import numpy
+
+import instrumentation
+
+
+class EventDelays:
+
+    # Class for results of events completed within a chunk of the scintillator tree
+
+    def __init__(self, scint0Hits, scint1Hits, minDelays, hasDelay):
+
+        # Get number of hits on each scintillator for each event, lowest delay time for each
+        # event, and whether any delay was recorded for each event
+        self.scint0Hits = scint0Hits
+        self.scint1Hits = scint1Hits
+        self.minDelays = minDelays
+        self.hasDelay = hasDelay
+
+    # Returns number of completed events
+    def __len__(self):
+        return len(self.scint0Hits)
+
+    def fill(self, hScintWireHits, hTimeOffsets, hTimeOffsetsNocut):
+
+        # Fill histogram with number of times each scintillator hit in each event
+        hScintWireHits.fill(self.scint0Hits, self.scint1Hits)
+
+        # Fill histograms with minimum recorded offset time, for events with offsets recorded,
+        # and with those below 100ns
+        minDelays = self.minDelays[self.hasDelay]
+        hTimeOffsets.fill(minDelays[minDelays < 100])
+        hTimeOffsetsNocut.fill(minDelays)
+
+
+def noEventDelays(timeType=numpy.float64):
+
+    # Returns EventDelays holding no events
+    return EventDelays(numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64),
+                       numpy.zeros(0, dtype=timeType), numpy.zeros(0, dtype=bool))
+
+
+class ScintDelayEngine:
+
+    # Class following the scintillator tree chunk by chunk. Gives the same results as the loop
+    # originally in scint_coincidence_delays.py: a new event starts whenever the event number
+    # changes, and the event still open at the end of the tree is never filled.
+    # To process part of the tree starting at a change of event number, pass openEvent=False, so
+    # no event is open before the first hit, and call finish() at the end of the part to get the
+    # event the next part of the tree would complete
+
+    def __init__(self, openEvent=True):
+
+        # Values for entry before first entry in tree
+        self.previousWire = 1000
+        self.previousHitTime = 0
+        self.previousRun = 0
+        self.eventCount = 0
+
+        # Whether results for event open before first hit are returned
+        self.openEvent = openEvent
+
+        # Hit counts and lowest delay for event still open at end of last chunk
+        self.scint0Hits = 0
+        self.scint1Hits = 0
+        self.minDelay = None
+
+    @instrumentation.timed(instrumentation.DELAY_SEARCH)
+    def process(self, hits):
+
+        # Returns EventDelays for events completed by this chunk of hits
+        if len(hits) == 0:
+            return noEventDelays(hits.hitTime.dtype)
+
+        # Values for entry before each entry, carried over from last chunk for first entry
+        previousWire = numpy.concatenate(([self.previousWire], hits.wire[:-1]))
+        previousHitTime = numpy.concatenate(([self.previousHitTime], hits.hitTime[:-1])).astype(hits.hitTime.dtype)
+        previousRun = numpy.concatenate(([self.previousRun], hits.run[:-1]))
+        if self.openEvent:
+            previousEvent = numpy.concatenate(([self.eventCount], hits.event[:-1]))
+        else:
+            previousEvent = numpy.concatenate(([hits.event[0] - 1], hits.event[:-1]))
+
+        # Entries starting new event, and entries giving delay time (not new event, but different
+        # scintillator struck to last time, and not new run)
+        newEvent = hits.event != previousEvent
+        isDelay = (~newEvent) & (hits.wire != previousWire) & (hits.run == previousRun)
+
+        # Number of event each entry belongs to. Event 0 is the one open at end of last chunk, and
+        # events 0 to nCompleted - 1 are completed by this chunk
+        eventIndex = numpy.cumsum(newEvent)
+        nCompleted = eventIndex[-1]
+        nEvents = nCompleted + 1
+
+        # Number of times each scintillator hit in each event
+        scint0Hits = numpy.bincount(eventIndex[hits.wire == 0], minlength=nEvents)
+        scint1Hits = numpy.bincount(eventIndex[hits.wire == 1], minlength=nEvents)
+        scint0Hits[0] += self.scint0Hits
+        scint1Hits[0] += self.scint1Hits
+
+        # Lowest delay time in each event, reduced over each run of delays from same event
+        delayEvents = eventIndex[isDelay]
+        delays = (hits.hitTime - previousHitTime)[isDelay]
+        minDelays = numpy.zeros(nEvents, dtype=delays.dtype)
+        hasDelay = numpy.zeros(nEvents, dtype=bool)
+
+        if len(delays) > 0:
+            starts = numpy.flatnonzero(numpy.concatenate(([True], delayEvents[1:] != delayEvents[:-1])))
+            minDelays[delayEvents[starts]] = numpy.minimum.reduceat(delays, starts)
+            hasDelay[delayEvents[starts]] = True
+
+        if self.minDelay is not None:
+            if (not hasDelay[0]) or (self.minDelay < minDelays[0]):
+                minDelays[0] = self.minDelay
+            hasDelay[0] = True
+
+        # Keep values for last entry, and results for event left open, for next chunk
+        self.previousWire = hits.wire[-1]
+        self.previousHitTime = hits.hitTime[-1]
+        self.previousRun = hits.run[-1]
+        self.eventCount = hits.event[-1]
+        self.scint0Hits = scint0Hits[nCompleted]
+        self.scint1Hits = scint1Hits[nCompleted]
+        self.minDelay = minDelays[nCompleted] if hasDelay[nCompleted] else None
+
+        # Skip results for event before first hit, if none was open
+        firstCompleted = 0 if self.openEvent else 1
+        self.openEvent = True
+
+        return EventDelays(scint0Hits[firstCompleted:nCompleted], scint1Hits[firstCompleted:nCompleted],
+                           minDelays[firstCompleted:nCompleted], hasDelay[firstCompleted:nCompleted])
+
+    def finish(self):
+
+        # Returns EventDelays for event still open, as if the next hit started a new event
+        if not self.openEvent:
+            return noEventDelays()
+
+        minDelay = self.minDelay if self.minDelay is not None else 0
+        return EventDelays(numpy.array([self.scint0Hits]), numpy.array([self.scint1Hits]),
+                           numpy.array([minDelay]), numpy.array([self.minDelay is not None]))
@@ -0,0 +1,237 @@
+#
+# Store for scintillator strikes, and the straw hits coinciding with them, shared by
+# scint_straw_coincidence.py and double_scint_straw_coincidence.py.
+# Strikes are held as a table of typed arrays (run, event, hit time, wire), and each cluster of
+# coinciding straw hits as an offset and length into shared arrays of straw hit times and wires, so no
+# Python object is kept per strike or per straw hit. ScintStrike and StrawHitCluster objects are
+# thin views onto the table, made on request.
+#
+
+import numpy
+
+import coincidence_engine
+
+
+class StrawHitCluster:
+
+    # View of cluster of straw hits coinciding with one scintillator strike
+
+    def __init__(self, strawHitTimes, strawWires, first, count):
+
+        # Get shared arrays of straw hit times and wires, and offset and number of hits for this
+        # cluster
+        self.strawHitTimes = strawHitTimes
+        self.strawWires = strawWires
+        self.first = first
+        self.count = count
+
+    # Return number of hit straws in cluster
+    def getStrawCount(self):
+        return self.count
+
+    # Return array of hit times
+    def getHitTimes(self):
+        return self.strawHitTimes[self.first:self.first + self.count]
+
+    # Return array of wire numbers of hit straws
+    def getWires(self):
+        return self.strawWires[self.first:self.first + self.count]
+
+
+
+class ScintStrike:
+
+    # View of strike of scintillator (either one), at given row of strike collection
+
+    def __init__(self, collection, index):
+        self.collection = collection
+        self.index = index
+
+    # Returns run number for strike
+    def getRun(self):
+        return int(self.collection.runs[self.index])
+
+    # Returns event number for strike
+    def getEvent(self):
+        return int(self.collection.events[self.index])
+
+    # Returns hit time
+    def getHitTime(self):
+        return self.collection.hitTimes[self.index].item()
+
+    # Returns wire number of scintillator struck
+    def getWire(self):
+        return int(self.collection.wires[self.index])
+
+    # Returns collection of straw hits with given delay cut
+    def getStrawHitCluster(self, cutTime):
+        return self.collection.getStrawHitCluster(self.index, cutTime)
+
+    # Returns collection of straw hits with longest delay cut
+    def getStrawHitClusterLongCut(self):
+        return self.collection.getStrawHitCluster(self.index, max(self.collection.getCutTimes()))
+
+    # Returns collection of straw hits with shortest delay cut
+    def getStrawHitClusterShortCut(self):
+        return self.collection.getStrawHitCluster(self.index, min(self.collection.getCutTimes()))
+
+
+class ScintStrikeCollection:
+
+    # Class for collection of scintillator strikes. Strikes are sorted by an integer key made from
+    # run number and event number, and the strikes for each key are found from a list of offsets
+    # into the sorted strikes
+
+    def __init__(self):
+
+        # Strikes added one at a time, and blocks of strikes added as arrays, not yet in table
+        self.pendingStrikes = ([], [], [], [])
+        self.strikeBlocks = []
+
+        # Table of strikes sorted by key: run number, event number, hit time and wire number
+        self.runs = numpy.zeros(0, dtype=numpy.int32)
+        self.events = numpy.zeros(0, dtype=numpy.int32)
+        self.hitTimes = numpy.zeros(0, dtype=numpy.float64)
+        self.wires = numpy.zeros(0, dtype=numpy.int32)
+
+        # Distinct keys in table, and offset of first strike for each key (plus one past last strike)
+        self.eventKeys = numpy.zeros(0, dtype=numpy.int64)
+        self.eventOffsets = numpy.zeros(1, dtype=numpy.int64)
+
+        # Shared arrays of straw hit times and wires, and for each cut, offset and number of straw
+        # hits in cluster for each strike
+        self.strawHitTimes = numpy.zeros(0, dtype=numpy.float64)
+        self.strawWires = numpy.zeros(0, dtype=numpy.int64)
+        self.clusterFirst = dict()
+        self.clusterCounts = dict()
+
+    def addStrike(self, run, event, hitTime, wire):
+
+        # Append single strike to those waiting to be added to table
+        for column, value in zip(self.pendingStrikes, (run, event, hitTime, wire)):
+            column.append(value)
+
+    def addStrikes(self, runs, events, hitTimes, wires):
+
+        # Append arrays of strikes to those waiting to be added to table, after any single strikes
+        self.flushPendingStrikes()
+        if len(runs) > 0:
+            self.strikeBlocks.append((runs, events, hitTimes, wires))
+
+    def flushPendingStrikes(self):
+
+        # Moves single strikes into a block of arrays
+        if len(self.pendingStrikes[0]) > 0:
+            self.strikeBlocks.append(tuple(numpy.array(column) for column in self.pendingStrikes))
+            self.pendingStrikes = ([], [], [], [])
+
+    def buildIndex(self):
+
+        # Adds any waiting strikes to table, and sorts table by run and event
+        self.flushPendingStrikes()
+        if len(self.strikeBlocks) == 0:
+            return
+
+        # Join table with waiting strikes
+        blocks = self.strikeBlocks
+        if len(self.runs) > 0:
+            blocks = [(self.runs, self.events, self.hitTimes, self.wires)] + blocks
+        self.strikeBlocks = []
+
+        runs, events, hitTimes, wires = [numpy.concatenate([block[i] for block in blocks]) for i in xrange(4)]
+        runs = runs.astype(numpy.int32)
+        events = events.astype(numpy.int32)
+        wires = wires.astype(numpy.int32)
+
+        # Sort strikes by key. Sort is stable, so strikes for the same event keep the order added
+        keys = coincidence_engine.eventKeys(runs, events)
+        order = numpy.argsort(keys, kind="mergesort")
+
+        self.runs = runs[order]
+        self.events = events[order]
+        self.hitTimes = hitTimes[order]
+        self.wires = wires[order]
+
+        # Offsets of first strike for each distinct key
+        self.eventKeys, eventOffsets = numpy.unique(keys[order], return_index=True)
+        self.eventOffsets = numpy.append(eventOffsets, len(keys))
+
+        # Clusters found for earlier strikes no longer line up with table
+        self.clusterFirst = dict()
+        self.clusterCounts = dict()
+
+    # Returns number of strikes
+    def __len__(self):
+        self.buildIndex()
+        return len(self.runs)
+
+    # Returns view of strike at given row of table
+    def getStrike(self, index):
+        return ScintStrike(self, index)
+
+    def getStrikes(self, run, event):
+
+        self.buildIndex()
+
+        key = coincidence_engine.eventKey(run, event) # Generate key from run, event numbers
+
+        # If key in index, return list of strikes, else return empty list
+        i = numpy.searchsorted(self.eventKeys, key)
+        if (i < len(self.eventKeys)) and (self.eventKeys[i] == key):
+            return [ScintStrike(self, index) for index in xrange(self.eventOffsets[i], self.eventOffsets[i + 1])]
+        else:
+            return []
+
+    # Returns list of views of all strikes, sorted by run and event
+    def getAllStrikes(self):
+        return [ScintStrike(self, index) for index in xrange(len(self))]
+
+    def getArrays(self):
+
+        # Returns arrays of run number, event number and hit time for all strikes, sorted by run
+        # and event
+        self.buildIndex()
+        return self.runs, self.events, self.hitTimes
+
+    def setStrawHits(self, strawHitTimes, strawWires):
+
+        # Sets shared arrays of straw hit times and wires which clusters index into
+        self.strawHitTimes = strawHitTimes
+        self.strawWires = strawWires
+        self.clusterFirst = dict()
+        self.clusterCounts = dict()
+
+    def setStrawClusters(self, cutTime, first, last):
+
+        # Sets cluster for each strike with given cut time, from first and last (exclusive) index
+        # of its straw hits in shared arrays
+        self.clusterFirst[cutTime] = numpy.asarray(first, dtype=numpy.int64)
+        self.clusterCounts[cutTime] = (numpy.asarray(last) - self.clusterFirst[cutTime]).astype(numpy.int32)
+
+    # Returns sorted list of cut times with clusters set
+    def getCutTimes(self):
+        return sorted(self.clusterCounts)
+
+    # Returns view of cluster for strike at given row of table, with given cut time
+    def getStrawHitCluster(self, index, cutTime):
+        return StrawHitCluster(self.strawHitTimes, self.strawWires, self.clusterFirst[cutTime][index],
+                               self.clusterCounts[cutTime][index])
+
+    # Returns number of straw hits in cluster for each strike, with given cut time
+    def getStrawCounts(self, cutTime):
+        return self.clusterCounts[cutTime]
+
+    def getStrawDelays(self, cutTime):
+
+        # Returns delay of each straw hit after its strike, for all clusters with given cut time,
+        # in order of strike
+        strawIndex, strikeIndex = coincidence_engine.expandRanges(self.clusterFirst[cutTime],
+                                                                  self.clusterCounts[cutTime])
+        return self.strawHitTimes[strawIndex] - self.hitTimes[strikeIndex]
+
+    def getStrawWires(self, cutTime):
+
+        # Returns wire of each straw hit, for all clusters with given cut time, in order of strike
+        strawIndex, strikeIndex = coincidence_engine.expandRanges(self.clusterFirst[cutTime],
+                                                                  self.clusterCounts[cutTime])
+        return self.strawWires[strawIndex]